@@ -0,0 +1,109 @@
+import logging
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from . import metrics
+from .models import PeriodPrediction, PredictionAccuracy
+from .queries import current_predictions
+
+
+logger = logging.getLogger(__name__)
+
+
+# 预测方法
+METHOD_FIXED = 'fixed'
+METHOD_WEIGHTED = 'weighted'
+METHOD_GRU = 'gru'
+METHOD_GRU_GLOBAL = 'gru_global'
+
+# 实际开始日期与预测相差超过该天数时视为中间漏记了周期，不计入误差
+MAX_MATCH_DAYS = 20
+
+# 用于选择预测方法时，每个方法至少需要的已确认预测数
+MIN_SELECTION_SAMPLES = 3
+
+
+def record_actual(user, start_date, stats):
+    """
+    用户记录了新的经期开始日期：确认当前的第1个预测周期，更新各方法的误差统计
+
+    stats为新增记录之前的统计；返回当时所用方法的误差天数，没有可对比的预测时返回None
+    """
+    if stats.last_start_date is not None and start_date <= stats.last_start_date:
+        # 补录历史记录，不是对当前预测的检验
+        return None
+
+    prediction = current_predictions(user, stats.data_version).filter(cycle_index=1).first()
+    if prediction is None:
+        return None
+
+    error = abs((start_date - prediction.predicted_start).days)
+    if error > MAX_MATCH_DAYS:
+        logger.info("用户%s的实际开始日期与预测相差%s天，不计入误差", user.id, error,
+                    extra={'user_id': user.id, 'error_days': error})
+        return None
+
+    # 各方法的预测开始日期 = 参考日期 + 各自的周期长度，参考日期与当时的预测相同
+    reference = prediction.predicted_start - timedelta(days=prediction.cycle_length)
+    errors = {
+        method: abs((start_date - reference - timedelta(days=cycle_length)).days)
+        for method, cycle_length in prediction.candidates.items()
+    }
+    if prediction.method_key:
+        errors[prediction.method_key] = error
+
+    with transaction.atomic():
+        # 已确认的预测不再被refresh_predictions删除，作为历史保留；并发重复确认时只统计一次
+        confirmed = PeriodPrediction.objects.filter(pk=prediction.pk, is_confirmed=False).update(
+            is_confirmed=True, actual_start=start_date, error_days=error
+        )
+        if not confirmed:
+            return None
+        for method, method_error in errors.items():
+            update_accuracy(user, method, method_error)
+            metrics.PREDICTION_ERRORS.observe(method_error, method=method)
+
+    logger.info("用户%s的预测已确认，误差%s天", user.id, error, extra={
+        'user_id': user.id,
+        'method': prediction.method_key,
+        'error_days': error,
+        'candidate_errors': errors,
+    })
+    return error
+
+
+def update_accuracy(user, method, error):
+    """把一次误差累加到用户和全部用户的统计上（原子更新，不读取旧值）"""
+    decay = PredictionAccuracy.ERROR_DECAY
+    for owner in (user, None):
+        accuracy, _ = PredictionAccuracy.objects.get_or_create(user=owner, method=method)
+        PredictionAccuracy.objects.filter(pk=accuracy.pk).update(
+            count=F('count') + 1,
+            error_sum=F('error_sum') + error,
+            weighted_error_sum=F('weighted_error_sum') * decay + error,
+            weight_total=F('weight_total') * decay + 1,
+            last_error=error,
+        )
+
+
+def rolling_errors(user):
+    """用户各方法的(滚动MAE, 已确认预测数)，一次查询"""
+    return {
+        accuracy.method: (accuracy.rolling_mae, accuracy.count)
+        for accuracy in PredictionAccuracy.objects.filter(user=user)
+    }
+
+
+def better_method(errors, preferred, alternative):
+    """
+    preferred和alternative都有足够的已确认预测、且alternative的滚动MAE更小时返回alternative，否则返回preferred
+
+    errors为rolling_errors的结果
+    """
+    if preferred not in errors or alternative not in errors:
+        return preferred
+    preferred_mae, preferred_count = errors[preferred]
+    alternative_mae, alternative_count = errors[alternative]
+    if min(preferred_count, alternative_count) < MIN_SELECTION_SAMPLES:
+        return preferred
+    return alternative if alternative_mae < preferred_mae else preferred
@@ -0,0 +1,132 @@
+import csv
+import json
+from datetime import timedelta
+from django.utils import timezone
+from .models import PeriodPrediction
+from .queries import active_records, user_profile
+
+
+# 每次从数据库读取的行数，导出内存占用只与它有关，与历史长度无关
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'json': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'ics': ('text/calendar; charset=utf-8', 'ics'),
+}
+
+CSV_COLUMNS = ['type', 'start_date', 'end_date', 'is_predicted', 'cycle_length', 'period_length', 'method']
+
+
+class Echo:
+    """csv.writer的写入目标，直接返回写入的内容供生成器产出"""
+
+    def write(self, value):
+        return value
+
+
+def export_records(user):
+    """未删除的记录，按开始日期正序分批读取"""
+    return active_records(user).order_by('start_date').iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def export_predictions(user):
+    """未确认的预测，按预测开始日期正序分批读取"""
+    return PeriodPrediction.objects.filter(user=user, is_confirmed=False).order_by('predicted_start').iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+
+
+def stream_csv(user):
+    """每行一条：profile、record、prediction，type列区分（导入时只读取record行）"""
+    writer = csv.writer(Echo())
+    # 带BOM，Excel打开不乱码
+    yield '\ufeff' + writer.writerow(CSV_COLUMNS)
+
+    profile = user_profile(user)
+    if profile is not None:
+        yield writer.writerow(['profile', '', '', '', profile.cycle_length, profile.period_length, ''])
+    for record in export_records(user):
+        yield writer.writerow(['record', record.start_date, record.end_date, int(record.is_predicted), '', '', ''])
+    for prediction in export_predictions(user):
+        yield writer.writerow(['prediction', prediction.predicted_start, prediction.predicted_end, 1,
+                               prediction.cycle_length or '', '', prediction.method])
+
+
+def stream_ndjson(user):
+    """每行一个JSON对象，type字段区分"""
+    def line(item):
+        return json.dumps(item, ensure_ascii=False) + '\n'
+
+    profile = user_profile(user)
+    if profile is not None:
+        yield line({'type': 'profile', 'cycle_length': profile.cycle_length, 'period_length': profile.period_length})
+    for record in export_records(user):
+        yield line({
+            'type': 'record',
+            'start_date': record.start_date.isoformat(),
+            'end_date': record.end_date.isoformat(),
+            'is_predicted': record.is_predicted,
+        })
+    for prediction in export_predictions(user):
+        yield line({
+            'type': 'prediction',
+            'cycle': prediction.cycle_index,
+            'start_date': prediction.predicted_start.isoformat(),
+            'end_date': prediction.predicted_end.isoformat(),
+            'cycle_length': prediction.cycle_length,
+            'method': prediction.method,
+        })
+
+
+def _ics_event(uid, start, end, summary, category, stamp):
+    # 全天事件，DTEND为结束日期的下一天
+    return (
+        'BEGIN:VEVENT\r\n'
+        f'UID:{uid}\r\n'
+        f'DTSTAMP:{stamp}\r\n'
+        f'DTSTART;VALUE=DATE:{start:%Y%m%d}\r\n'
+        f'DTEND;VALUE=DATE:{end + timedelta(days=1):%Y%m%d}\r\n'
+        f'SUMMARY:{summary}\r\n'
+        f'CATEGORIES:{category}\r\n'
+        'END:VEVENT\r\n'
+    )
+
+
+def stream_ics(user):
+    """iCalendar：经期记录和预测各为一个全天事件，预测和预测占位记录用CATEGORIES:PREDICTION区分"""
+    stamp = timezone.now().strftime('%Y%m%dT%H%M%SZ')
+    yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//periodai//export//CN\r\nCALSCALE:GREGORIAN\r\n'
+    for record in export_records(user):
+        # 预测占位记录与预测一样标记PREDICTION，导入时不会变成实际记录
+        yield _ics_event(f'record-{record.id}@periodai', record.start_date, record.end_date,
+                         '经期（预测）' if record.is_predicted else '经期',
+                         'PERIOD,PREDICTION' if record.is_predicted else 'PERIOD', stamp)
+    for prediction in export_predictions(user):
+        yield _ics_event(f'prediction-{prediction.id}@periodai', prediction.predicted_start,
+                         prediction.predicted_end, '预测经期', 'PREDICTION', stamp)
+    yield 'END:VCALENDAR\r\n'
+
+
+def chunked(lines, size=EXPORT_CHUNK_SIZE):
+    """把逐行产出合并为每size行一块，减少响应写入次数"""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_export(user, export_format):
+    """按格式分块产出用户的完整历史"""
+    return chunked(STREAMERS[export_format](user))
+
+
+STREAMERS = {
+    'csv': stream_csv,
+    'json': stream_ndjson,
+    'ics': stream_ics,
+}
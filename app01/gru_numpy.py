@@ -0,0 +1,415 @@
+"""纯NumPy的GRU推理引擎
+
+训练仍由TensorFlow完成（见predictor.GRUPeriodPredictor.train_model），训练结束后把
+build_model结构（GRU → GRU → Dense → Dense）的权重和MinMaxScaler参数导出为一个.gru文件，
+请求时只用NumPy做前向计算，不需要加载TensorFlow。
+
+.gru文件格式（小端）：
+    magic b'PGRU' | 格式版本 uint16 | 保留 uint16 | 头部长度 uint32 | 头部JSON | 对齐填充 | 数据区
+头部JSON记录层结构、元数据和每个数组在数据区中的偏移与形状；数组为按64字节对齐的原始float32，
+读取时直接映射文件（np.memmap），不解压也不复制。多个.gru可以打包进一个分片文件（ModelPack）。
+"""
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+
+
+# .gru单文件格式
+ARTIFACT_MAGIC = b'PGRU'
+ARTIFACT_VERSION = 2
+ARTIFACT_EXTENSION = '.gru'
+PACK_MAGIC = b'PGPK'
+PACK_VERSION = 1
+PACK_EXTENSION = '.gpk'
+
+_PREAMBLE = struct.Struct('<4sHHI')
+_ALIGNMENT = 64
+
+_ACTIVATIONS = {
+    'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-x)),
+    'tanh': np.tanh,
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0.0),
+}
+
+
+def _activation_name(activation):
+    name = activation if isinstance(activation, str) else getattr(activation, '__name__', str(activation))
+    if name not in _ACTIVATIONS:
+        raise ValueError(f"不支持的激活函数: {name}")
+    return name
+
+
+def extract_weights(model, scaler):
+    """取出Keras模型各层权重和scaler参数，返回(层结构列表, {数组名: float32数组})"""
+    arrays = {
+        'scaler_min': np.asarray(scaler.min_, dtype=np.float32),
+        'scaler_scale': np.asarray(scaler.scale_, dtype=np.float32),
+    }
+    layers = []
+
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind == 'Dropout':
+            # 推理时Dropout不起作用
+            continue
+
+        index = len(layers)
+        if kind == 'GRU':
+            kernel, recurrent_kernel, bias = layer.get_weights()
+            arrays[f'l{index}_kernel'] = kernel.astype(np.float32)
+            arrays[f'l{index}_recurrent_kernel'] = recurrent_kernel.astype(np.float32)
+            arrays[f'l{index}_bias'] = bias.astype(np.float32)
+            layers.append({
+                'type': 'gru',
+                'units': int(layer.units),
+                'activation': _activation_name(layer.activation),
+                'recurrent_activation': _activation_name(layer.recurrent_activation),
+                'reset_after': bool(layer.reset_after),
+                'return_sequences': bool(layer.return_sequences),
+            })
+        elif kind == 'Dense':
+            kernel, bias = layer.get_weights()
+            arrays[f'l{index}_kernel'] = kernel.astype(np.float32)
+            arrays[f'l{index}_bias'] = bias.astype(np.float32)
+            layers.append({
+                'type': 'dense',
+                'activation': _activation_name(layer.activation),
+            })
+        else:
+            raise ValueError(f"不支持导出的层类型: {kind}")
+    return layers, arrays
+
+
+def _aligned(size):
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def encode_artifact(layers, arrays, metadata=None):
+    """把层结构和权重编码为.gru格式的bytes"""
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {'offset': offset, 'shape': list(array.shape)}
+        offset = _aligned(offset + array.size * 4)
+
+    header = json.dumps({
+        'layers': layers,
+        'arrays': entries,
+        'metadata': metadata or {},
+    }).encode('utf-8')
+    data_start = _aligned(_PREAMBLE.size + len(header))
+
+    buffer = bytearray(data_start + offset)
+    _PREAMBLE.pack_into(buffer, 0, ARTIFACT_MAGIC, ARTIFACT_VERSION, 0, len(header))
+    buffer[_PREAMBLE.size:_PREAMBLE.size + len(header)] = header
+    for name, array in arrays.items():
+        start = data_start + entries[name]['offset']
+        raw = np.ascontiguousarray(array, dtype='<f4').tobytes()
+        buffer[start:start + len(raw)] = raw
+    return bytes(buffer)
+
+
+def _atomic_write(path, data):
+    # 先写临时文件再替换，避免读取方看到写了一半的文件；临时文件名唯一，
+    # 多个进程同时训练同一用户时各写各的，最后一次替换生效
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f"{os.path.basename(path)}.",
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp创建的文件只有属主可读，改为与普通写入一致的权限
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_artifact(model, scaler, path, metadata=None):
+    """把Keras模型导出为.gru文件，返回写入的文件路径"""
+    layers, arrays = extract_weights(model, scaler)
+    if not path.endswith(ARTIFACT_EXTENSION):
+        path = f"{path}{ARTIFACT_EXTENSION}"
+    _atomic_write(path, encode_artifact(layers, arrays, metadata))
+    return path
+
+
+def decode_artifact(buffer, offset=0):
+    """
+    从bytes或np.memmap中解析.gru内容，返回(model, scaler, metadata)
+
+    权重数组是buffer的只读视图，buffer为memmap时不会把文件读入内存
+    """
+    if len(buffer) - offset < _PREAMBLE.size:
+        raise ValueError('模型文件不完整')
+    magic, version, _, header_length = _PREAMBLE.unpack_from(buffer, offset)
+    if magic != ARTIFACT_MAGIC:
+        raise ValueError('不是.gru模型文件')
+    if version != ARTIFACT_VERSION:
+        raise ValueError(f"不支持的模型文件版本: {version}")
+    header_start = offset + _PREAMBLE.size
+    if len(buffer) < header_start + header_length:
+        raise ValueError('模型文件不完整')
+    header = json.loads(bytes(buffer[header_start:header_start + header_length]).decode('utf-8'))
+    data_start = offset + _aligned(_PREAMBLE.size + header_length)
+
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        if len(buffer) < data_start + entry['offset'] + count * 4:
+            raise ValueError('模型文件不完整')
+        arrays[name] = np.frombuffer(
+            buffer, dtype='<f4', count=count, offset=data_start + entry['offset']
+        ).reshape(entry['shape'])
+
+    scaler = NumpyMinMaxScaler(arrays.pop('scaler_min'), arrays.pop('scaler_scale'))
+    return NumpyGRUModel(header['layers'], arrays, header['metadata']), scaler, header['metadata']
+
+
+def read_artifact(path):
+    """通过内存映射读取.gru文件，返回(model, scaler)"""
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    model, scaler, _ = decode_artifact(buffer)
+    return model, scaler
+
+
+class ModelPack:
+    """
+    多个用户的.gru打包在一个分片文件里，减少小文件数量和目录扫描
+
+    文件格式：magic b'PGPK' | 版本 uint16 | 保留 uint16 | 索引长度 uint32 | 索引JSON | 对齐填充 | 数据区
+    索引为{user_id: [在数据区中的偏移, 长度]}，每段.gru按64字节对齐；整个分片以内存映射方式只读打开
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, version, _, index_length = _PREAMBLE.unpack_from(self.buffer, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"{path}不是支持的模型分片文件")
+        index = json.loads(bytes(self.buffer[_PREAMBLE.size:_PREAMBLE.size + index_length]).decode('utf-8'))
+        data_start = _aligned(_PREAMBLE.size + index_length)
+        self.entries = {int(user_id): (data_start + offset, length) for user_id, (offset, length) in index.items()}
+
+    def __contains__(self, user_id):
+        return user_id in self.entries
+
+    def load(self, user_id):
+        """返回(model, scaler)"""
+        model, scaler, _ = decode_artifact(self.buffer, self.entries[user_id][0])
+        return model, scaler
+
+    def artifacts(self):
+        """{user_id: .gru内容bytes}，用于重新打包"""
+        return {user_id: bytes(self.buffer[offset:offset + length])
+                for user_id, (offset, length) in self.entries.items()}
+
+    @staticmethod
+    def write(path, artifacts):
+        """artifacts为{user_id: .gru内容bytes}，写入分片文件，返回文件路径"""
+        offsets = {}
+        offset = 0
+        for user_id, data in artifacts.items():
+            offsets[str(user_id)] = [offset, len(data)]
+            offset = _aligned(offset + len(data))
+
+        index = json.dumps(offsets).encode('utf-8')
+        data_start = _aligned(_PREAMBLE.size + len(index))
+        buffer = bytearray(data_start + offset)
+        _PREAMBLE.pack_into(buffer, 0, PACK_MAGIC, PACK_VERSION, 0, len(index))
+        buffer[_PREAMBLE.size:_PREAMBLE.size + len(index)] = index
+        for user_id, data in artifacts.items():
+            start = data_start + offsets[str(user_id)][0]
+            buffer[start:start + len(data)] = data
+        _atomic_write(path, bytes(buffer))
+        return path
+
+
+class NumpyMinMaxScaler:
+    """MinMaxScaler.transform的NumPy实现：X * scale_ + min_"""
+
+    def __init__(self, min_, scale_):
+        self.min_ = min_
+        self.scale_ = scale_
+
+    def transform(self, X):
+        return np.asarray(X, dtype=np.float32) * self.scale_ + self.min_
+
+    def data_range(self):
+        """拟合时各特征的(最小值, 最大值)，由min_ = -data_min * scale_、scale_ = 1 / (max - min)反推"""
+        scale = np.asarray(self.scale_, dtype=np.float64)
+        data_min = -np.asarray(self.min_, dtype=np.float64) / scale
+        return data_min, data_min + 1.0 / scale
+
+
+class NumpyGRUModel:
+    """与build_model结构一致的前向推理，调用方式与Keras模型相同：model(x, training=False)"""
+
+    def __init__(self, layers, weights, metadata=None):
+        self.layers = layers
+        self.weights = weights
+        self.metadata = metadata or {}
+
+    @classmethod
+    def load(cls, path):
+        """通过内存映射读取.gru文件，返回(model, scaler)"""
+        return read_artifact(path)
+
+    def __call__(self, inputs, training=False):
+        return self.predict(inputs)
+
+    def keras_weights(self):
+        """按Keras model.get_weights()的顺序返回权重列表，用于把导出的模型恢复到build_model上继续训练"""
+        weights = []
+        for index, layer in enumerate(self.layers):
+            names = ['kernel', 'recurrent_kernel', 'bias'] if layer['type'] == 'gru' else ['kernel', 'bias']
+            weights.extend(np.array(self.weights[f'l{index}_{name}']) for name in names)
+        return weights
+
+    def predict(self, inputs, verbose=0):
+        """inputs形状为(batch, timesteps, features)，返回(batch, 1)"""
+        x = np.asarray(inputs, dtype=np.float32)
+        for index, layer in enumerate(self.layers):
+            if layer['type'] == 'gru':
+                x = self._gru(index, layer, x)
+            else:
+                w = self.weights
+                x = _ACTIVATIONS[layer['activation']](x @ w[f'l{index}_kernel'] + w[f'l{index}_bias'])
+        return x
+
+    def _gru(self, index, layer, x):
+        kernel = self.weights[f'l{index}_kernel']
+        recurrent_kernel = self.weights[f'l{index}_recurrent_kernel']
+        bias = self.weights[f'l{index}_bias']
+        units = layer['units']
+        activation = _ACTIVATIONS[layer['activation']]
+        recurrent_activation = _ACTIVATIONS[layer['recurrent_activation']]
+
+        if layer['reset_after']:
+            input_bias, recurrent_bias = bias[0], bias[1]
+        else:
+            input_bias, recurrent_bias = bias, None
+
+        batch, timesteps, _ = x.shape
+        # 输入部分与时间步无关，一次性算完所有时间步
+        x_proj = x @ kernel + input_bias
+        h = np.zeros((batch, units), dtype=np.float32)
+        outputs = []
+
+        for t in range(timesteps):
+            x_z, x_r, x_h = np.split(x_proj[:, t, :], 3, axis=-1)
+            if layer['reset_after']:
+                h_proj = h @ recurrent_kernel + recurrent_bias
+                h_z, h_r, h_h = np.split(h_proj, 3, axis=-1)
+                z = recurrent_activation(x_z + h_z)
+                r = recurrent_activation(x_r + h_r)
+                hh = activation(x_h + r * h_h)
+            else:
+                h_z = h @ recurrent_kernel[:, :units]
+                h_r = h @ recurrent_kernel[:, units:2 * units]
+                z = recurrent_activation(x_z + h_z)
+                r = recurrent_activation(x_r + h_r)
+                hh = activation(x_h + (r * h) @ recurrent_kernel[:, 2 * units:])
+            h = z * h + (1.0 - z) * hh
+            outputs.append(h)
+
+        if layer['return_sequences']:
+            return np.stack(outputs, axis=1)
+        return h
+
+
+def max_abs_error(keras_model, numpy_model, n_features, samples=64, seed=0):
+    """在[0, 1]区间的随机输入上比较两种实现，返回最大绝对误差"""
+    rng = np.random.default_rng(seed)
+    x = rng.random((samples, 1, n_features), dtype=np.float32)
+    expected = np.asarray(keras_model(x, training=False))
+    actual = numpy_model.predict(x)
+    return float(np.max(np.abs(expected - actual)))
+
+
+class StackedGRUModel:
+    """把多个结构相同的用户模型的权重堆叠起来，一次前向计算得到所有用户的结果
+
+    第n个输入样本只使用第n个模型的权重，输入形状为(n_models, timesteps, features)
+    """
+
+    def __init__(self, models, scalers):
+        first = models[0]
+        self.layers = first.layers
+        self.weights = {
+            key: np.stack([model.weights[key] for model in models])
+            for key in first.weights
+        }
+        self.scaler_min = np.stack([scaler.min_ for scaler in scalers])
+        self.scaler_scale = np.stack([scaler.scale_ for scaler in scalers])
+
+    @staticmethod
+    def group_key(model):
+        """结构和权重形状都相同的模型才能堆叠"""
+        shapes = sorted((key, value.shape) for key, value in model.weights.items())
+        return json.dumps(model.layers, sort_keys=True), tuple(shapes)
+
+    def transform(self, X):
+        """逐用户做MinMax缩放，X形状为(n_models, features)"""
+        return np.asarray(X, dtype=np.float32) * self.scaler_scale + self.scaler_min
+
+    def predict(self, inputs):
+        x = np.asarray(inputs, dtype=np.float32)
+        for index, layer in enumerate(self.layers):
+            if layer['type'] == 'gru':
+                x = self._gru(index, layer, x)
+            else:
+                kernel = self.weights[f'l{index}_kernel']
+                bias = self.weights[f'l{index}_bias']
+                if x.ndim == 3:
+                    x = np.einsum('nti,nij->ntj', x, kernel) + bias[:, None, :]
+                else:
+                    x = np.einsum('ni,nij->nj', x, kernel) + bias
+                x = _ACTIVATIONS[layer['activation']](x)
+        return x
+
+    def _gru(self, index, layer, x):
+        kernel = self.weights[f'l{index}_kernel']
+        recurrent_kernel = self.weights[f'l{index}_recurrent_kernel']
+        bias = self.weights[f'l{index}_bias']
+        units = layer['units']
+        activation = _ACTIVATIONS[layer['activation']]
+        recurrent_activation = _ACTIVATIONS[layer['recurrent_activation']]
+
+        if layer['reset_after']:
+            input_bias, recurrent_bias = bias[:, 0], bias[:, 1]
+        else:
+            input_bias, recurrent_bias = bias, None
+
+        n_models, timesteps, _ = x.shape
+        x_proj = np.einsum('ntf,nfk->ntk', x, kernel) + input_bias[:, None, :]
+        h = np.zeros((n_models, units), dtype=np.float32)
+        outputs = []
+
+        for t in range(timesteps):
+            x_z, x_r, x_h = np.split(x_proj[:, t, :], 3, axis=-1)
+            if layer['reset_after']:
+                h_proj = np.einsum('nu,nuk->nk', h, recurrent_kernel) + recurrent_bias
+                h_z, h_r, h_h = np.split(h_proj, 3, axis=-1)
+                z = recurrent_activation(x_z + h_z)
+                r = recurrent_activation(x_r + h_r)
+                hh = activation(x_h + r * h_h)
+            else:
+                h_z = np.einsum('nu,nuk->nk', h, recurrent_kernel[:, :, :units])
+                h_r = np.einsum('nu,nuk->nk', h, recurrent_kernel[:, :, units:2 * units])
+                z = recurrent_activation(x_z + h_z)
+                r = recurrent_activation(x_r + h_r)
+                hh = activation(x_h + np.einsum('nu,nuk->nk', r * h, recurrent_kernel[:, :, 2 * units:]))
+            h = z * h + (1.0 - z) * hh
+            outputs.append(h)
+
+        if layer['return_sequences']:
+            return np.stack(outputs, axis=1)
+        return h
@@ -0,0 +1,235 @@
+import csv
+import io
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from django.db import transaction
+from .models import PeriodRecord
+from .policy import evaluate_retraining
+from .predictor import refresh_predictions
+from .queries import active_records
+from .stats import rebuild_cycle_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+# 单次导入的最大记录数（约80年），防止误传超大文件
+MAX_IMPORT_RECORDS = 1000
+
+# 与add_period_end一致，经期最长14天
+MAX_PERIOD_DAYS = 14
+
+IMPORT_FORMATS = ('csv', 'json', 'ics')
+
+
+def detect_format(filename):
+    """根据文件扩展名判断导入格式"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('ical', 'ifb', 'icalendar'):
+        return 'ics'
+    if extension == 'ndjson':
+        return 'json'
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def _parse_date(value, where):
+    try:
+        return datetime.strptime(str(value).strip(), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"{where}: 日期格式应为YYYY-MM-DD，实际为“{value}”")
+
+
+def _is_true(value):
+    # 导出的is_predicted：CSV为1/0，JSON为true/false
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def parse_csv(text):
+    """CSV：表头需包含start_date，end_date可选；有type列时只读取record行"""
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or 'start_date' not in reader.fieldnames:
+        raise ValueError('CSV缺少start_date列')
+
+    rows = []
+    for line_number, row in enumerate(reader, start=2):
+        # 导出文件中还有profile、prediction行以及预测占位记录，只导入实际记录
+        if (row.get('type') or 'record') != 'record' or _is_true(row.get('is_predicted')):
+            continue
+        start = _parse_date(row['start_date'], f"第{line_number}行")
+        end = row.get('end_date')
+        rows.append((start, _parse_date(end, f"第{line_number}行") if end and end.strip() else None))
+    return rows
+
+
+def parse_json(text):
+    """JSON：记录列表、{"records": [...]}（与导出格式一致）或每行一个记录的NDJSON"""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        # 按NDJSON逐行解析
+        data = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                data.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise ValueError(f"第{line_number}行不是有效的JSON")
+    else:
+        if isinstance(data, dict):
+            # 有records键的是导出格式的外层对象，否则是只有一行的NDJSON
+            data = data['records'] if 'records' in data else [data]
+    if not isinstance(data, list):
+        raise ValueError('JSON应为记录列表或包含records列表的对象')
+
+    rows = []
+    for index, item in enumerate(data, start=1):
+        if not isinstance(item, dict):
+            raise ValueError(f"第{index}条记录应为JSON对象")
+        # NDJSON导出中还有profile、prediction行以及预测占位记录，只导入实际记录
+        if item.get('type', 'record') != 'record' or _is_true(item.get('is_predicted')):
+            continue
+        if 'start_date' not in item:
+            raise ValueError(f"第{index}条记录缺少start_date")
+        end = item.get('end_date')
+        rows.append((_parse_date(item['start_date'], f"第{index}条记录"),
+                     _parse_date(end, f"第{index}条记录") if end else None))
+    return rows
+
+
+def _parse_ics_date(value, where):
+    # DTSTART;VALUE=DATE:20240101 或 DTSTART:20240101T000000Z，只取日期部分
+    try:
+        return datetime.strptime(value.split(':', 1)[-1].strip()[:8], '%Y%m%d').date()
+    except ValueError:
+        raise ValueError(f"{where}: 无法识别的日期“{value}”")
+
+
+def parse_ics(text):
+    """iCalendar：每个VEVENT为一次经期，全天事件的DTEND不包含在内"""
+    # 展开折行（以空格或制表符开头的行是上一行的延续）
+    lines = []
+    for line in text.splitlines():
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        else:
+            lines.append(line)
+
+    rows = []
+    event = None
+    for line in lines:
+        name = line.split(':', 1)[0].split(';', 1)[0].upper()
+        if line.strip().upper() == 'BEGIN:VEVENT':
+            event = {}
+        elif line.strip().upper() == 'END:VEVENT' and event is not None:
+            # 导出的预测事件和预测占位记录不作为记录导入
+            if 'PREDICTION' in event.get('CATEGORIES', '').upper():
+                event = None
+                continue
+            where = f"第{len(rows) + 1}个事件"
+            if 'DTSTART' not in event:
+                raise ValueError(f"{where}缺少DTSTART")
+            start = _parse_ics_date(event['DTSTART'], where)
+            end = None
+            if 'DTEND' in event:
+                end = _parse_ics_date(event['DTEND'], where) - timedelta(days=1)
+                end = max(end, start)
+            rows.append((start, end))
+            event = None
+        elif event is not None and name in ('DTSTART', 'DTEND', 'CATEGORIES'):
+            event[name] = line
+    return rows
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'json': parse_json,
+    'ics': parse_ics,
+}
+
+
+def parse_records(content, import_format):
+    """把上传内容解析为[(开始日期, 结束日期或None)]"""
+    if import_format not in PARSERS:
+        raise ValueError(f"不支持的导入格式：{import_format}，可选 {', '.join(IMPORT_FORMATS)}")
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    rows = PARSERS[import_format](content)
+    if len(rows) > MAX_IMPORT_RECORDS:
+        raise ValueError(f"单次最多导入{MAX_IMPORT_RECORDS}条记录")
+    return rows
+
+
+def validate_records(user, rows, period_length):
+    """
+    一次遍历校验待导入记录，返回(待创建的PeriodRecord列表, 跳过的重复数, 错误列表)
+
+    与已有记录开始日期相同的视为重复导入，直接跳过；其余与已有记录或彼此重叠的记录报错
+    """
+    existing = list(active_records(user).values_list('start_date', 'end_date'))
+    existing_starts = {start for start, _ in existing}
+
+    errors = []
+    skipped = 0
+    incoming = []
+    for start, end in rows:
+        if end is None:
+            end = start + timedelta(days=period_length - 1)
+        if end < start:
+            errors.append(f"{start}: 结束日期{end}早于开始日期")
+        elif (end - start).days > MAX_PERIOD_DAYS:
+            errors.append(f"{start}: 经期持续时间过长（{(end - start).days + 1}天）")
+        elif start in existing_starts:
+            skipped += 1
+        else:
+            incoming.append((start, end))
+
+    # 新旧记录合并后按开始日期排序，只需与结束最晚的前一条比较即可发现所有重叠
+    intervals = sorted([(start, end, False) for start, end in existing] +
+                       [(start, end, True) for start, end in incoming])
+    previous = None  # 目前为止结束最晚的记录
+    for start, end, is_new in intervals:
+        # 已有记录之间的重叠不属于本次导入，忽略
+        if previous is not None and start <= previous[1] and (is_new or previous[2]):
+            errors.append(f"{start}~{end}: 与{previous[0]}~{previous[1]}的记录重叠")
+        if previous is None or end > previous[1]:
+            previous = (start, end, is_new)
+
+    records = [
+        PeriodRecord(user=user, start_date=start, end_date=end, is_predicted=False)
+        for start, end in incoming
+    ]
+    return records, skipped, errors
+
+
+def import_records(user, profile, rows):
+    """
+    校验并批量导入记录，有任何错误时不写入
+
+    全部记录一次bulk_create，之后只重建一次统计、刷新一次预测、最多登记一次GRU训练
+    返回{'imported', 'skipped', 'errors'}
+    """
+    started = time.perf_counter()
+    records, skipped, errors = validate_records(user, rows, profile.period_length)
+    if errors or not records:
+        return {'imported': 0, 'skipped': skipped, 'errors': errors}
+
+    with transaction.atomic():
+        PeriodRecord.objects.bulk_create(records)
+        stats = rebuild_cycle_stats(user)
+
+    # 先由重训练策略决定是否登记训练，刷新预测时发现没有模型不会再登记第二次
+    evaluate_retraining(user, stats, 'import')
+    refresh_predictions(user, profile, stats)
+
+    logger.info("用户%s导入%s条记录", user.id, len(records), extra={
+        'user_id': user.id,
+        'imported': len(records),
+        'skipped': skipped,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    })
+    return {'imported': len(records), 'skipped': skipped, 'errors': []}
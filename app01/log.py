@@ -0,0 +1,53 @@
+import atexit
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from django.utils.module_loading import import_string
+
+
+# LogRecord自带的属性，其余属性来自调用方的extra，作为结构化字段输出
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行JSON：时间、级别、logger、消息，以及extra中的字段（如elapsed_ms）"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    日志先放入内存队列，由QueueListener后台线程写到目标handler，请求线程不做同步I/O
+
+    在LOGGING中通过'()'使用；target为目标handler类的路径，其余参数传给目标handler
+    """
+
+    def __init__(self, target='logging.StreamHandler', **target_kwargs):
+        super().__init__(queue.SimpleQueue())
+        target_class = import_string(target) if isinstance(target, str) else target
+        self.target = target_class(**target_kwargs)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        # 退出前把队列中剩余的日志写完
+        atexit.register(self.close)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+        super().close()
@@ -0,0 +1,41 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from app01.models import PeriodRecord
+from app01.predictor import gru_predictor
+from app01.training import MIN_GLOBAL_GRU_CYCLES, MIN_GRU_CYCLES
+
+
+class Command(BaseCommand):
+    help = '对所有进入GRU阶段的用户批量预测下一个周期长度（夜间刷新、提醒生成等后台任务使用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='只预测指定用户，可重复传入')
+        parser.add_argument('--quiet', action='store_true', help='只输出吞吐量，不逐个输出结果')
+
+    def handle(self, *args, **options):
+        records = PeriodRecord.objects.filter(is_deleted=False, is_predicted=False).order_by('user_id', 'start_date')
+        if options['users']:
+            records = records.filter(user_id__in=options['users'])
+
+        records_by_user = defaultdict(list)
+        for record in records.iterator():
+            records_by_user[record.user_id].append(record)
+
+        # 与三阶段算法一致，只有7个以上周期的用户使用GRU；有群体模型时3个以上周期即可
+        min_cycles = MIN_GLOBAL_GRU_CYCLES if gru_predictor.has_global_model() else MIN_GRU_CYCLES
+        records_by_user = {
+            user_id: user_records for user_id, user_records in records_by_user.items()
+            if len(user_records) - 1 >= min_cycles
+        }
+
+        stats = {}
+        results = gru_predictor.predict_batch(records_by_user, stats=stats)
+
+        if not options['quiet']:
+            for user_id, cycle_length in sorted(results.items()):
+                self.stdout.write(f"用户{user_id}: {cycle_length}天")
+        self.stdout.write(
+            f"共{stats['users']}个用户，群体模型{stats['global_users']}个，堆叠模型{stats['stacked_groups']}组，"
+            f"耗时{stats['seconds'] * 1000:.1f}ms，吞吐量{stats['users_per_second']:.0f}用户/秒"
+        )
@@ -0,0 +1,104 @@
+import copy
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from app01.views import build_period_days, calendar_window, generate_calendar, mark_calendar
+
+
+SyntheticRecord = namedtuple('SyntheticRecord', ['start_date', 'end_date', 'is_predicted'])
+
+
+def synthetic_history(years, until):
+    """生成截止到until、跨度years年的模拟记录（按开始日期倒序，与PeriodRecord默认排序一致）"""
+    records = []
+    start = until - timedelta(days=int(years * 365))
+    while start < until:
+        records.append(SyntheticRecord(start, start + timedelta(days=4), False))
+        start += timedelta(days=28 + len(records) % 4)
+    records.reverse()
+    return records
+
+
+def reference_marking(calendar_data, records, current_prediction_dates, next_prediction_dates, today):
+    """优化前index的标记方式：展开全部历史，再对每一天逐个扫描"""
+    period_dates = []
+    for record in records:
+        current_date = record.start_date
+        while current_date <= record.end_date:
+            period_dates.append({
+                'date': current_date,
+                'is_predicted': record.is_predicted,
+                'is_confirmed': not record.is_predicted
+            })
+            current_date += timedelta(days=1)
+
+    for week in calendar_data:
+        for day in week:
+            day.update({
+                'is_period': False,
+                'is_predicted_period': False,
+                'is_confirmed_period': False,
+                'is_current_prediction': False,
+                'is_next_prediction': False,
+                'is_today': day['date'] == today,
+                'is_future': day['date'] > today
+            })
+            for period_info in period_dates:
+                if day['date'] == period_info['date']:
+                    day['is_period'] = True
+                    day['is_predicted_period'] = period_info['is_predicted']
+                    day['is_confirmed_period'] = period_info['is_confirmed']
+                    break
+            for pred_date in current_prediction_dates:
+                if day['date'] == pred_date:
+                    day['is_current_prediction'] = True
+                    break
+            for next_pred_date in next_prediction_dates:
+                if day['date'] == next_pred_date:
+                    day['is_next_prediction'] = True
+                    break
+    return calendar_data
+
+
+def current_marking(calendar_data, records, current_prediction_dates, next_prediction_dates, today):
+    """与views.index相同的标记方式：只展开可见范围，按日期查字典/集合"""
+    period_days = build_period_days(records, *calendar_window(calendar_data))
+    return mark_calendar(calendar_data, period_days, current_prediction_dates, next_prediction_dates, today)
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+class Command(BaseCommand):
+    help = '对比日历标记新旧实现在不同历史长度下的耗时（新实现应与历史长度无关）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 20, 40])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        today = date(2025, 6, 15)
+        template = generate_calendar(today.year, today.month)
+        current_prediction = [date(2025, 6, d) for d in range(20, 25)]
+        next_prediction = []
+
+        self.stdout.write(f"{'年数':>6} {'记录数':>8} {'原实现':>12} {'新实现':>12}")
+        for years in options['years']:
+            records = synthetic_history(years, today)
+
+            def run(marking):
+                return marking(copy.deepcopy(template), records, current_prediction, next_prediction, today)
+
+            if run(reference_marking) != run(current_marking):
+                raise CommandError(f"{years}年历史时标记结果不一致")
+
+            old = best_of(lambda: run(reference_marking), options['repeat'])
+            new = best_of(lambda: run(current_marking), options['repeat'])
+            self.stdout.write(f"{years:>6} {len(records):>8} {old * 1000:>10.2f}ms {new * 1000:>10.2f}ms")
@@ -0,0 +1,92 @@
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from app01.predictor import gru_predictor
+
+
+SyntheticRecord = namedtuple('SyntheticRecord', ['start_date'])
+
+
+def reference_create_features(records, sequence_length=6):
+    """向量化之前的逐窗口循环实现，用于校验结果一致并作为基准"""
+    if len(records) < 2:
+        return None, None
+
+    sorted_records = sorted(records, key=lambda x: x.start_date)
+    cycle_lengths = []
+
+    for i in range(1, len(sorted_records)):
+        days_between = (sorted_records[i].start_date - sorted_records[i - 1].start_date).days
+        if 20 <= days_between <= 45:
+            cycle_lengths.append(days_between)
+
+    if len(cycle_lengths) < sequence_length + 1:
+        return None, None
+
+    features = []
+    for i in range(len(cycle_lengths) - sequence_length):
+        sequence = cycle_lengths[i:i + sequence_length]
+        feature_vector = list(sequence)
+        feature_vector.extend([
+            np.mean(sequence), np.std(sequence),
+            min(sequence), max(sequence), np.median(sequence)
+        ])
+        feature_vector.append(sequence[-1] - sequence[-2] if len(sequence) >= 2 else 0)
+        features.append(feature_vector)
+
+    targets = cycle_lengths[sequence_length:]
+    return np.array(features), np.array(targets)
+
+
+def synthetic_records(cycles, seed=0):
+    """生成cycles个周期的模拟记录，夹杂少量超出20-45天范围的异常间隔"""
+    rng = np.random.default_rng(seed)
+    gaps = rng.normal(29, 3, size=cycles).round().astype(int)
+    gaps[rng.random(cycles) < 0.03] = 60
+    start = date(1990, 1, 1)
+    records = [SyntheticRecord(start)]
+    for gap in gaps:
+        start += timedelta(days=int(gap))
+        records.append(SyntheticRecord(start))
+    # 打乱顺序，保留排序开销
+    order = rng.permutation(len(records))
+    return [records[i] for i in order]
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+class Command(BaseCommand):
+    help = '对比create_features向量化实现与原循环实现的耗时，并校验输出完全一致'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                            help='模拟历史的周期数')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'周期数':>8} {'循环实现':>12} {'向量化':>12} {'加速比':>8}")
+        for size in options['sizes']:
+            records = synthetic_records(size)
+
+            expected = reference_create_features(records, gru_predictor.sequence_length)
+            actual = gru_predictor.create_features(records)
+            for old, new in zip(expected, actual):
+                if (old is None) != (new is None) or (
+                        old is not None and (old.dtype != new.dtype or not np.array_equal(old, new))):
+                    raise CommandError(f"{size}个周期时输出不一致")
+
+            loop = best_of(lambda: reference_create_features(records, gru_predictor.sequence_length),
+                           options['repeat'])
+            vectorized = best_of(lambda: gru_predictor.create_features(records), options['repeat'])
+            self.stdout.write(
+                f"{size:>8} {loop * 1000:>10.2f}ms {vectorized * 1000:>10.2f}ms {loop / vectorized:>7.1f}x"
+            )
@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+from django.core.management.base import BaseCommand
+
+
+# 在全新的解释器中执行：初始化Django并导入视图层，统计耗时、峰值内存和已加载的重型模块
+PROBE = """
+import json, os, resource, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import app01.urls
+for name in %(extra)r:
+    __import__(name)
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = [m for m in ('tensorflow', 'keras', 'sklearn', 'joblib') if m in sys.modules]
+print(json.dumps({'seconds': elapsed, 'max_rss_mb': rss_kb / 1024, 'loaded': heavy}))
+"""
+
+SCENARIOS = [
+    ('lazy（当前）', []),
+    ('eager（启动时导入ML库）', ['tensorflow', 'sklearn.preprocessing', 'joblib']),
+]
+
+
+class Command(BaseCommand):
+    help = '测量Django启动并导入视图层的耗时和内存，对比启动时即导入TensorFlow/sklearn的情况'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='每种场景重复次数，取中位数')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'periodai.settings')
+        env.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+
+        for label, extra in SCENARIOS:
+            runs = []
+            for _ in range(options['repeat']):
+                output = subprocess.run(
+                    [sys.executable, '-c', PROBE % {'extra': extra}],
+                    env=env, capture_output=True, text=True, check=True,
+                ).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+
+            runs.sort(key=lambda run: run['seconds'])
+            median = runs[len(runs) // 2]
+            loaded = ', '.join(median['loaded']) or '无'
+            self.stdout.write(
+                f"{label}: 导入耗时 {median['seconds'] * 1000:.0f}ms, "
+                f"峰值RSS {median['max_rss_mb']:.0f}MB, 已加载: {loaded}"
+            )
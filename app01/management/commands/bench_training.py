@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from app01.management.commands.bench_features import synthetic_records
+from app01.predictor import GRUPeriodPredictor
+
+
+class Command(BaseCommand):
+    help = '对比每次追加一个周期后增量训练与完整训练的耗时，以及对下一个周期的预测误差'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[12, 24, 60],
+                            help='初始历史的周期数')
+        parser.add_argument('--appends', type=int, default=3, help='依次追加的周期数')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'周期数':>6} {'完整训练':>10} {'增量训练':>10} {'加速比':>7} "
+                          f"{'完整MAE':>8} {'增量MAE':>8}  增量/完整次数")
+        for size in options['sizes']:
+            with tempfile.TemporaryDirectory() as model_dir:
+                self.run_size(size, options['appends'], model_dir)
+
+    def run_size(self, size, appends, model_dir):
+        predictor = GRUPeriodPredictor()
+        predictor.model_dir = model_dir
+        # 多生成一条用于评估最后一次训练后的预测
+        records = sorted(synthetic_records(size + appends + 1), key=lambda r: r.start_date)
+
+        # 两个用户从同一个初始模型出发：1号增量训练，2号每次完整训练
+        predictor.train_model(1, records[:size + 1], incremental=False)
+        shutil.copy(predictor.get_user_model_path(1) + '.gru', predictor.get_user_model_path(2) + '.gru')
+
+        times = {'full': 0.0, 'incremental': 0.0}
+        errors = {'full': [], 'incremental': []}
+        modes = []
+        for step in range(1, appends + 1):
+            prefix = records[:size + 1 + step]
+            for user_id, incremental in ((1, True), (2, False)):
+                started = time.perf_counter()
+                predictor.train_model(user_id, prefix, incremental=incremental)
+                elapsed = time.perf_counter() - started
+                handle = predictor.load_model(user_id)
+                mode = handle.model.metadata['mode']
+                if incremental:
+                    modes.append(mode)
+                times['incremental' if incremental else 'full'] += elapsed
+
+                # 用下一条记录对应的周期评估预测误差
+                X, y = predictor.create_features(records[:size + 2 + step])
+                if X is not None and len(y):
+                    scaled = handle.scaler.transform(X[-1:]).reshape((1, 1, -1))
+                    prediction = float(np.asarray(handle.model(scaled, training=False))[0][0])
+                    errors['incremental' if incremental else 'full'].append(abs(prediction - y[-1]))
+
+        full_mae = np.mean(errors['full']) if errors['full'] else float('nan')
+        incremental_mae = np.mean(errors['incremental']) if errors['incremental'] else float('nan')
+        self.stdout.write(
+            f"{size:>6} {times['full']:>9.2f}s {times['incremental']:>9.2f}s "
+            f"{times['full'] / times['incremental']:>6.1f}x {full_mae:>7.2f}天 {incremental_mae:>7.2f}天  "
+            f"{modes.count('incremental')}/{modes.count('full')}"
+        )
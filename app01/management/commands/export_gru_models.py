@@ -0,0 +1,101 @@
+import glob
+import os
+import re
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = '把旧的用户GRU模型(.h5 + scaler.pkl)转换为.gru，可选打包进分片文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='只转换指定用户，可重复传入；默认转换全部')
+        parser.add_argument('--tolerance', type=float, default=1e-4,
+                            help='NumPy推理与Keras输出允许的最大绝对误差')
+        parser.add_argument('--remove-legacy', action='store_true',
+                            help='转换成功后删除旧格式文件')
+        parser.add_argument('--pack', action='store_true',
+                            help='把全部.gru按用户ID打包进分片文件，并删除已打包的单个文件')
+
+    def handle(self, *args, **options):
+        from app01.predictor import gru_predictor
+
+        users = options['users']
+        if not users:
+            pattern = re.compile(r'user_(\d+)\.h5$')
+            users = sorted({
+                int(match.group(1))
+                for match in map(pattern.search, glob.glob(os.path.join(gru_predictor.model_dir, 'user_*')))
+                if match
+            })
+
+        failed = 0
+        for user_id in users:
+            try:
+                message = self.convert(gru_predictor, user_id, options['tolerance'])
+            except ValueError as e:
+                self.stderr.write(f"用户{user_id}: {e}")
+                failed += 1
+                continue
+            if options['remove_legacy']:
+                gru_predictor.remove_legacy_files(user_id)
+            gru_predictor.model_cache.invalidate(user_id)
+            self.stdout.write(f"用户{user_id}: {message}")
+
+        if options['pack']:
+            self.pack(gru_predictor)
+
+        if failed:
+            raise CommandError(f"{failed}个用户转换失败")
+
+    def convert(self, gru_predictor, user_id, tolerance):
+        from app01.gru_numpy import ARTIFACT_EXTENSION
+
+        model_path = gru_predictor.get_user_model_path(user_id)
+        path = f"{model_path}{ARTIFACT_EXTENSION}"
+        if os.path.exists(path):
+            # 重新训练写入的.gru比旧格式文件新，不能被覆盖
+            return f"已有 {path}，无需转换"
+        if not (os.path.exists(f"{model_path}.h5") and os.path.exists(f"{model_path}_scaler.pkl")):
+            raise ValueError('未找到模型文件，跳过')
+
+        # 读取.h5旧模型需要TensorFlow
+        import joblib
+        import tensorflow as tf
+        from app01.gru_numpy import NumpyGRUModel, max_abs_error, write_artifact
+
+        model = tf.keras.models.load_model(f"{model_path}.h5", compile=False)
+        scaler = joblib.load(f"{model_path}_scaler.pkl")
+        path = write_artifact(model, scaler, model_path, metadata={'user_id': user_id})
+
+        numpy_model, _ = NumpyGRUModel.load(path)
+        error = max_abs_error(model, numpy_model, n_features=len(scaler.scale_))
+        if error > tolerance:
+            os.remove(path)
+            raise ValueError(f"误差{error:.2e}超出容差，已删除导出文件")
+        return f"已导出 {path}（最大误差 {error:.2e}）"
+
+    def pack(self, gru_predictor):
+        """按分片合并已有分片中的模型和单个.gru文件（单个文件更新，优先），写入后删除单个文件"""
+        from app01.gru_numpy import ModelPack
+
+        pattern = re.compile(r'user_(\d+)\.gru$')
+        files_by_shard = defaultdict(dict)
+        for path in glob.glob(os.path.join(gru_predictor.model_dir, 'user_*.gru')):
+            match = pattern.search(path)
+            if match:
+                user_id = int(match.group(1))
+                files_by_shard[gru_predictor.get_pack_path(user_id)][user_id] = path
+
+        for shard_path, files in sorted(files_by_shard.items()):
+            artifacts = ModelPack(shard_path).artifacts() if os.path.exists(shard_path) else {}
+            for user_id, path in files.items():
+                with open(path, 'rb') as f:
+                    artifacts[user_id] = f.read()
+
+            ModelPack.write(shard_path, dict(sorted(artifacts.items())))
+            for user_id, path in files.items():
+                os.remove(path)
+                gru_predictor.model_cache.invalidate(user_id)
+            self.stdout.write(f"{shard_path}: {len(artifacts)}个用户（新增或更新{len(files)}个）")
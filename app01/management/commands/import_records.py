@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from app01.importers import IMPORT_FORMATS, detect_format, import_records, parse_records
+from app01.queries import user_profile
+
+
+class Command(BaseCommand):
+    help = '从CSV/JSON/ICS文件批量导入用户的历史经期记录（校验全部通过才写入）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='用户ID或用户名')
+        parser.add_argument('path', help='导入文件路径')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='文件格式，默认按扩展名判断')
+
+    def handle(self, *args, **options):
+        lookup = {'id': options['user']} if options['user'].isdigit() else {'username': options['user']}
+        try:
+            user = User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"用户{options['user']}不存在")
+
+        profile = user_profile(user)
+        if profile is None:
+            raise CommandError(f"用户{user.username}还没有设置基础信息")
+
+        try:
+            with open(options['path'], 'rb') as f:
+                rows = parse_records(f.read(), options['format'] or detect_format(options['path']))
+            result = import_records(user, profile, rows)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            raise CommandError(str(e))
+
+        for error in result['errors']:
+            self.stderr.write(error)
+        if result['errors']:
+            raise CommandError(f"{len(result['errors'])}条记录未通过校验，未导入任何记录")
+
+        self.stdout.write(f"用户{user.username}: 导入{result['imported']}条，跳过{result['skipped']}条重复记录")
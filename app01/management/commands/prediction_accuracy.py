@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app01.models import PredictionAccuracy
+
+
+class Command(BaseCommand):
+    help = '显示各预测方法已确认预测的误差（平均绝对误差和按时间衰减的滚动误差）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='只显示该用户的统计（默认显示全部用户的汇总）')
+
+    def handle(self, *args, **options):
+        rows = PredictionAccuracy.objects.filter(user_id=options['user']).order_by('method')
+        self.stdout.write(f"{'方法':<12} {'次数':>6} {'MAE':>8} {'滚动MAE':>8} {'最近误差':>8}")
+        for accuracy in rows:
+            last_error = '-' if accuracy.last_error is None else accuracy.last_error
+            self.stdout.write(f"{accuracy.method:<12} {accuracy.count:>6} {accuracy.mae:>7.2f}天 "
+                              f"{accuracy.rolling_mae:>7.2f}天 {last_error:>8}")
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app01.models import TrainingDecision
+from app01.policy import retrain_policy
+
+
+class Command(BaseCommand):
+    help = '删除超过保留天数的重训练决定记录（TrainingDecision），建议每天定时执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'GRU_DECISION_RETENTION_DAYS', 90),
+                            help='保留最近多少天的记录（默认GRU_DECISION_RETENTION_DAYS）')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['days'])
+        # 重训练策略用最近一次train决定的时间判断冷却期，冷却期内的记录不能删除
+        if retention < retrain_policy.min_interval:
+            raise CommandError(f"保留时间不能短于重训练最小间隔（{retrain_policy.min_interval}）")
+
+        cutoff = timezone.now() - retention
+        deleted, _ = TrainingDecision.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(f"已删除{deleted}条{cutoff:%Y-%m-%d %H:%M}之前的重训练决定")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from app01.models import UserCycleStats
+from app01.predictor import GLOBAL_MIN_SAMPLES, gru_predictor
+
+
+class Command(BaseCommand):
+    help = '用全部用户的周期序列离线训练GRU群体模型，之后用户只需在预测时校准，不再单独训练模型'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--epochs', type=int, default=100, help='最大训练轮数（带早停）')
+        parser.add_argument('--no-refresh', action='store_true',
+                            help='不使已保存的预测失效（默认递增所有用户的数据版本，下次访问时用新模型重新预测）')
+
+    def handle(self, *args, **options):
+        sequences = UserCycleStats.objects.values_list('cycle_lengths', flat=True).iterator(chunk_size=2000)
+        if not gru_predictor.train_global_model(sequences, epochs=options['epochs']):
+            raise CommandError(f"样本不足{GLOBAL_MIN_SAMPLES}个，未训练群体模型")
+        self.stdout.write(f"群体模型已保存到 {gru_predictor.get_global_model_path()}")
+
+        if not options['no_refresh']:
+            updated = UserCycleStats.objects.update(data_version=F('data_version') + 1)
+            self.stdout.write(f"已使{updated}个用户的预测失效")
@@ -0,0 +1,159 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+
+# 默认的耗时分桶（秒），覆盖从缓存命中到模型训练的范围
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+# 当前请求各阶段的累计耗时，由ServerTimingMiddleware开启；不在请求中时为None
+_request_timings = ContextVar('request_timings', default=None)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """按固定分桶统计观测值的分布（与Prometheus直方图一致：桶为累计计数）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # 标签 -> [各桶计数..., 总和, 次数]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {series[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}'
+
+
+def render():
+    """全部指标的Prometheus文本格式"""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram('periodai_stage_seconds', '预测和页面各阶段耗时（秒）', ['stage'])
+REQUEST_SECONDS = Histogram('periodai_request_seconds', '请求总耗时（秒）', ['view', 'method'])
+REQUESTS = Counter('periodai_requests', '请求数', ['view', 'method', 'status'])
+DB_QUERIES = Counter('periodai_db_queries', '数据库查询数', ['view'])
+CACHE_EVENTS = Counter('periodai_cache_events', '缓存命中/未命中次数', ['cache', 'result'])
+PREDICTIONS = Counter('periodai_predictions', '预测周期长度的计算次数', ['method'])
+TRAININGS = Counter('periodai_trainings', '用户GRU模型训练次数（full/incremental）', ['mode'])
+PREDICTION_ERRORS = Histogram('periodai_prediction_error_days', '预测开始日期与实际开始日期相差天数', ['method'],
+                              buckets=(0, 1, 2, 3, 5, 7, 10, 14, 20))
+TRAINING_DECISIONS = Counter('periodai_training_decisions', '重训练策略的决定次数', ['action', 'reason'])
+
+
+def add_request_timing(stage, seconds):
+    """把耗时计入当前请求的Server-Timing（不在请求中时忽略）"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + seconds
+
+
+@contextmanager
+def timed(stage):
+    """记录一个阶段的耗时：写入periodai_stage_seconds直方图，并计入当前请求的Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        add_request_timing(stage, elapsed)
+
+
+def timed_function(stage):
+    """timed的装饰器形式"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request_timings():
+    """开始收集当前请求的阶段耗时，返回用于结束的token"""
+    return _request_timings.set({})
+
+
+def finish_request_timings(token):
+    """结束收集，返回{阶段: 秒}"""
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
@@ -0,0 +1,47 @@
+import time
+from django.db import connection
+from .metrics import (DB_QUERIES, REQUEST_SECONDS, REQUESTS, STAGE_SECONDS, add_request_timing,
+                      finish_request_timings, start_request_timings)
+
+
+class ServerTimingMiddleware:
+    """
+    统计每个请求的总耗时、数据库查询耗时和各阶段耗时（metrics.timed），
+    写入指标，并通过Server-Timing响应头返回，浏览器开发者工具中可直接查看
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def time_query(execute, sql, params, many, context):
+            nonlocal queries
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries += 1
+                add_request_timing('db', time.perf_counter() - started)
+
+        token = start_request_timings()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(time_query):
+                response = self.get_response(request)
+        finally:
+            timings = finish_request_timings(token)
+        elapsed = time.perf_counter() - started
+
+        view = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        if queries:
+            DB_QUERIES.inc(queries, view=view)
+            STAGE_SECONDS.observe(timings['db'], stage='db')
+
+        entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()]
+        entries.append(f'total;dur={elapsed * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(entries)
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app01', '0007_alter_periodrecord_options_alter_userprofile_options_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCycleStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_count', models.IntegerField(default=0)),
+                ('cycle_lengths', models.JSONField(default=list)),
+                ('weighted_sum', models.FloatField(default=0)),
+                ('weight_total', models.FloatField(default=0)),
+                ('last_start_date', models.DateField(blank=True, null=True)),
+                ('last_end_date', models.DateField(blank=True, null=True)),
+                ('stage', models.IntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cycle_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
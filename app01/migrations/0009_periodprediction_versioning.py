@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app01', '0008_usercyclestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='periodprediction',
+            name='cycle_index',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='periodprediction',
+            name='cycle_length',
+            field=models.IntegerField(default=28),
+        ),
+        migrations.AddField(
+            model_name='periodprediction',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='periodprediction',
+            name='method',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='usercyclestats',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
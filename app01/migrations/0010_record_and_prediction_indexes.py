@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app01', '0009_periodprediction_versioning'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='periodprediction',
+            index=models.Index(condition=models.Q(('is_confirmed', False)), fields=['user', 'data_version', 'cycle_index'], name='prediction_pending_version'),
+        ),
+        migrations.AddIndex(
+            model_name='periodrecord',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'start_date'], name='record_active_user_start'),
+        ),
+        migrations.AddIndex(
+            model_name='periodrecord',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('is_predicted', False)), fields=['user', 'start_date'], name='record_actual_user_start'),
+        ),
+    ]
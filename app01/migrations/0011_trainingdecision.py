@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app01', '0010_record_and_prediction_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingDecision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('action', models.CharField(max_length=10)),
+                ('reason', models.CharField(max_length=30)),
+                ('source', models.CharField(blank=True, default='', max_length=20)),
+                ('new_samples', models.IntegerField(blank=True, null=True)),
+                ('prediction_error', models.IntegerField(blank=True, null=True)),
+                ('model_age_hours', models.FloatField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='training_decisions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'created_at'], name='decision_user_created')],
+            },
+        ),
+    ]
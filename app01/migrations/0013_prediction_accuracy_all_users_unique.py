@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_duplicate_totals(apps, schema_editor):
+    """添加约束前把并发写入产生的重复汇总行（user为空）合并为一行"""
+    PredictionAccuracy = apps.get_model('app01', 'PredictionAccuracy')
+    rows = {}
+    for row in PredictionAccuracy.objects.filter(user__isnull=True).order_by('id'):
+        kept = rows.setdefault(row.method, row)
+        if kept is row:
+            continue
+        kept.count += row.count
+        kept.error_sum += row.error_sum
+        kept.weighted_error_sum += row.weighted_error_sum
+        kept.weight_total += row.weight_total
+        kept.save()
+        row.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app01', '0012_prediction_accuracy'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_totals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='predictionaccuracy',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('method',), name='accuracy_all_users_method'),
+        ),
+    ]
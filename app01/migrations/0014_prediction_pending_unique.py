@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def delete_duplicate_pending(apps, schema_editor):
+    """添加约束前删除并发刷新产生的重复未确认预测，每个(user, cycle_index)保留最新的一行"""
+    PeriodPrediction = apps.get_model('app01', 'PeriodPrediction')
+    seen = set()
+    for row in PeriodPrediction.objects.filter(is_confirmed=False).order_by('-id'):
+        key = (row.user_id, row.cycle_index)
+        if key in seen:
+            row.delete()
+        else:
+            seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app01', '0013_prediction_accuracy_all_users_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_pending, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='periodprediction',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_confirmed', False)), fields=('user', 'cycle_index'), name='prediction_pending_unique'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 from datetime import timedelta
 
@@ -24,6 +25,14 @@ class PeriodRecord(models.Model):
 
     class Meta:
         ordering = ['-start_date']
+        indexes = [
+            # 日历窗口、记录列表、日期详情等按用户和开始日期查询未删除记录
+            models.Index(fields=['user', 'start_date'], name='record_active_user_start',
+                         condition=Q(is_deleted=False)),
+            # 训练和统计重建只读取实际（非预测）记录
+            models.Index(fields=['user', 'start_date'], name='record_actual_user_start',
+                         condition=Q(is_deleted=False, is_predicted=False)),
+        ]
 
 
 class UserProfile(models.Model):
@@ -45,10 +54,147 @@ class PeriodPrediction(models.Model):
     based_on_record = models.ForeignKey(PeriodRecord, on_delete=models.CASCADE, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_confirmed = models.BooleanField(default=False)  # 是否已确认（用户标记了经期开始）
+    cycle_index = models.IntegerField(default=1)  # 第几个预测周期，1为当前预测
+    cycle_length = models.IntegerField(default=28)  # 预测使用的周期长度
+    method = models.CharField(max_length=50, blank=True, default='')  # 预测方法说明
+    data_version = models.IntegerField(default=0)  # 生成时的UserCycleStats.data_version
+    method_key = models.CharField(max_length=20, blank=True, default='')  # fixed/weighted/gru/gru_global
+    # 第1个周期：各方法给出的周期长度，确认后用于对比各方法的误差
+    candidates = models.JSONField(default=dict, blank=True)
+    actual_start = models.DateField(null=True, blank=True)  # 确认时用户记录的实际开始日期
+    error_days = models.IntegerField(null=True, blank=True)  # |实际开始日期 - 预测开始日期|
 
     def __str__(self):
         status = "已确认" if self.is_confirmed else "预测中"
         return f"{self.user.username} - 预测{self.predicted_start}至{self.predicted_end} ({status})"
 
     class Meta:
-        ordering = ['predicted_start']
\ No newline at end of file
+        ordering = ['predicted_start']
+        indexes = [
+            # 读取当前版本的未确认预测
+            models.Index(fields=['user', 'data_version', 'cycle_index'], name='prediction_pending_version',
+                         condition=Q(is_confirmed=False)),
+        ]
+        constraints = [
+            # 每个用户只有一组未确认的预测
+            models.UniqueConstraint(fields=['user', 'cycle_index'], condition=Q(is_confirmed=False),
+                                    name='prediction_pending_unique'),
+        ]
+
+
+class UserCycleStats(models.Model):
+    """用户周期统计：记录增删改时增量维护，预测时直接读取，无需重新遍历全部记录"""
+    STAGE_FIXED = 1  # 固定周期（少于3个周期）
+    STAGE_WEIGHTED = 2  # 加权平均（3-6个周期）
+    STAGE_GRU = 3  # GRU神经网络（7个及以上周期）
+
+    # 加权平均的衰减因子：越近的周期权重越高
+    WEIGHT_DECAY = 0.5
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cycle_stats')
+    record_count = models.IntegerField(default=0)  # 实际（非预测）记录数
+    cycle_lengths = models.JSONField(default=list)  # 有效周期长度（20-45天），按时间顺序
+    weighted_sum = models.FloatField(default=0)  # Σ 权重 × 周期长度
+    weight_total = models.FloatField(default=0)  # Σ 权重
+    last_start_date = models.DateField(null=True, blank=True)
+    last_end_date = models.DateField(null=True, blank=True)
+    stage = models.IntegerField(default=STAGE_FIXED)
+    data_version = models.IntegerField(default=0)  # 记录或基础信息每次变化都递增，用于判断已保存的预测是否过期
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.record_count}条记录，{len(self.cycle_lengths)}个有效周期"
+
+    @property
+    def cycle_count(self):
+        """三阶段算法使用的周期数：实际记录数 - 1"""
+        return max(self.record_count - 1, 0)
+
+    def weighted_average_cycle(self):
+        """加权平均周期长度，与predictor.calculate_weighted_average_cycle结果一致"""
+        if not self.weight_total:
+            return 28
+        weighted_avg = self.weighted_sum / self.weight_total
+        return int(round(max(20, min(45, weighted_avg))))
+
+    def append_record(self, start_date, end_date):
+        """追加一条开始日期晚于所有已有记录的实际记录（O(1)更新，不保存）"""
+        if self.last_start_date is not None:
+            days_between = (start_date - self.last_start_date).days
+            if 20 <= days_between <= 45:
+                self.cycle_lengths = self.cycle_lengths + [days_between]
+                self.weighted_sum = self.weighted_sum * self.WEIGHT_DECAY + days_between
+                self.weight_total = self.weight_total * self.WEIGHT_DECAY + 1
+        self.record_count += 1
+        self.last_start_date = start_date
+        self.last_end_date = end_date
+        self.stage = self.stage_for(self.cycle_count)
+
+    @classmethod
+    def stage_for(cls, cycle_count):
+        if cycle_count < 3:
+            return cls.STAGE_FIXED
+        if cycle_count < 7:
+            return cls.STAGE_WEIGHTED
+        return cls.STAGE_GRU
+
+
+class TrainingDecision(models.Model):
+    """重训练策略的每次决定：是否训练用户GRU模型、原因及决定时的依据"""
+    ACTION_TRAIN = 'train'
+    ACTION_SKIP = 'skip'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='training_decisions')
+    created_at = models.DateTimeField(auto_now_add=True)
+    action = models.CharField(max_length=10)  # train / skip
+    reason = models.CharField(max_length=30)  # 见policy.RetrainPolicy
+    source = models.CharField(max_length=20, blank=True, default='')  # 触发来源：add_period_start、import等
+    new_samples = models.IntegerField(null=True, blank=True)  # 上次训练后新增的训练窗口数
+    prediction_error = models.IntegerField(null=True, blank=True)  # 上次预测的开始日期与实际开始日期相差天数
+    model_age_hours = models.FloatField(null=True, blank=True)  # 现有模型训练后经过的小时数
+
+    def __str__(self):
+        return f"{self.user.username} - {self.action}（{self.reason}）"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='decision_user_created'),
+        ]
+
+
+class PredictionAccuracy(models.Model):
+    """各预测方法的误差统计：预测被确认时增量更新，user为空的行是全部用户的汇总"""
+    # 滚动误差的衰减因子：越近的误差权重越高
+    ERROR_DECAY = 0.8
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name='prediction_accuracy')
+    method = models.CharField(max_length=20)  # fixed/weighted/gru/gru_global
+    count = models.IntegerField(default=0)  # 已确认的预测数
+    error_sum = models.FloatField(default=0)  # Σ 误差天数
+    weighted_error_sum = models.FloatField(default=0)  # Σ 权重 × 误差天数
+    weight_total = models.FloatField(default=0)  # Σ 权重
+    last_error = models.IntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        owner = self.user.username if self.user_id else "全部用户"
+        return f"{owner} - {self.method}：{self.count}次，滚动MAE {self.rolling_mae:.2f}天"
+
+    @property
+    def mae(self):
+        return self.error_sum / self.count if self.count else 0.0
+
+    @property
+    def rolling_mae(self):
+        """按时间衰减加权的平均绝对误差"""
+        return self.weighted_error_sum / self.weight_total if self.weight_total else 0.0
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'method'], name='accuracy_user_method'),
+            # user为空时上面的约束不生效（NULL互不相等），全部用户的汇总行单独约束
+            models.UniqueConstraint(fields=['method'], condition=Q(user__isnull=True),
+                                    name='accuracy_all_users_method'),
+        ]
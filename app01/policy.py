@@ -0,0 +1,136 @@
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+from . import metrics
+from .evaluation import METHOD_GRU, METHOD_WEIGHTED, better_method, rolling_errors
+from .models import TrainingDecision
+from .training import MIN_GRU_CYCLES, training_queue
+
+
+logger = logging.getLogger(__name__)
+
+
+# 一次决定：action为train/skip，其余字段为决定时的依据（不适用时为None）
+Decision = namedtuple('Decision', ['action', 'reason', 'new_samples', 'prediction_error', 'model_age_hours'])
+
+
+class RetrainPolicy:
+    """决定新增记录后是否需要重新训练用户GRU模型
+
+    依次检查：
+    - 不足GRU阶段、已有群体模型、已在排队：不训练（too_few_cycles / global_model / pending）
+    - 还没有用户模型或模型没有训练窗口元数据：训练（no_model / no_metadata）
+    - 距上次登记训练不足最小间隔：不训练（cooldown）
+    - 训练窗口内的周期被插入、修改或删除：训练（history_changed）
+    - 没有新的周期：不训练（no_new_samples）
+    - 上次预测误差、新增周期数、模型年龄任一达到阈值：训练（prediction_error / new_samples / model_age）
+    - GRU模型的滚动误差（evaluation.rolling_errors）大于加权平均：训练（underperforming）
+    - 否则不训练（within_tolerance），预测继续使用现有模型
+    """
+
+    def __init__(self, min_new_samples=3, error_days=3, min_interval=timedelta(hours=1),
+                 max_model_age=timedelta(days=90)):
+        self.min_new_samples = min_new_samples
+        self.error_days = error_days
+        self.min_interval = min_interval
+        self.max_model_age = max_model_age
+
+    def decide(self, cycle_count, cycle_lengths, metadata, prediction_error=None, since_last_train=None,
+               has_global_model=False, pending=False, errors=None):
+        """
+        根据当前数据和现有模型的元数据做出决定，不访问数据库
+
+        cycle_lengths为全部有效周期序列；metadata为GRUPeriodPredictor.model_metadata的结果；
+        prediction_error为上次预测开始日期的误差天数；since_last_train为距上次登记训练的时间（timedelta）；
+        errors为evaluation.rolling_errors的结果
+        """
+        from .predictor import gru_predictor
+
+        if cycle_count < MIN_GRU_CYCLES:
+            return Decision(TrainingDecision.ACTION_SKIP, 'too_few_cycles', None, prediction_error, None)
+        if has_global_model:
+            return Decision(TrainingDecision.ACTION_SKIP, 'global_model', None, prediction_error, None)
+        if pending:
+            return Decision(TrainingDecision.ACTION_SKIP, 'pending', None, prediction_error, None)
+        if metadata is None:
+            return Decision(TrainingDecision.ACTION_TRAIN, 'no_model', None, prediction_error, None)
+        if 'cycles_total' not in metadata or 'trained_at' not in metadata:
+            return Decision(TrainingDecision.ACTION_TRAIN, 'no_metadata', None, prediction_error, None)
+
+        # 每个追加的周期对应一个新的训练窗口；历史变化时为None
+        new_samples = gru_predictor.appended_cycles(metadata, cycle_lengths)
+        model_age = datetime.now() - datetime.fromisoformat(metadata['trained_at'])
+        model_age_hours = round(model_age.total_seconds() / 3600, 1)
+
+        def decision(action, reason):
+            return Decision(action, reason, new_samples, prediction_error, model_age_hours)
+
+        if since_last_train is not None and since_last_train < self.min_interval:
+            return decision(TrainingDecision.ACTION_SKIP, 'cooldown')
+        if new_samples is None:
+            return decision(TrainingDecision.ACTION_TRAIN, 'history_changed')
+        if new_samples == 0:
+            return decision(TrainingDecision.ACTION_SKIP, 'no_new_samples')
+        if prediction_error is not None and prediction_error >= self.error_days:
+            return decision(TrainingDecision.ACTION_TRAIN, 'prediction_error')
+        if new_samples >= self.min_new_samples:
+            return decision(TrainingDecision.ACTION_TRAIN, 'new_samples')
+        if model_age >= self.max_model_age:
+            return decision(TrainingDecision.ACTION_TRAIN, 'model_age')
+        if errors and better_method(errors, METHOD_GRU, METHOD_WEIGHTED) != METHOD_GRU:
+            return decision(TrainingDecision.ACTION_TRAIN, 'underperforming')
+        return decision(TrainingDecision.ACTION_SKIP, 'within_tolerance')
+
+    def evaluate(self, user, stats, prediction_error=None, source=''):
+        """
+        对用户当前数据做出决定并记录，需要训练时登记到后台训练队列，返回Decision
+
+        用户模型的训练只由这里登记；应在refresh_predictions之前调用，使刷新预测时看到的是策略的决定
+        """
+        from .predictor import gru_predictor
+
+        if stats.cycle_count < MIN_GRU_CYCLES:
+            # 多数用户在GRU阶段之前，不读取模型也不记录
+            return Decision(TrainingDecision.ACTION_SKIP, 'too_few_cycles', None, prediction_error, None)
+
+        has_global_model = gru_predictor.has_global_model()
+        pending = training_queue.is_pending(user.id)
+        metadata = None if has_global_model or pending else gru_predictor.model_metadata(user.id)
+        last_train = TrainingDecision.objects.filter(
+            user=user, action=TrainingDecision.ACTION_TRAIN
+        ).values_list('created_at', flat=True).first()
+        since_last_train = timezone.now() - last_train if last_train is not None else None
+
+        decision = self.decide(stats.cycle_count, stats.cycle_lengths, metadata, prediction_error,
+                               since_last_train, has_global_model, pending, rolling_errors(user))
+        TrainingDecision.objects.create(user=user, source=source, **decision._asdict())
+        metrics.TRAINING_DECISIONS.inc(action=decision.action, reason=decision.reason)
+        logger.info("用户%s的重训练决定: %s（%s）", user.id, decision.action, decision.reason, extra={
+            'user_id': user.id,
+            'source': source,
+            'cycles': stats.cycle_count,
+            **decision._asdict(),
+        })
+
+        if decision.action == TrainingDecision.ACTION_TRAIN:
+            training_queue.enqueue(user.id)
+        return decision
+
+
+# 全局策略实例，阈值可在settings中调整
+retrain_policy = RetrainPolicy(
+    min_new_samples=getattr(settings, 'GRU_RETRAIN_MIN_NEW_SAMPLES', 3),
+    error_days=getattr(settings, 'GRU_RETRAIN_ERROR_DAYS', 3),
+    min_interval=timedelta(seconds=getattr(settings, 'GRU_RETRAIN_MIN_INTERVAL', 60 * 60)),
+    max_model_age=timedelta(seconds=getattr(settings, 'GRU_RETRAIN_MAX_MODEL_AGE', 90 * 24 * 60 * 60)),
+)
+
+
+def evaluate_retraining(user, stats, source, prediction_error=None):
+    """记录变化后由重训练策略决定是否登记GRU训练（不阻塞请求）；失败只记录日志，不影响已保存的记录"""
+    try:
+        retrain_policy.evaluate(user, stats, prediction_error, source=source)
+    except Exception:
+        logger.exception("用户%s的GRU模型训练登记失败", user.id, extra={'user_id': user.id, 'source': source})
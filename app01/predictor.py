@@ -1,71 +1,305 @@
+import hashlib
+import logging
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timedelta
-from sklearn.preprocessing import MinMaxScaler
-import tensorflow as tf
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import GRU, Dense, Dropout
-from tensorflow.keras.optimizers import Adam
-import joblib
 import os
 import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from django.conf import settings
+from django.db import transaction
+from . import metrics
+from .evaluation import (METHOD_FIXED, METHOD_GRU, METHOD_GRU_GLOBAL, METHOD_WEIGHTED, better_method,
+                         rolling_errors)
+from .gru_numpy import ARTIFACT_EXTENSION, PACK_EXTENSION, ModelPack, NumpyGRUModel, StackedGRUModel, write_artifact
+from .models import PeriodPrediction, UserCycleStats
+from .queries import current_predictions, latest_actual_record, predictions_overlapping, user_profile
+from .stats import get_cycle_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+# 群体模型在ModelCache中的key（用户模型以user_id为key）
+GLOBAL_MODEL_KEY = 'global'
+
+# 训练群体模型所需的最少样本（窗口）数
+GLOBAL_MIN_SAMPLES = 50
+
+# 用户校准：历史残差按时间衰减加权，并加上若干个残差为0的虚拟样本，使历史很短的用户接近群体模型
+CALIBRATION_DECAY = 0.8
+CALIBRATION_PRIOR = 2.0
+
+# 增量训练：在现有权重上用新窗口和最近的若干旧窗口训练几轮
+INCREMENTAL_EPOCHS = 5
+INCREMENTAL_REPLAY = 8
+# 连续增量训练的次数上限，达到后做一次完整训练，避免误差累积
+INCREMENTAL_MAX_UPDATES = 10
+# 现有模型在新窗口上的平均误差超过max(该值, 2 × 上次训练MAE)时视为漂移，完整训练
+DRIFT_MIN_DAYS = 3.0
+# 新窗口的特征超出scaler拟合范围的比例上限（相对范围宽度），超出时重新拟合scaler并完整训练
+SCALER_TOLERANCE = 0.05
+
+# select_cycle_length的结果：key为预测方法，candidates为各方法给出的周期长度（第1个预测周期确认时对比误差）
+Selection = namedtuple('Selection', ['cycle_length', 'method', 'key', 'candidates'])
+
+# 用户模型最多使用最近的这么多个周期（约10年），长期用户的训练时间不随历史增长
+TRAINING_MAX_CYCLES = 119
+
+# 单个用户的模型句柄：创建后不再修改，可在多个请求线程间安全共享
+ModelHandle = namedtuple('ModelHandle', ['user_id', 'version', 'model', 'scaler'])
+
+
+class ModelCache:
+    """进程内GRU模型注册表：按用户ID和模型文件修改时间索引，按数量(LRU)和存活时间淘汰
+
+    缓存中保存的是不可变的ModelHandle，调用方拿到句柄后无需再加锁
+    """
+
+    def __init__(self, max_size=32, max_age=3600):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._entries = OrderedDict()  # user_id（群体模型为GLOBAL_MODEL_KEY） -> (loaded_at, handle)
+        self._lock = threading.Lock()
+        self._load_locks = {}  # user_id -> [加载锁, 正在使用的线程数]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, mtime):
+        """命中返回ModelHandle，否则返回None"""
+        with self._lock:
+            handle = self._lookup(user_id, mtime)
+            if handle is not None:
+                self.hits += 1
+                metrics.CACHE_EVENTS.inc(cache='gru_model', result='hit')
+                return handle
+            self.misses += 1
+            metrics.CACHE_EVENTS.inc(cache='gru_model', result='miss')
+            return None
+
+    def peek(self, user_id, mtime):
+        """与get相同但不计入命中/未命中，供加载锁内的二次检查使用，避免一次未命中被统计两次"""
+        with self._lock:
+            return self._lookup(user_id, mtime)
+
+    def _lookup(self, user_id, mtime):
+        # 调用方需持有self._lock
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        loaded_at, handle = entry
+        # 模型文件已被重写或缓存过期，视为未命中
+        if handle.version != mtime or time.monotonic() - loaded_at > self.max_age:
+            del self._entries[user_id]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(user_id)
+        return handle
+
+    def put(self, handle):
+        with self._lock:
+            self._entries[handle.user_id] = (time.monotonic(), handle)
+            self._entries.move_to_end(handle.user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    @contextmanager
+    def load_lock(self, user_id):
+        """同一用户的模型只由一个线程从磁盘加载，其余线程等待后直接命中缓存
+
+        锁按引用计数保存，最后一个使用者退出后删除，_load_locks不会随用户数增长
+        """
+        with self._lock:
+            entry = self._load_locks.get(user_id)
+            if entry is None:
+                entry = self._load_locks[user_id] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._load_locks[user_id]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回命中/未命中计数，便于监控"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
 
 
 class GRUPeriodPredictor:
+    """GRU周期预测器
+
+    实例本身不保存任何用户的模型状态，模型和scaler以ModelHandle的形式从注册表获取，
+    因此全局单例可以被多线程的WSGI/ASGI进程并发使用
+    """
+
     def __init__(self):
-        self.model = None
-        self.scaler = MinMaxScaler(feature_range=(0, 1))
         self.sequence_length = 6
         self.model_dir = os.path.join(settings.BASE_DIR, 'gru_models')
         os.makedirs(self.model_dir, exist_ok=True)
+        self.model_cache = ModelCache(
+            max_size=getattr(settings, 'GRU_MODEL_CACHE_SIZE', 32),
+            max_age=getattr(settings, 'GRU_MODEL_CACHE_TTL', 3600),
+        )
+        self.shard_count = getattr(settings, 'GRU_MODEL_SHARDS', 16)
+        self._packs = {}  # 分片路径 -> 已映射的ModelPack
+        self._packs_lock = threading.Lock()
 
     def get_user_model_path(self, user_id):
         return os.path.join(self.model_dir, f'user_{user_id}')
 
-    def create_features(self, records):
-        """从经期记录创建特征"""
-        if len(records) < 2:
-            return None, None
+    def get_global_model_path(self):
+        return os.path.join(self.model_dir, f'global{ARTIFACT_EXTENSION}')
 
-        sorted_records = sorted(records, key=lambda x: x.start_date)
-        cycle_lengths = []
+    def has_global_model(self):
+        return os.path.exists(self.get_global_model_path())
 
-        for i in range(1, len(sorted_records)):
-            prev_start = sorted_records[i - 1].start_date
-            curr_start = sorted_records[i].start_date
-            days_between = (curr_start - prev_start).days
+    def get_pack_path(self, user_id):
+        return os.path.join(self.model_dir, f'shard_{user_id % self.shard_count:03d}{PACK_EXTENSION}')
 
-            if 20 <= days_between <= 45:
-                cycle_lengths.append(days_between)
+    def get_pack(self, user_id):
+        """用户所在的分片文件（ModelPack），不存在时返回None；分片被重写后重新映射"""
+        path = self.get_pack_path(user_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with self._packs_lock:
+            pack = self._packs.get(path)
+            if pack is None or pack.mtime != mtime:
+                pack = self._packs[path] = ModelPack(path)
+            return pack
+
+    def locate_model(self, user_id):
+        """
+        查找用户模型，返回(文件路径, 修改时间)；模型不存在时返回(None, None)
+
+        依次查找.gru、旧的.h5 + scaler.pkl，最后查找分片文件
+        """
+        model_path = self.get_user_model_path(user_id)
+        try:
+            path = f"{model_path}{ARTIFACT_EXTENSION}"
+            return path, os.path.getmtime(path)
+        except OSError:
+            pass
+        try:
+            return f"{model_path}.h5", max(os.path.getmtime(f"{model_path}.h5"),
+                                           os.path.getmtime(f"{model_path}_scaler.pkl"))
+        except OSError:
+            pass
+        pack = self.get_pack(user_id)
+        if pack is not None and user_id in pack:
+            return pack.path, pack.mtime
+        return None, None
+
+    def get_model_mtime(self, user_id):
+        """模型文件的修改时间，模型不存在时返回None"""
+        return self.locate_model(user_id)[1]
+
+    def model_metadata(self, user_id):
+        """用户模型的训练元数据（trained_at、samples、cycles_digest等）；模型不存在时返回None，旧格式模型返回{}"""
+        handle = self.load_model(user_id)
+        if handle is None:
+            return None
+        return getattr(handle.model, 'metadata', None) or {}
+
+    def remove_legacy_files(self, user_id):
+        """删除用户旧格式的模型文件（.h5、scaler.pkl）"""
+        model_path = self.get_user_model_path(user_id)
+        for path in (f"{model_path}.h5", f"{model_path}_scaler.pkl"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
-        if len(cycle_lengths) < self.sequence_length + 1:
-            return None, None
+    @staticmethod
+    def cycle_lengths_from_records(records):
+        """经期记录之间的有效周期长度（20-45天），按时间顺序"""
+        sorted_records = sorted(records, key=lambda x: x.start_date)
+        start_days = np.fromiter((r.start_date.toordinal() for r in sorted_records),
+                                 dtype=np.int64, count=len(sorted_records))
+        days_between = np.diff(start_days)
+        return days_between[(days_between >= 20) & (days_between <= 45)]
 
-        features = []
-        for i in range(len(cycle_lengths) - self.sequence_length):
-            sequence = cycle_lengths[i:i + self.sequence_length]
-            feature_vector = list(sequence)
-
-            # 统计特征
-            feature_vector.extend([
-                np.mean(sequence), np.std(sequence),
-                min(sequence), max(sequence), np.median(sequence)
-            ])
-
-            # 趋势特征
-            if len(sequence) >= 2:
-                trend = sequence[-1] - sequence[-2]
-                feature_vector.append(trend)
-            else:
-                feature_vector.append(0)
+    def create_features(self, records):
+        """从经期记录创建特征（耗时计入create_features_from_cycles的features阶段）"""
+        if len(records) < 2:
+            return None, None
+        return self.create_features_from_cycles(self.cycle_lengths_from_records(records))
 
-            features.append(feature_vector)
+    @metrics.timed_function('features')
+    def create_features_from_cycles(self, cycle_lengths):
+        """从有效周期长度序列创建滑动窗口特征：窗口原值 + 均值/标准差/最小/最大/中位数 + 趋势"""
+        cycle_lengths = np.asarray(cycle_lengths, dtype=np.int64)
+        if len(cycle_lengths) < self.sequence_length + 1:
+            return None, None
 
+        # 每行是一个长度为sequence_length的窗口，最后一个窗口没有目标值，不参与
+        windows = sliding_window_view(cycle_lengths.astype(np.float64), self.sequence_length)[:-1]
         targets = cycle_lengths[self.sequence_length:]
-        return np.array(features), np.array(targets)
+        return self.window_features(windows), targets
+
+    def window_features(self, windows):
+        """每个窗口的特征：窗口原值 + 均值/标准差/最小/最大/中位数 + 趋势"""
+        # 统计特征
+        stats = [
+            windows.mean(axis=1), windows.std(axis=1),
+            windows.min(axis=1), windows.max(axis=1), np.median(windows, axis=1)
+        ]
+
+        # 趋势特征
+        if self.sequence_length >= 2:
+            trend = windows[:, -1] - windows[:, -2]
+        else:
+            trend = np.zeros(len(windows))
+
+        return np.column_stack([windows, *stats, trend])
+
+    def padded_windows(self, cycle_lengths):
+        """
+        群体模型使用的窗口，返回(n, sequence_length)
+
+        第k行（k=1..n）由第k个周期之前最多sequence_length个周期组成，不足时在前面用这些周期的均值补齐，
+        因此周期数少于sequence_length的用户也有完整的窗口。前n-1行的目标为第k个周期，最后一行用于预测下一个周期
+        """
+        cycles = np.asarray(cycle_lengths, dtype=np.float64)
+        n = len(cycles)
+        padded = np.concatenate([np.full(self.sequence_length, np.nan), cycles])
+        windows = sliding_window_view(padded, self.sequence_length)[1:n + 1]
+        prefix_means = np.cumsum(cycles) / np.arange(1, n + 1)
+        return np.where(np.isnan(windows), prefix_means[:, None], windows)
 
     def build_model(self, input_shape):
         """构建GRU模型"""
+        # TensorFlow只在训练时才导入，普通请求和manage.py命令不需要加载
+        from tensorflow.keras.models import Sequential
+        from tensorflow.keras.layers import GRU, Dense, Dropout
+        from tensorflow.keras.optimizers import Adam
+
         model = Sequential([
             GRU(50, return_sequences=True, input_shape=input_shape),
             Dropout(0.2),
@@ -80,79 +314,383 @@ class GRUPeriodPredictor:
                       metrics=['mae'])
         return model
 
-    def train_model(self, user_id, records):
-        """训练GRU模型"""
-        print(f"🎯 开始训练用户{user_id}的GRU模型")
-
-        X, y = self.create_features(records)
+    @staticmethod
+    def cycles_digest(cycle_lengths):
+        """周期序列的摘要，用于判断新数据是否只是在上次训练所用的数据之后追加了周期"""
+        return hashlib.sha1(np.asarray(cycle_lengths, dtype='<i8').tobytes()).hexdigest()[:16]
+
+    def appended_cycles(self, metadata, cycle_lengths):
+        """
+        模型训练后在全部周期序列末尾追加的周期数；历史被插入、修改或删除，或元数据没有训练窗口信息时返回None
+
+        训练只使用最近TRAINING_MAX_CYCLES个周期，窗口随历史增长向后滑动。元数据记录训练时的全部周期数
+        cycles_total和所用的最后cycles_used个周期的摘要，这里比较的始终是全部周期序列中的同一段
+        """
+        total, used = metadata.get('cycles_total'), metadata.get('cycles_used')
+        if total is None or used is None or len(cycle_lengths) < total:
+            return None
+        if self.cycles_digest(cycle_lengths[total - used:total]) != metadata.get('cycles_digest'):
+            return None
+        return len(cycle_lengths) - total
+
+    def plan_incremental(self, user_id, cycle_lengths, X, y):
+        """
+        判断能否在现有模型上增量训练，返回(ModelHandle, 新窗口数)；需要完整训练时返回(None, 原因)
+
+        cycle_lengths为全部周期序列，X、y为训练窗口的特征和目标
+        条件：现有模型是带训练元数据的.gru；新数据只是在上次训练的数据之后追加；连续增量次数未达上限；
+        新窗口的特征没有超出scaler的拟合范围；现有模型在新窗口上的误差没有明显变大（漂移）
+        """
+        handle = self.load_model(user_id)
+        metadata = getattr(handle.model, 'metadata', None) if handle is not None else None
+        if not metadata or 'cycles_digest' not in metadata:
+            return None, 'no_model'
+
+        appended = self.appended_cycles(metadata, cycle_lengths)
+        if appended is None:
+            return None, 'history_changed'
+        if appended == 0:
+            return None, 'no_new_samples'
+        if metadata.get('incremental_updates', 0) >= INCREMENTAL_MAX_UPDATES:
+            return None, 'max_updates'
+
+        # 每个追加的周期是一个新窗口的目标
+        new_count = min(appended, len(X))
+        new_X, new_y = X[-new_count:], y[-new_count:]
+        data_min, data_max = handle.scaler.data_range()
+        margin = (data_max - data_min) * SCALER_TOLERANCE
+        if np.any(new_X < data_min - margin) or np.any(new_X > data_max + margin):
+            return None, 'scaler_range'
+
+        scaled = handle.scaler.transform(new_X).reshape((new_count, 1, -1))
+        error = float(np.mean(np.abs(np.asarray(handle.model(scaled, training=False))[:, 0] - new_y)))
+        if error > max(DRIFT_MIN_DAYS, 2 * metadata.get('train_mae', 0)):
+            return None, 'drift'
+        return handle, new_count
+
+    def train_model(self, user_id, records, incremental=True):
+        """用经期记录训练GRU模型，见train_from_cycles"""
+        return self.train_from_cycles(user_id, self.cycle_lengths_from_records(records), incremental)
+
+    @metrics.timed_function('train')
+    def train_from_cycles(self, user_id, cycle_lengths, incremental=True):
+        """
+        用全部有效周期序列（UserCycleStats.cycle_lengths）训练GRU模型，只使用最近TRAINING_MAX_CYCLES个周期
+
+        incremental为True时，若新数据只是追加了周期且没有漂移，就在现有权重和scaler上用新窗口训练几轮，
+        否则重新拟合scaler并从头训练
+        """
+        import tensorflow as tf
+        from sklearn.preprocessing import MinMaxScaler
+
+        started = time.perf_counter()
+        all_cycles = np.asarray(cycle_lengths, dtype=np.int64)
+        window = all_cycles[-TRAINING_MAX_CYCLES:]
+        X, y = self.create_features_from_cycles(window)
         if X is None or len(X) < 3:
-            print(f"❌ 用户{user_id}数据不足，无法训练GRU模型")
+            logger.info("用户%s数据不足，无法训练GRU模型", user_id, extra={'user_id': user_id})
             return False
 
-        # 数据标准化
-        X_scaled = self.scaler.fit_transform(X)
-        X_reshaped = X_scaled.reshape((X_scaled.shape[0], 1, X_scaled.shape[1]))
+        previous, detail = self.plan_incremental(user_id, all_cycles, X, y) if incremental else (None, 'requested')
+        model = self.build_model((1, X.shape[1]))
+
+        if previous is not None:
+            # 增量训练：沿用现有scaler，只用新窗口和最近的旧窗口训练几轮
+            mode = 'incremental'
+            scaler = previous.scaler
+            model.set_weights(previous.model.keras_weights())
+            fit_count = min(len(X), detail + INCREMENTAL_REPLAY)
+            X_scaled = scaler.transform(X[-fit_count:])
+            history = model.fit(
+                X_scaled.reshape((fit_count, 1, X_scaled.shape[1])), y[-fit_count:],
+                epochs=INCREMENTAL_EPOCHS,
+                batch_size=16,
+                verbose=0
+            )
+            updates = previous.model.metadata.get('incremental_updates', 0) + 1
+        else:
+            # 完整训练：数据标准化（局部变量，不影响正在使用中的模型句柄）
+            mode = 'full'
+            scaler = MinMaxScaler(feature_range=(0, 1))
+            X_scaled = scaler.fit_transform(X)
+            history = model.fit(
+                X_scaled.reshape((X_scaled.shape[0], 1, X_scaled.shape[1])), y,
+                epochs=100,
+                batch_size=16,
+                validation_split=0.2,
+                verbose=0,
+                callbacks=[tf.keras.callbacks.EarlyStopping(patience=10, restore_best_weights=True)]
+            )
+            updates = 0
+
+        # 保存为单个.gru文件（权重 + scaler参数 + 元数据），请求时用NumPy推理，无需TensorFlow
+        train_mae = float(history.history['mae'][-1])
+        path = write_artifact(model, scaler, self.get_user_model_path(user_id), metadata={
+            'user_id': user_id,
+            'trained_at': datetime.now().isoformat(timespec='seconds'),
+            'samples': len(X),
+            'train_mae': train_mae,
+            'mode': mode,
+            'incremental_updates': updates,
+            'cycles_total': len(all_cycles),
+            'cycles_used': len(window),
+            'cycles_digest': self.cycles_digest(window),
+        })
+        self.remove_legacy_files(user_id)
+
+        # 新模型写入后让旧缓存失效，并直接注册刚导出的模型
+        self.model_cache.invalidate(user_id)
+        numpy_model, numpy_scaler = NumpyGRUModel.load(path)
+        self.model_cache.put(ModelHandle(user_id, os.path.getmtime(path), numpy_model, numpy_scaler))
+
+        metrics.TRAININGS.inc(mode=mode)
+        logger.info("用户%s的GRU模型训练完成（%s），MAE %.2f天", user_id, mode, train_mae, extra={
+            'user_id': user_id,
+            'mode': mode,
+            'reason': detail if mode == 'full' else None,
+            'samples': len(X),
+            'epochs': len(history.history['mae']),
+            'train_mae': round(train_mae, 3),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        })
+        return True
 
-        # 构建和训练模型
-        self.model = self.build_model((1, X_scaled.shape[1]))
+    @metrics.timed_function('train')
+    def train_global_model(self, cycle_sequences, epochs=100):
+        """
+        用全部用户的周期序列离线训练群体模型，返回是否成功
+
+        结构与用户模型相同，训练样本为每个用户的padded_windows；用户只需在预测时做校准，不再单独训练
+        """
+        import tensorflow as tf
+        from sklearn.preprocessing import MinMaxScaler
+
+        started = time.perf_counter()
+        features, targets = [], []
+        users = 0
+        for cycles in cycle_sequences:
+            if len(cycles) < 2:
+                continue
+            features.append(self.window_features(self.padded_windows(cycles))[:-1])
+            targets.append(np.asarray(cycles[1:], dtype=np.float64))
+            users += 1
+
+        samples = sum(len(t) for t in targets)
+        if samples < GLOBAL_MIN_SAMPLES:
+            logger.info("样本不足，无法训练群体模型", extra={'users': users, 'samples': samples})
+            return False
 
-        history = self.model.fit(
-            X_reshaped, y,
-            epochs=100,
-            batch_size=16,
-            validation_split=0.2,
+        # 打乱顺序，validation_split取到的不只是最后几个用户
+        order = np.random.default_rng(0).permutation(samples)
+        X = np.concatenate(features)[order]
+        y = np.concatenate(targets)[order]
+
+        scaler = MinMaxScaler(feature_range=(0, 1))
+        X_scaled = scaler.fit_transform(X)
+        model = self.build_model((1, X_scaled.shape[1]))
+        # 输出层偏置从平均周期长度开始，只需学习相对平均值的偏差，收敛快得多
+        model.layers[-1].bias.assign([y.mean()])
+        history = model.fit(
+            X_scaled.reshape((samples, 1, X_scaled.shape[1])), y,
+            epochs=epochs,
+            batch_size=64,
+            validation_split=0.1,
             verbose=0,
             callbacks=[tf.keras.callbacks.EarlyStopping(patience=10, restore_best_weights=True)]
         )
 
-        # 保存模型
-        model_path = self.get_user_model_path(user_id)
-        self.model.save(f"{model_path}.h5")
-        joblib.dump(self.scaler, f"{model_path}_scaler.pkl")
-
-        train_mae = history.history['mae'][-1]
-        print(f"✅ 用户{user_id}的GRU模型训练完成，MAE: {train_mae:.2f}天")
+        train_mae = float(history.history['mae'][-1])
+        path = write_artifact(model, scaler, self.get_global_model_path(), metadata={
+            'trained_at': datetime.now().isoformat(timespec='seconds'),
+            'users': users,
+            'samples': samples,
+            'train_mae': train_mae,
+        })
+        self.model_cache.invalidate(GLOBAL_MODEL_KEY)
+        numpy_model, numpy_scaler = NumpyGRUModel.load(path)
+        self.model_cache.put(ModelHandle(GLOBAL_MODEL_KEY, os.path.getmtime(path), numpy_model, numpy_scaler))
+
+        logger.info("群体模型训练完成，MAE %.2f天", train_mae, extra={
+            'users': users,
+            'samples': samples,
+            'epochs': len(history.history['mae']),
+            'train_mae': round(train_mae, 3),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        })
         return True
 
     def load_model(self, user_id):
-        """加载用户模型"""
-        model_path = self.get_user_model_path(user_id)
-        model_file = f"{model_path}.h5"
-        scaler_file = f"{model_path}_scaler.pkl"
-
-        if os.path.exists(model_file) and os.path.exists(scaler_file):
+        """加载用户模型，返回不可变的ModelHandle；模型不存在或加载失败时返回None"""
+        path, mtime = self.locate_model(user_id)
+        if mtime is None:
+            self.model_cache.invalidate(user_id)
+            return None
+        return self._load_handle(user_id, mtime, lambda: self._read_model_files(user_id, path))
+
+    def load_global_model(self):
+        """加载群体模型，返回ModelHandle；尚未训练或加载失败时返回None"""
+        path = self.get_global_model_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self.model_cache.invalidate(GLOBAL_MODEL_KEY)
+            return None
+        return self._load_handle(GLOBAL_MODEL_KEY, mtime, lambda: NumpyGRUModel.load(path))
+
+    def _load_handle(self, key, mtime, read):
+        handle = self.model_cache.get(key, mtime)
+        if handle is not None:
+            return handle
+
+        with self.model_cache.load_lock(key):
+            # 等锁期间其他线程可能已完成加载
+            handle = self.model_cache.peek(key, mtime)
+            if handle is not None:
+                return handle
             try:
-                self.model = tf.keras.models.load_model(model_file)
-                self.scaler = joblib.load(scaler_file)
-                return True
-            except Exception as e:
-                print(f"❌ 加载模型失败: {e}")
-        return False
-
-    def predict_next_cycle(self, user_id, records):
-        """使用GRU预测下一个周期长度"""
-        if not self.load_model(user_id):
-            if not self.train_model(user_id, records):
-                return self.fallback_prediction(records)
-
-        X, _ = self.create_features(records)
+                with metrics.timed('model_load'):
+                    model, scaler = read()
+            except Exception:
+                logger.exception("用户%s的模型加载失败", key, extra={'user_id': key})
+                return None
+            handle = ModelHandle(key, mtime, model, scaler)
+            self.model_cache.put(handle)
+            return handle
+
+    def _read_model_files(self, user_id, path):
+        if path.endswith(PACK_EXTENSION):
+            return self.get_pack(user_id).load(user_id)
+        if not path.endswith('.h5'):
+            return NumpyGRUModel.load(path)
+        # 旧模型尚未转换为.gru时才需要TensorFlow
+        import joblib
+        import tensorflow as tf
+        return tf.keras.models.load_model(path), joblib.load(f"{path[:-3]}_scaler.pkl")
+
+    def predict_from_stats(self, user_id, stats):
+        """使用预先统计好的周期长度预测，无需读取和遍历全部记录；模型尚未就绪时返回None"""
+        X, _ = self.create_features_from_cycles(stats.cycle_lengths)
+        return self._predict_latest(user_id, X, lambda: None)
+
+    def predict_global(self, handle, cycle_sequences):
+        """
+        群体模型 + 用户校准，返回每个序列下一个周期长度的预测（天）
+
+        所有序列的全部窗口拼成一批做一次前向计算。每个用户的校准层只有一个偏移量：
+        历史窗口残差（实际 - 群体模型预测）的时间衰减加权平均，向0收缩，历史越短越接近群体模型
+        """
+        windows = [self.window_features(self.padded_windows(cycles)) for cycles in cycle_sequences]
+        X = np.concatenate(windows)
+        with metrics.timed('model_predict'):
+            outputs = handle.model(handle.scaler.transform(X).reshape((len(X), 1, -1)), training=False)[:, 0]
+
+        results = []
+        start = 0
+        for cycles in cycle_sequences:
+            predicted = np.asarray(outputs[start:start + len(cycles)], dtype=np.float64)
+            start += len(cycles)
+            residuals = np.asarray(cycles[1:], dtype=np.float64) - predicted[:-1]
+            weights = CALIBRATION_DECAY ** np.arange(len(residuals))[::-1]
+            offset = float(weights @ residuals) / (weights.sum() + CALIBRATION_PRIOR)
+            results.append(int(round(max(20, min(45, predicted[-1] + offset)))))
+        return results
+
+    def _predict_latest(self, user_id, X, fallback):
+        handle = self.load_model(user_id)
+        if handle is None:
+            # 模型尚未就绪：是否训练由重训练策略（policy.RetrainPolicy）决定，本次先用回退值
+            metrics.PREDICTIONS.inc(method='gru_pending')
+            return fallback()
+
         if X is None or len(X) == 0:
-            return self.fallback_prediction(records)
+            metrics.PREDICTIONS.inc(method='gru_pending')
+            return fallback()
 
         # 使用最新序列预测
         latest_sequence = X[-1:].reshape(1, -1)
-        latest_sequence_scaled = self.scaler.transform(latest_sequence)
+        latest_sequence_scaled = handle.scaler.transform(latest_sequence)
         latest_sequence_reshaped = latest_sequence_scaled.reshape((1, 1, latest_sequence_scaled.shape[1]))
 
-        prediction = self.model.predict(latest_sequence_reshaped, verbose=0)[0][0]
+        # 直接调用模型做前向计算：不会像predict()那样在实例上缓存可变的预测函数
+        with metrics.timed('model_predict'):
+            prediction = float(handle.model(latest_sequence_reshaped, training=False)[0][0])
         predicted_cycle = int(round(max(20, min(45, prediction))))
+        metrics.PREDICTIONS.inc(method='gru')
 
-        print(f"🤖 GRU预测周期长度: {predicted_cycle}天")
+        logger.debug("用户%s的GRU预测周期长度: %s天", user_id, predicted_cycle,
+                     extra={'user_id': user_id, 'cycle_length': predicted_cycle})
         return predicted_cycle
 
+    def predict_batch(self, records_by_user, stats=None):
+        """批量预测多个用户的下一个周期长度，返回{user_id: 周期天数}
+
+        有群体模型时所有用户一次前向计算（predict_global）；否则结构相同的NumPy用户模型会堆叠成
+        一个StackedGRUModel，一次前向计算完成整组用户。没有模型或数据不足的用户回退到加权平均。
+        传入stats字典时写入吞吐量统计。
+        """
+        started = time.perf_counter()
+        results = {}
+        global_handle = self.load_global_model()
+        global_members = []  # [(user_id, 周期长度序列)]
+        groups = {}  # 结构key -> [(user_id, handle, 最新特征行)]
+        legacy = []
+
+        for user_id, records in records_by_user.items():
+            if global_handle is not None:
+                cycles = self.cycle_lengths_from_records(records)
+                if len(cycles):
+                    global_members.append((user_id, cycles))
+                    continue
+            X, _ = self.create_features(records)
+            handle = self.load_model(user_id) if X is not None and len(X) else None
+            if handle is None:
+                results[user_id] = self.fallback_prediction(records)
+                continue
+            if isinstance(handle.model, NumpyGRUModel):
+                key = StackedGRUModel.group_key(handle.model)
+                groups.setdefault(key, []).append((user_id, handle, X[-1]))
+            else:
+                legacy.append((user_id, handle, X[-1]))
+
+        if global_members:
+            predictions = self.predict_global(global_handle, [cycles for _, cycles in global_members])
+            results.update(zip((user_id for user_id, _ in global_members), predictions))
+
+        for members in groups.values():
+            stacked = StackedGRUModel([m[1].model for m in members], [m[1].scaler for m in members])
+            features = stacked.transform(np.stack([m[2] for m in members]))
+            predictions = stacked.predict(features.reshape((len(members), 1, -1)))[:, 0]
+            for (user_id, _, _), prediction in zip(members, predictions):
+                results[user_id] = int(round(max(20, min(45, float(prediction)))))
+
+        # 尚未转换的.h5旧模型只能逐个计算
+        for user_id, handle, latest in legacy:
+            latest_scaled = handle.scaler.transform(latest.reshape(1, -1))
+            prediction = float(handle.model(latest_scaled.reshape((1, 1, -1)), training=False)[0][0])
+            results[user_id] = int(round(max(20, min(45, prediction))))
+
+        elapsed = time.perf_counter() - started
+        throughput = len(results) / elapsed if elapsed > 0 else float('inf')
+        logger.info("批量GRU预测%s个用户", len(results), extra={
+            'users': len(results),
+            'global_users': len(global_members),
+            'stacked_groups': len(groups),
+            'legacy_models': len(legacy),
+            'elapsed_ms': round(elapsed * 1000, 1),
+        })
+        if stats is not None:
+            stats.update({
+                'users': len(results),
+                'global_users': len(global_members),
+                'stacked_groups': len(groups),
+                'legacy_models': len(legacy),
+                'seconds': elapsed,
+                'users_per_second': throughput,
+            })
+        return results
+
     def fallback_prediction(self, records):
         """回退到加权平均法"""
-        from . import calculate_weighted_average_cycle
         return calculate_weighted_average_cycle(records)
 
 
@@ -160,67 +698,175 @@ class GRUPeriodPredictor:
 gru_predictor = GRUPeriodPredictor()
 
 
-def get_three_stage_predictions(user, records, profile, year, month):
+# 每次保存的预测周期数（预测范围），日历按日期范围查询其中与可见范围重叠的周期
+PREDICTION_CYCLES = settings.FORECAST_CYCLES
+
+
+def select_cycle_length(user, profile, stats):
     """
-    三阶段预测算法：
+    三阶段预测算法，返回Selection(周期长度, 方法说明, 方法, 各方法的周期长度)：
     阶段1 (1-3周期): 固定周期
     阶段2 (4-6周期): 加权平均
     阶段3 (7+周期): GRU神经网络
+    已训练群体模型时，阶段2和阶段3都使用群体模型 + 用户校准
+    GRU模型的近期误差（evaluation.rolling_errors）大于加权平均时改用加权平均，其余方法的结果仍保存在candidates中用于对比
     """
-    print(f"=== 三阶段预测算法启动 ===")
-
-    # 获取实际记录
-    actual_records = [r for r in records if not r.is_predicted]
-    if not actual_records:
-        return [], []
+    cycle_count = stats.cycle_count
 
-    sorted_actual = sorted(actual_records, key=lambda x: x.start_date)
-    cycle_count = len(sorted_actual) - 1
+    if stats.stage == UserCycleStats.STAGE_FIXED:
+        # 阶段1：固定周期
+        metrics.PREDICTIONS.inc(method='fixed')
+        return Selection(profile.cycle_length, f"固定周期（{cycle_count}个周期）", METHOD_FIXED, {})
 
-    print(f"📊 记录分析: {len(actual_records)}个记录, {cycle_count}个完整周期")
+    candidates = {METHOD_FIXED: profile.cycle_length, METHOD_WEIGHTED: stats.weighted_average_cycle()}
+    model_method = None
 
-    # 使用最新记录作为参考
-    latest_record = sorted_actual[-1]
-    reference_date = latest_record.end_date
+    if stats.cycle_lengths:
+        handle = gru_predictor.load_global_model()
+        if handle is not None:
+            try:
+                candidates[METHOD_GRU_GLOBAL] = gru_predictor.predict_global(handle, [stats.cycle_lengths])[0]
+                model_method = METHOD_GRU_GLOBAL
+            except Exception:
+                logger.exception("用户%s的群体模型预测失败", user.id, extra={'user_id': user.id})
 
-    # 三阶段算法选择
-    if cycle_count < 3:
-        # 阶段1：固定周期
-        cycle_length = profile.cycle_length
-        method = f"固定周期（{cycle_count}个周期）"
-    elif cycle_count < 7:
-        # 阶段2：加权平均
-        cycle_length = calculate_weighted_average_cycle(sorted_actual)
-        method = f"加权平均（{cycle_count}个周期）"
-    else:
+    if model_method is None and stats.stage == UserCycleStats.STAGE_GRU:
         # 阶段3：GRU神经网络
         try:
-            cycle_length = gru_predictor.predict_next_cycle(user.id, sorted_actual)
-            method = f"GRU神经网络（{cycle_count}个周期）"
-        except Exception as e:
-            print(f"❌ GRU预测失败: {e}，回退到加权平均")
-            cycle_length = calculate_weighted_average_cycle(sorted_actual)
-            method = f"加权平均（回退）"
+            cycle_length = gru_predictor.predict_from_stats(user.id, stats)
+            if cycle_length is not None:
+                candidates[METHOD_GRU] = cycle_length
+                model_method = METHOD_GRU
+        except Exception:
+            logger.exception("用户%s的GRU预测失败，回退到加权平均", user.id, extra={'user_id': user.id})
+            metrics.PREDICTIONS.inc(method='weighted_fallback')
+            return Selection(candidates[METHOD_WEIGHTED], "加权平均（回退）", METHOD_WEIGHTED, candidates)
+
+    if model_method is not None:
+        if better_method(rolling_errors(user), model_method, METHOD_WEIGHTED) == model_method:
+            if model_method == METHOD_GRU_GLOBAL:
+                metrics.PREDICTIONS.inc(method='gru_global')
+                description = f"GRU群体模型（{cycle_count}个周期）"
+            else:
+                description = f"GRU神经网络（{cycle_count}个周期）"
+            return Selection(candidates[model_method], description, model_method, candidates)
+        metrics.PREDICTIONS.inc(method='weighted_selected')
+        return Selection(candidates[METHOD_WEIGHTED], f"加权平均（近期误差更小，{cycle_count}个周期）",
+                         METHOD_WEIGHTED, candidates)
 
-    period_length = profile.period_length
+    # 阶段2：加权平均（阶段3模型尚未就绪时也使用加权平均）
+    if stats.stage == UserCycleStats.STAGE_WEIGHTED:
+        metrics.PREDICTIONS.inc(method='weighted')
+    return Selection(candidates[METHOD_WEIGHTED], f"加权平均（{cycle_count}个周期）", METHOD_WEIGHTED, candidates)
 
-    print(f"🔧 预测方法: {method}")
-    print(f"⏱️ 预测周期: {cycle_length}天")
 
-    # 计算预测周期
-    prediction_start = reference_date + timedelta(days=cycle_length)
-    prediction_end = prediction_start + timedelta(days=period_length - 1)
+@metrics.timed_function('refresh_predictions')
+def refresh_predictions(user, profile=None, stats=None):
+    """重新计算并保存用户的预测周期，返回按cycle_index排序的PeriodPrediction列表
 
-    next_prediction_start = prediction_start + timedelta(days=cycle_length)
-    next_prediction_end = next_prediction_start + timedelta(days=period_length - 1)
+    在记录或基础信息变化、GRU模型训练完成后调用，使预测计算离开页面读取路径
+    """
+    if profile is None:
+        profile = user_profile(user)
+    if stats is None:
+        stats = get_cycle_stats(user)
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        # 锁住用户的统计行，同一用户的刷新（页面读取、后台训练、导入）串行执行，不会写入两组预测；
+        # 等锁期间统计可能已被其他请求更新，此时改用最新的统计
+        locked = UserCycleStats.objects.select_for_update().filter(user=user).first()
+        if locked is not None and locked.data_version != stats.data_version:
+            stats = locked
+        PeriodPrediction.objects.filter(user=user, is_confirmed=False).delete()
+        if profile is None or not stats.record_count:
+            return []
+
+        selection = select_cycle_length(user, profile, stats)
+        cycle_length, method = selection.cycle_length, selection.method
+        period_length = profile.period_length
+
+        # 使用最新记录作为参考
+        based_on_record = latest_actual_record(user)
+
+        predictions = []
+        prediction_start = stats.last_end_date + timedelta(days=cycle_length)
+        for cycle_index in range(1, PREDICTION_CYCLES + 1):
+            predictions.append(PeriodPrediction(
+                user=user,
+                predicted_start=prediction_start,
+                predicted_end=prediction_start + timedelta(days=period_length - 1),
+                based_on_record=based_on_record,
+                cycle_index=cycle_index,
+                cycle_length=cycle_length,
+                method=method,
+                data_version=stats.data_version,
+                method_key=selection.key,
+                candidates=selection.candidates if cycle_index == 1 else {}
+            ))
+            prediction_start += timedelta(days=cycle_length)
+        PeriodPrediction.objects.bulk_create(predictions)
+
+    logger.info("用户%s的预测已更新: %s，周期%s天", user.id, method, cycle_length, extra={
+        'user_id': user.id,
+        'records': stats.record_count,
+        'cycles': stats.cycle_count,
+        'method': method,
+        'cycle_length': cycle_length,
+        'data_version': stats.data_version,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    })
+    return predictions
+
+
+def get_stored_predictions(user, profile, stats=None):
+    """读取已保存的预测；没有或data_version与当前统计不一致时重新计算"""
+    if stats is None:
+        stats = get_cycle_stats(user)
+    if not stats.record_count:
+        return []
+
+    predictions = list(current_predictions(user, stats.data_version))
+
+    if len(predictions) < PREDICTION_CYCLES:
+        predictions = refresh_predictions(user, profile, stats)
+    return predictions
+
+
+@metrics.timed_function('predictions_read')
+def get_predictions_in_range(user, profile, range_start, range_end, stats=None):
+    """
+    读取与[range_start, range_end]重叠的已保存预测（按cycle_index排序）
+
+    预测范围内任意月份都只是一次日期范围查询；预测未生成或不完整时重新计算
+    """
+    if stats is None:
+        stats = get_cycle_stats(user)
+    if not stats.record_count:
+        return []
 
-    # 生成目标月份内的日期
-    current_dates = generate_dates_in_month(prediction_start, prediction_end, year, month)
-    next_dates = generate_dates_in_month(next_prediction_start, next_prediction_end, year, month)
+    predictions = list(predictions_overlapping(user, stats.data_version, range_start, range_end, PREDICTION_CYCLES))
+    if not any(prediction.cycle_index == PREDICTION_CYCLES for prediction in predictions):
+        predictions = refresh_predictions(user, profile, stats)
+    return [
+        prediction for prediction in predictions
+        if prediction.predicted_start <= range_end and prediction.predicted_end >= range_start
+    ]
 
-    print(f"✅ 当前预测在目标月份内: {len(current_dates)}天")
-    print(f"✅ 下次预测在目标月份内: {len(next_dates)}天")
 
+def prediction_dates_in_month(predictions, year, month):
+    """
+    从已读取的预测中取出目标月份内的(当前预测日期, 后续预测日期)，多个月份可共用一次读取
+
+    第1个周期为当前预测，之后的周期都标记为后续预测
+    """
+    current_dates, next_dates = [], []
+    for prediction in predictions:
+        dates = generate_dates_in_month(prediction.predicted_start, prediction.predicted_end, year, month)
+        if prediction.cycle_index == 1:
+            current_dates.extend(dates)
+        else:
+            next_dates.extend(dates)
     return current_dates, next_dates
 
 
@@ -251,13 +897,19 @@ def calculate_weighted_average_cycle(records):
     return int(round(max(20, min(45, weighted_avg))))
 
 
-def generate_dates_in_month(start_date, end_date, year, month):
-    """生成指定月份内的日期列表"""
+def month_range(year, month):
+    """指定月份的第一天和最后一天"""
     target_start = datetime(year, month, 1).date()
     if month == 12:
         target_end = datetime(year + 1, 1, 1).date() - timedelta(days=1)
     else:
         target_end = datetime(year, month + 1, 1).date() - timedelta(days=1)
+    return target_start, target_end
+
+
+def generate_dates_in_month(start_date, end_date, year, month):
+    """生成指定月份内的日期列表"""
+    target_start, target_end = month_range(year, month)
 
     if end_date < target_start or start_date > target_end:
         return []
@@ -0,0 +1,82 @@
+from django.core.paginator import Paginator
+from django.db.models import Q
+from .models import PeriodPrediction, PeriodRecord, UserProfile
+
+
+# 记录列表每页条数
+RECORDS_PER_PAGE = 20
+
+
+def user_profile(user):
+    """用户基础信息，未设置时返回None
+
+    通过一对一反向访问读取，结果（包括不存在）缓存在user对象上；
+    request.user在一个请求内是同一个对象，所以每个请求最多查询一次，保存或新建profile时缓存随之更新
+    """
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.userprofile
+    except UserProfile.DoesNotExist:
+        return None
+
+
+def active_records(user):
+    """用户未删除的记录"""
+    return PeriodRecord.objects.filter(user=user, is_deleted=False)
+
+
+def records_in_window(user, window_start, window_end):
+    """与[window_start, window_end]有重叠的记录，用于日历标记（按开始日期倒序）"""
+    return active_records(user).filter(
+        start_date__lte=window_end,
+        end_date__gte=window_start
+    ).order_by('-start_date')
+
+
+def records_covering(user, day):
+    """包含day的未删除记录"""
+    return active_records(user).filter(start_date__lte=day, end_date__gte=day)
+
+
+def records_starting_between(user, first_day, last_day):
+    """开始日期在[first_day, last_day]内的未删除记录（按开始日期倒序）"""
+    return active_records(user).filter(
+        start_date__gte=first_day,
+        start_date__lte=last_day
+    ).order_by('-start_date')
+
+
+def paginated_records(user, page_number, per_page=RECORDS_PER_PAGE):
+    """记录列表的一页（按开始日期倒序），页码无效时返回第一页或最后一页"""
+    paginator = Paginator(active_records(user).order_by('-start_date'), per_page)
+    return paginator.get_page(page_number)
+
+
+def latest_actual_record(user):
+    """最近一条实际（非预测）记录，作为预测的参考记录"""
+    return PeriodRecord.objects.filter(
+        user=user,
+        is_deleted=False,
+        is_predicted=False
+    ).order_by('-start_date').first()
+
+
+def current_predictions(user, data_version):
+    """指定数据版本下未确认的预测（按cycle_index排序）"""
+    return PeriodPrediction.objects.filter(
+        user=user,
+        is_confirmed=False,
+        data_version=data_version
+    ).order_by('cycle_index')
+
+
+def predictions_overlapping(user, data_version, range_start, range_end, last_cycle):
+    """
+    指定数据版本下与[range_start, range_end]重叠的未确认预测（按cycle_index排序）
+
+    额外带上第last_cycle个周期，调用方据此判断预测是否已完整生成，不必再单独查询
+    """
+    return current_predictions(user, data_version).filter(
+        Q(predicted_start__lte=range_end, predicted_end__gte=range_start) | Q(cycle_index=last_cycle)
+    )
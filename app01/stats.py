@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.models import F
+from .models import PeriodRecord, UserCycleStats
+
+
+def rebuild_cycle_stats(user):
+    """根据用户全部实际记录重新计算统计（插入历史记录、修改开始日期、删除记录时使用）"""
+    with transaction.atomic():
+        stats, _ = UserCycleStats.objects.select_for_update().get_or_create(user=user)
+        stats.record_count = 0
+        stats.cycle_lengths = []
+        stats.weighted_sum = 0
+        stats.weight_total = 0
+        stats.last_start_date = None
+        stats.last_end_date = None
+
+        records = PeriodRecord.objects.filter(
+            user=user,
+            is_deleted=False,
+            is_predicted=False
+        ).order_by('start_date').values_list('start_date', 'end_date')
+
+        for start_date, end_date in records:
+            stats.append_record(start_date, end_date)
+        stats.stage = UserCycleStats.stage_for(stats.cycle_count)
+        stats.data_version += 1
+        stats.save()
+    return stats
+
+
+def get_cycle_stats(user):
+    """读取用户周期统计，不存在时（老用户首次访问）从记录重建"""
+    try:
+        return UserCycleStats.objects.get(user=user)
+    except UserCycleStats.DoesNotExist:
+        return rebuild_cycle_stats(user)
+
+
+def record_added(user, record):
+    """新增记录后更新统计：按时间追加的记录O(1)更新，插入到历史中间时重建"""
+    if record.is_predicted or record.is_deleted:
+        return get_cycle_stats(user)
+
+    with transaction.atomic():
+        stats = UserCycleStats.objects.select_for_update().filter(user=user).first()
+        if stats is not None and (stats.last_start_date is None or record.start_date > stats.last_start_date):
+            stats.append_record(record.start_date, record.end_date)
+            stats.data_version += 1
+            stats.save()
+            return stats
+    return rebuild_cycle_stats(user)
+
+
+def record_updated(user, record, old_start_date, old_is_predicted):
+    """修改或删除记录后更新统计
+
+    只改了结束日期时O(1)更新（最近一条记录还要更新last_end_date）；开始日期、确认状态变化或删除时重建
+    """
+    if (record.is_deleted or record.start_date != old_start_date
+            or record.is_predicted != old_is_predicted):
+        return rebuild_cycle_stats(user)
+
+    with transaction.atomic():
+        stats = UserCycleStats.objects.select_for_update().filter(user=user).first()
+        if stats is None:
+            return rebuild_cycle_stats(user)
+        if not record.is_predicted and record.start_date == stats.last_start_date:
+            stats.last_end_date = record.end_date
+        stats.data_version += 1
+        stats.save(update_fields=['last_end_date', 'data_version', 'updated_at'])
+    return stats
+
+
+def bump_data_version(user):
+    """基础信息变化时使已保存的预测失效"""
+    if not UserCycleStats.objects.filter(user=user).update(data_version=F('data_version') + 1):
+        rebuild_cycle_stats(user)
@@ -1,3 +1,838 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from unittest import mock
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.dateparse import parse_date
+from .evaluation import METHOD_GRU_GLOBAL, METHOD_WEIGHTED, update_accuracy
+from .exporters import stream_export
+from .gru_numpy import (ARTIFACT_EXTENSION, ModelPack, NumpyGRUModel, NumpyMinMaxScaler, StackedGRUModel,
+                        encode_artifact)
+from .management.commands.bench_features import SyntheticRecord, reference_create_features
+from .importers import import_records, parse_records, validate_records
+from .models import (PeriodPrediction, PeriodRecord, PredictionAccuracy, TrainingDecision, UserCycleStats,
+                     UserProfile)
+from .policy import RetrainPolicy
+from .predictor import (PREDICTION_CYCLES, TRAINING_MAX_CYCLES, GRUPeriodPredictor, ModelCache, ModelHandle,
+                        get_predictions_in_range, refresh_predictions, select_cycle_length)
+from .stats import bump_data_version, get_cycle_stats, rebuild_cycle_stats, record_added, record_updated
+from .training import TrainingQueue
+from .views import MAX_CALENDAR_MONTHS, build_user_calendars, cached_user_calendars
+from .queries import (active_records, current_predictions, latest_actual_record, predictions_overlapping,
+                      records_covering, records_in_window, records_starting_between)
 
-# Create your tests here.
+
+class QueryPlanTests(TestCase):
+    """页面和预测的热点查询应使用PeriodRecord/PeriodPrediction的复合部分索引，而不是扫描用户的全部记录"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('plan', 'plan@example.com', 'pw')
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        records = []
+        for owner in (cls.user, other):
+            start = date(2000, 1, 1)
+            for i in range(300):
+                records.append(PeriodRecord(
+                    user=owner,
+                    start_date=start,
+                    end_date=start + timedelta(days=4),
+                    is_predicted=i % 10 == 0,
+                    is_deleted=i % 25 == 0
+                ))
+                start += timedelta(days=28)
+        PeriodRecord.objects.bulk_create(records)
+        PeriodPrediction.objects.create(
+            user=cls.user,
+            predicted_start=date(2025, 1, 1),
+            predicted_end=date(2025, 1, 5),
+            cycle_index=1,
+            data_version=1
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor != 'sqlite':
+            self.skipTest('只检查SQLite的查询计划')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('SCAN app01_periodrecord\n', plan + '\n')
+
+    def test_calendar_window(self):
+        self.assertUsesIndex(records_in_window(self.user, date(2010, 5, 31), date(2010, 7, 11)),
+                             'record_active_user_start')
+
+    def test_records_page(self):
+        self.assertUsesIndex(active_records(self.user).order_by('-start_date')[20:40], 'record_active_user_start')
+
+    def test_period_info(self):
+        day = parse_date('2010-06-15')
+        self.assertUsesIndex(records_covering(self.user, day), 'record_active_user_start')
+        self.assertUsesIndex(records_starting_between(self.user, day - timedelta(days=14), day),
+                             'record_active_user_start')
+
+    def test_add_period_end_lookup(self):
+        day = parse_date('2010-06-15')
+        self.assertUsesIndex(records_starting_between(self.user, day - timedelta(days=30), day + timedelta(days=1)),
+                             'record_active_user_start')
+
+    def test_latest_actual_record(self):
+        self.assertUsesIndex(
+            PeriodRecord.objects.filter(user=self.user, is_deleted=False, is_predicted=False).order_by('-start_date')[:1],
+            'record_actual_user_start'
+        )
+        self.assertIsNotNone(latest_actual_record(self.user))
+
+    def test_current_predictions(self):
+        self.assertUsesIndex(current_predictions(self.user, 1), 'prediction_pending_version')
+        self.assertEqual(current_predictions(self.user, 1).count(), 1)
+
+    def test_predictions_in_range(self):
+        queryset = predictions_overlapping(self.user, 1, date(2024, 12, 29), date(2025, 2, 8), 12)
+        self.assertUsesIndex(queryset, 'prediction_pending_version')
+        self.assertEqual(len(queryset), 1)
+
+
+class CycleStatsTests(TestCase):
+    """record_added/record_updated的增量更新应与rebuild_cycle_stats从全部记录重建的结果一致"""
+
+    FIELDS = ('record_count', 'cycle_lengths', 'last_start_date', 'last_end_date', 'stage')
+
+    def setUp(self):
+        self.user = User.objects.create_user('stats', 'stats@example.com', 'pw')
+        rebuild_cycle_stats(self.user)
+
+    def add(self, start, days=5, **fields):
+        record = PeriodRecord.objects.create(user=self.user, start_date=start,
+                                             end_date=start + timedelta(days=days - 1), **fields)
+        record_added(self.user, record)
+        return record
+
+    def update(self, record, **fields):
+        old_start_date, old_is_predicted = record.start_date, record.is_predicted
+        for name, value in fields.items():
+            setattr(record, name, value)
+        record.save()
+        record_updated(self.user, record, old_start_date, old_is_predicted)
+
+    def assertMatchesRebuild(self):
+        incremental = UserCycleStats.objects.get(user=self.user)
+        rebuilt = rebuild_cycle_stats(self.user)
+        for name in self.FIELDS:
+            self.assertEqual(getattr(incremental, name), getattr(rebuilt, name), name)
+        self.assertAlmostEqual(incremental.weighted_sum, rebuilt.weighted_sum)
+        self.assertAlmostEqual(incremental.weight_total, rebuilt.weight_total)
+        self.assertAlmostEqual(incremental.weighted_average_cycle(), rebuilt.weighted_average_cycle())
+
+    def test_append(self):
+        start = date(2024, 1, 1)
+        for length in (28, 30, 27, 29, 31, 26, 28, 30):
+            self.add(start)
+            start += timedelta(days=length)
+        self.assertMatchesRebuild()
+        self.assertEqual(UserCycleStats.objects.get(user=self.user).stage, UserCycleStats.STAGE_GRU)
+
+    def test_out_of_range_gaps(self):
+        # 间隔少于20天或多于45天的记录计入记录数，但不产生周期
+        for start in (date(2024, 1, 1), date(2024, 1, 29), date(2024, 2, 8), date(2024, 4, 20),
+                      date(2024, 5, 18)):
+            self.add(start)
+        self.assertMatchesRebuild()
+        self.assertEqual(UserCycleStats.objects.get(user=self.user).cycle_lengths, [28, 28])
+
+    def test_backfill_into_past(self):
+        self.add(date(2024, 3, 1))
+        self.add(date(2024, 3, 29))
+        self.add(date(2024, 2, 2))
+        self.add(date(2024, 1, 5))
+        self.assertMatchesRebuild()
+
+    def test_predicted_record_is_ignored(self):
+        self.add(date(2024, 1, 1))
+        self.add(date(2024, 1, 29), is_predicted=True)
+        self.assertMatchesRebuild()
+        self.assertEqual(UserCycleStats.objects.get(user=self.user).record_count, 1)
+
+    def test_edit_end_date(self):
+        self.add(date(2024, 1, 1))
+        latest = self.add(date(2024, 1, 29))
+        self.update(latest, end_date=date(2024, 2, 4))
+        self.assertMatchesRebuild()
+        self.assertEqual(UserCycleStats.objects.get(user=self.user).last_end_date, date(2024, 2, 4))
+
+    def test_edit_start_date(self):
+        first = self.add(date(2024, 1, 1))
+        self.add(date(2024, 1, 29))
+        self.add(date(2024, 2, 26))
+        self.update(first, start_date=date(2023, 12, 30))
+        self.assertMatchesRebuild()
+
+    def test_delete(self):
+        self.add(date(2024, 1, 1))
+        middle = self.add(date(2024, 1, 29))
+        latest = self.add(date(2024, 2, 26))
+        self.update(middle, is_deleted=True)
+        self.assertMatchesRebuild()
+        self.update(latest, is_deleted=True)
+        self.assertMatchesRebuild()
+        self.assertEqual(UserCycleStats.objects.get(user=self.user).last_start_date, date(2024, 1, 1))
+
+
+class ModelCacheTests(SimpleTestCase):
+    """冷加载只统计一次未命中，加载锁用完即释放"""
+
+    def test_cold_load_counts_one_miss(self):
+        predictor = GRUPeriodPredictor()
+        loads = []
+
+        def read():
+            loads.append(1)
+            return object(), object()
+
+        first = predictor._load_handle(1, 100.0, read)
+        second = predictor._load_handle(1, 100.0, read)
+        self.assertIs(first, second)
+        self.assertEqual(len(loads), 1)
+        stats = predictor.model_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(predictor.model_cache._load_locks, {})
+
+    def test_rewritten_model_reloads(self):
+        predictor = GRUPeriodPredictor()
+        first = predictor._load_handle(1, 100.0, lambda: (object(), object()))
+        second = predictor._load_handle(1, 200.0, lambda: (object(), object()))
+        self.assertIsNot(first, second)
+        self.assertEqual(predictor.model_cache.stats()['misses'], 2)
+
+    def test_evicts_least_recently_used(self):
+        model_cache = ModelCache(max_size=2)
+        for user_id in (1, 2):
+            model_cache.put(ModelHandle(user_id, 100.0, object(), object()))
+        model_cache.get(1, 100.0)
+        model_cache.put(ModelHandle(3, 100.0, object(), object()))
+        self.assertIsNone(model_cache.get(2, 100.0))
+        self.assertIsNotNone(model_cache.get(1, 100.0))
+        self.assertIsNotNone(model_cache.get(3, 100.0))
+        self.assertEqual((model_cache.stats()['size'], model_cache.stats()['evictions']), (2, 1))
+
+    def test_expires_by_age(self):
+        model_cache = ModelCache(max_age=60)
+        with mock.patch('app01.predictor.time.monotonic', return_value=1000.0):
+            model_cache.put(ModelHandle(1, 100.0, object(), object()))
+        with mock.patch('app01.predictor.time.monotonic', return_value=1059.0):
+            self.assertIsNotNone(model_cache.get(1, 100.0))
+        with mock.patch('app01.predictor.time.monotonic', return_value=1061.0):
+            self.assertIsNone(model_cache.get(1, 100.0))
+        self.assertEqual((model_cache.stats()['size'], model_cache.stats()['evictions']), (0, 1))
+
+
+class TrainingQueueTests(TestCase):
+    """同一用户的重复触发合并为一个任务，数据未变化时不重复训练"""
+
+    def setUp(self):
+        self.queue = TrainingQueue()
+        self.user = User.objects.create_user('queue', 'queue@example.com', 'pw')
+        UserProfile.objects.create(user=self.user, cycle_length=28, period_length=5)
+        start = date(2024, 1, 1)
+        for _ in range(9):
+            PeriodRecord.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+            start += timedelta(days=29)
+        rebuild_cycle_stats(self.user)
+
+    def test_coalesces_pending_jobs(self):
+        with mock.patch.object(self.queue, '_ensure_worker'):
+            self.assertTrue(self.queue.enqueue(1))
+            self.assertFalse(self.queue.enqueue(1))
+            self.assertTrue(self.queue.enqueue(2))
+        self.assertTrue(self.queue.is_pending(1))
+        stats = self.queue.stats()
+        self.assertEqual((stats['pending'], stats['enqueued'], stats['coalesced']), (2, 2, 1))
+
+    def test_drops_unchanged_data(self):
+        with mock.patch('app01.predictor.gru_predictor.has_global_model', return_value=False), \
+                mock.patch('app01.predictor.gru_predictor.train_from_cycles', return_value=True) as train:
+            self.queue._run_job(self.user.id)
+            self.queue._run_job(self.user.id)
+            self.assertEqual(train.call_count, 1)
+
+            start = UserCycleStats.objects.get(user=self.user).last_start_date + timedelta(days=29)
+            record = PeriodRecord.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+            record_added(self.user, record)
+            self.queue._run_job(self.user.id)
+            self.assertEqual(train.call_count, 2)
+        stats = self.queue.stats()
+        self.assertEqual((stats['completed'], stats['dropped']), (2, 1))
+
+    def test_signatures_are_bounded(self):
+        queue = TrainingQueue(max_trained=2)
+        for user_id in (1, 2, 1, 3):
+            queue._remember(user_id, (user_id, None))
+        self.assertEqual(list(queue._trained), [1, 3])
+
+    def test_drops_with_global_model(self):
+        with mock.patch('app01.predictor.gru_predictor.has_global_model', return_value=True), \
+                mock.patch('app01.predictor.gru_predictor.train_from_cycles') as train:
+            self.queue._run_job(self.user.id)
+        train.assert_not_called()
+        self.assertEqual(self.queue.stats()['dropped'], 1)
+
+
+def random_artifact(seed, n_features=12):
+    """与build_model结构相同（单元数较少）、权重随机的模型，返回(层结构, {数组名: float32数组})"""
+    rng = np.random.default_rng(seed)
+
+    def weights(*shape):
+        return rng.normal(scale=0.5, size=shape).astype(np.float32)
+
+    layers = [
+        {'type': 'gru', 'units': 8, 'activation': 'tanh', 'recurrent_activation': 'sigmoid',
+         'reset_after': True, 'return_sequences': True},
+        {'type': 'gru', 'units': 4, 'activation': 'tanh', 'recurrent_activation': 'sigmoid',
+         'reset_after': True, 'return_sequences': False},
+        {'type': 'dense', 'activation': 'linear'},
+        {'type': 'dense', 'activation': 'linear'},
+    ]
+    arrays = {
+        'scaler_min': weights(n_features),
+        'scaler_scale': np.abs(weights(n_features)) + 0.01,
+        'l0_kernel': weights(n_features, 24), 'l0_recurrent_kernel': weights(8, 24), 'l0_bias': weights(2, 24),
+        'l1_kernel': weights(8, 12), 'l1_recurrent_kernel': weights(4, 12), 'l1_bias': weights(2, 12),
+        'l2_kernel': weights(4, 3), 'l2_bias': weights(3),
+        'l3_kernel': weights(3, 1), 'l3_bias': weights(1),
+    }
+    return layers, arrays
+
+
+class ModelArtifactTests(SimpleTestCase):
+    """.gru文件和分片文件的读写：重新加载后的预测逐位一致，损坏的文件被拒绝"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.inputs = np.random.default_rng(0).random((16, 1, 12), dtype=np.float32)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def expected(self, layers, arrays):
+        weights = {key: value for key, value in arrays.items() if key.startswith('l')}
+        return NumpyGRUModel(layers, weights).predict(arrays['scaler_min'] + self.inputs * arrays['scaler_scale'])
+
+    def test_round_trip(self):
+        layers, arrays = random_artifact(1)
+        path = self.write(f'user_1{ARTIFACT_EXTENSION}', encode_artifact(layers, arrays, {'user_id': 1}))
+        model, scaler = NumpyGRUModel.load(path)
+        np.testing.assert_array_equal(model.predict(scaler.transform(self.inputs)), self.expected(layers, arrays))
+        self.assertEqual(model.metadata, {'user_id': 1})
+
+    def test_rejects_other_version(self):
+        data = bytearray(encode_artifact(*random_artifact(1)))
+        data[4] += 1  # 格式版本紧跟在magic之后
+        with self.assertRaisesMessage(ValueError, '版本'):
+            NumpyGRUModel.load(self.write('user_1.gru', bytes(data)))
+
+    def test_rejects_truncated_file(self):
+        data = encode_artifact(*random_artifact(1))
+        for size in (8, 64, len(data) // 2):
+            with self.subTest(size=size), self.assertRaisesMessage(ValueError, '不完整'):
+                NumpyGRUModel.load(self.write('user_1.gru', data[:size]))
+
+    def test_pack_round_trip(self):
+        artifacts = {user_id: random_artifact(user_id) for user_id in (3, 19, 35)}
+        path = os.path.join(self.dir, 'shard_003.gpk')
+        ModelPack.write(path, {user_id: encode_artifact(*artifact) for user_id, artifact in artifacts.items()})
+
+        pack = ModelPack(path)
+        self.assertNotIn(4, pack)
+        for user_id, (layers, arrays) in artifacts.items():
+            self.assertIn(user_id, pack)
+            model, scaler = pack.load(user_id)
+            np.testing.assert_array_equal(model.predict(scaler.transform(self.inputs)), self.expected(layers, arrays))
+
+        # 重新打包后内容不变
+        repacked = os.path.join(self.dir, 'shard_003_repacked.gpk')
+        ModelPack.write(repacked, pack.artifacts())
+        self.assertEqual(ModelPack(repacked).artifacts(), pack.artifacts())
+
+    def test_pack_rejects_artifact(self):
+        path = self.write('shard_000.gpk', encode_artifact(*random_artifact(1)))
+        with self.assertRaises(ValueError):
+            ModelPack(path)
+
+
+def numpy_model(seed):
+    layers, arrays = random_artifact(seed)
+    scaler = NumpyMinMaxScaler(arrays.pop('scaler_min'), arrays.pop('scaler_scale'))
+    return NumpyGRUModel(layers, arrays), scaler
+
+
+class ConstantModel:
+    """群体模型的替身：每个窗口都预测同一个周期长度"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, inputs, training=False):
+        return np.full((len(inputs), 1), self.value, dtype=np.float32)
+
+
+class NumpyInferenceTests(SimpleTestCase):
+    """NumPy推理路径与逐个计算/循环实现的结果一致"""
+
+    def setUp(self):
+        self.predictor = GRUPeriodPredictor()
+
+    def test_stacked_matches_single_models(self):
+        models = [numpy_model(seed) for seed in range(5)]
+        X = np.random.default_rng(0).normal(28, 3, size=(5, 12))
+        stacked = StackedGRUModel([model for model, _ in models], [scaler for _, scaler in models])
+        batch = stacked.predict(stacked.transform(X).reshape((5, 1, -1)))
+        for index, (model, scaler) in enumerate(models):
+            single = model.predict(scaler.transform(X[index:index + 1]).reshape((1, 1, -1)))
+            np.testing.assert_allclose(batch[index], single[0], rtol=1e-5, atol=1e-6)
+
+    def test_features_match_loop(self):
+        rng = np.random.default_rng(0)
+        for count in (0, 1, 5, 6, 7, 40):
+            cycles = [int(length) for length in rng.integers(22, 40, size=count)]
+            records = [SyntheticRecord(date(2020, 1, 1) + timedelta(days=sum(cycles[:i]))) for i in range(count + 1)]
+            with self.subTest(cycles=count):
+                expected_X, expected_y = reference_create_features(records, self.predictor.sequence_length)
+                X, y = self.predictor.create_features_from_cycles(cycles)
+                if expected_X is None:
+                    self.assertEqual((X, y), (None, None))
+                else:
+                    np.testing.assert_allclose(X, expected_X)
+                    np.testing.assert_array_equal(y, expected_y)
+                    np.testing.assert_allclose(self.predictor.create_features(records)[0], expected_X)
+
+    def test_global_calibration(self):
+        scaler = NumpyMinMaxScaler(np.zeros(12, dtype=np.float32), np.ones(12, dtype=np.float32))
+        handle = ModelHandle('global', 0.0, ConstantModel(28.0), scaler)
+        # 残差[2, 2]按[0.8, 1]加权，再加上2个残差为0的虚拟样本：28 + 3.6 / 3.8 ≈ 28.95
+        self.assertEqual(self.predictor.predict_global(handle, [[30, 30, 30], [28]]), [29, 28])
+
+    def test_global_prediction_is_clamped(self):
+        scaler = NumpyMinMaxScaler(np.zeros(12, dtype=np.float32), np.ones(12, dtype=np.float32))
+        for value, expected in ((90.0, 45), (5.0, 20)):
+            handle = ModelHandle('global', 0.0, ConstantModel(value), scaler)
+            self.assertEqual(self.predictor.predict_global(handle, [[30]]), [expected])
+
+
+class GlobalModelSelectionTests(TestCase):
+    """已训练群体模型时阶段2使用群体模型，没有群体模型或预测失败时使用加权平均"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('global', 'global@example.com', 'pw')
+        self.profile = UserProfile.objects.create(user=self.user, cycle_length=28, period_length=5)
+        start = date(2024, 1, 1)
+        for length in (30, 31, 29, 30):
+            PeriodRecord.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+            start += timedelta(days=length)
+        PeriodRecord.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+        self.stats = rebuild_cycle_stats(self.user)
+        scaler = NumpyMinMaxScaler(np.zeros(12, dtype=np.float32), np.ones(12, dtype=np.float32))
+        self.handle = ModelHandle('global', 0.0, ConstantModel(90.0), scaler)
+
+    def select(self, handle):
+        with mock.patch('app01.predictor.gru_predictor.load_global_model', return_value=handle):
+            return select_cycle_length(self.user, self.profile, self.stats)
+
+    def test_global_model(self):
+        selection = self.select(self.handle)
+        self.assertEqual((selection.key, selection.cycle_length), (METHOD_GRU_GLOBAL, 45))
+        self.assertEqual(selection.candidates[METHOD_WEIGHTED], self.stats.weighted_average_cycle())
+
+    def test_no_global_model(self):
+        selection = self.select(None)
+        self.assertEqual((selection.key, selection.cycle_length),
+                         (METHOD_WEIGHTED, self.stats.weighted_average_cycle()))
+        self.assertNotIn(METHOD_GRU_GLOBAL, selection.candidates)
+
+    def test_global_model_failure(self):
+        self.handle = self.handle._replace(model=mock.Mock(side_effect=RuntimeError('boom')))
+        with self.assertLogs('app01.predictor', 'ERROR'):
+            selection = self.select(self.handle)
+        self.assertEqual(selection.key, METHOD_WEIGHTED)
+
+
+class AppendedCyclesTests(SimpleTestCase):
+    """训练窗口滑动后仍能识别只在末尾追加了周期的历史"""
+
+    def setUp(self):
+        self.predictor = GRUPeriodPredictor()
+        self.cycles = [26 + i % 5 for i in range(TRAINING_MAX_CYCLES + 40)]
+        window = self.cycles[-TRAINING_MAX_CYCLES:]
+        self.metadata = {
+            'cycles_total': len(self.cycles),
+            'cycles_used': len(window),
+            'cycles_digest': self.predictor.cycles_digest(window),
+        }
+
+    def test_appended(self):
+        self.assertEqual(self.predictor.appended_cycles(self.metadata, self.cycles), 0)
+        self.assertEqual(self.predictor.appended_cycles(self.metadata, self.cycles + [28, 29]), 2)
+
+    def test_history_changed(self):
+        edited = list(self.cycles)
+        edited[-5] += 1
+        self.assertIsNone(self.predictor.appended_cycles(self.metadata, edited + [28]))
+        self.assertIsNone(self.predictor.appended_cycles(self.metadata, self.cycles[:-1]))
+        self.assertIsNone(self.predictor.appended_cycles(self.metadata, self.cycles[1:] + [28]))
+
+    def test_legacy_metadata(self):
+        self.assertIsNone(self.predictor.appended_cycles({'samples': 10, 'cycles_digest': 'x'}, self.cycles))
+
+
+class RetrainPolicyTests(SimpleTestCase):
+    """RetrainPolicy.decide的各个分支及检查顺序"""
+
+    def setUp(self):
+        self.policy = RetrainPolicy(min_new_samples=3, error_days=3, min_interval=timedelta(hours=1),
+                                    max_model_age=timedelta(days=90))
+        self.cycles = [26 + i % 5 for i in range(20)]
+        predictor = GRUPeriodPredictor()
+        self.metadata = {
+            'trained_at': datetime.now().isoformat(timespec='seconds'),
+            'samples': 14,
+            'cycles_total': 20,
+            'cycles_used': 20,
+            'cycles_digest': predictor.cycles_digest(self.cycles),
+        }
+
+    def decide(self, cycles=None, metadata='default', **kwargs):
+        cycles = self.cycles if cycles is None else cycles
+        metadata = self.metadata if metadata == 'default' else metadata
+        return self.policy.decide(len(cycles), cycles, metadata, **kwargs)
+
+    def test_reasons(self):
+        edited = [27] + self.cycles[1:]
+        old = dict(self.metadata, trained_at=(datetime.now() - timedelta(days=100)).isoformat(timespec='seconds'))
+        worse = {'gru': (4.0, 5), 'weighted': (2.0, 5)}
+        cases = [
+            ('too_few_cycles', 'skip', dict(cycles=self.cycles[:5])),
+            ('global_model', 'skip', dict(has_global_model=True)),
+            ('pending', 'skip', dict(pending=True)),
+            ('no_model', 'train', dict(metadata=None)),
+            ('no_metadata', 'train', dict(metadata={'samples': 14, 'trained_at': self.metadata['trained_at']})),
+            ('history_changed', 'train', dict(cycles=edited + [28])),
+            ('history_changed', 'train', dict(cycles=self.cycles[:-1])),
+            ('no_new_samples', 'skip', dict()),
+            ('prediction_error', 'train', dict(cycles=self.cycles + [28], prediction_error=3)),
+            ('new_samples', 'train', dict(cycles=self.cycles + [28, 29, 30])),
+            ('model_age', 'train', dict(cycles=self.cycles + [28], metadata=old)),
+            ('underperforming', 'train', dict(cycles=self.cycles + [28], errors=worse)),
+            ('within_tolerance', 'skip', dict(cycles=self.cycles + [28], prediction_error=2,
+                                              errors={'gru': (1.0, 5), 'weighted': (2.0, 5)})),
+        ]
+        for reason, action, kwargs in cases:
+            with self.subTest(reason=reason, kwargs=kwargs):
+                decision = self.decide(**kwargs)
+                self.assertEqual((decision.reason, decision.action), (reason, action))
+
+    def test_cooldown_comes_before_history_changed(self):
+        decision = self.decide(cycles=[27] + self.cycles[1:], since_last_train=timedelta(minutes=5))
+        self.assertEqual(decision.reason, 'cooldown')
+        decision = self.decide(cycles=[27] + self.cycles[1:], since_last_train=timedelta(hours=2))
+        self.assertEqual(decision.reason, 'history_changed')
+
+    def test_cooldown_blocks_thresholds(self):
+        decision = self.decide(cycles=self.cycles + [28, 29, 30], prediction_error=10,
+                               since_last_train=timedelta(minutes=5))
+        self.assertEqual((decision.reason, decision.new_samples), ('cooldown', 3))
+
+    def test_threshold_order(self):
+        # 预测误差优先于新增周期数，新增周期数优先于模型年龄和滚动误差
+        old = dict(self.metadata, trained_at=(datetime.now() - timedelta(days=100)).isoformat(timespec='seconds'))
+        worse = {'gru': (4.0, 5), 'weighted': (2.0, 5)}
+        self.assertEqual(self.decide(cycles=self.cycles + [28, 29, 30], prediction_error=5).reason,
+                         'prediction_error')
+        self.assertEqual(self.decide(cycles=self.cycles + [28, 29, 30], metadata=old, errors=worse).reason,
+                         'new_samples')
+        self.assertEqual(self.decide(cycles=self.cycles + [28], metadata=old, errors=worse).reason, 'model_age')
+
+    def test_underperforming_needs_enough_samples(self):
+        errors = {'gru': (4.0, 2), 'weighted': (2.0, 5)}
+        self.assertEqual(self.decide(cycles=self.cycles + [28], errors=errors).reason, 'within_tolerance')
+
+
+class PruneTrainingDecisionsTests(TestCase):
+    """只删除超过保留天数的重训练决定"""
+
+    def test_prune(self):
+        user = User.objects.create_user('prune', 'prune@example.com', 'pw')
+        for days in (1, 10, 100):
+            decision = TrainingDecision.objects.create(user=user, action=TrainingDecision.ACTION_TRAIN, reason='x')
+            TrainingDecision.objects.filter(pk=decision.pk).update(created_at=decision.created_at - timedelta(days=days))
+        call_command('prune_training_decisions', days=30, stdout=mock.Mock())
+        self.assertEqual(TrainingDecision.objects.filter(user=user).count(), 2)
+        with self.assertRaises(CommandError):
+            call_command('prune_training_decisions', days=0, stdout=mock.Mock())
+
+
+class ImportParserTests(SimpleTestCase):
+    """导入文件解析：CSV、JSON（列表、records对象、NDJSON）和iCalendar"""
+
+    def test_csv_reads_only_records(self):
+        content = ('type,start_date,end_date\r\nprofile,,\r\nrecord,2024-01-01,2024-01-05\r\n'
+                   'record,2024-01-29,\r\nprediction,2024-02-26,2024-03-01\r\n')
+        self.assertEqual(parse_records(content, 'csv'),
+                         [(date(2024, 1, 1), date(2024, 1, 5)), (date(2024, 1, 29), None)])
+
+    def test_csv_requires_start_date(self):
+        with self.assertRaises(ValueError):
+            parse_records('date\n2024-01-01\n', 'csv')
+
+    def test_json_list_and_envelope(self):
+        expected = [(date(2024, 1, 1), date(2024, 1, 5))]
+        self.assertEqual(parse_records('[{"start_date": "2024-01-01", "end_date": "2024-01-05"}]', 'json'),
+                         expected)
+        self.assertEqual(parse_records('{"records": [{"start_date": "2024-01-01", "end_date": "2024-01-05"}]}',
+                                       'json'), expected)
+
+    def test_ndjson(self):
+        content = ('{"type": "profile", "cycle_length": 28}\n'
+                   '{"type": "record", "start_date": "2024-01-01", "end_date": "2024-01-05"}\n\n'
+                   '{"type": "record", "start_date": "2024-01-29"}\n'
+                   '{"type": "prediction", "start_date": "2024-02-26", "end_date": "2024-03-01"}\n')
+        self.assertEqual(parse_records(content.encode('utf-8'), 'json'),
+                         [(date(2024, 1, 1), date(2024, 1, 5)), (date(2024, 1, 29), None)])
+
+    def test_single_line_ndjson(self):
+        self.assertEqual(parse_records('{"type": "record", "start_date": "2024-01-01"}\n', 'json'),
+                         [(date(2024, 1, 1), None)])
+
+    def test_json_errors(self):
+        for content in ('{"type": "record"}', '[1, 2]', '{"start_date": "2024-01-01"}\n[1]\n',
+                        '{"start_date": "2024-01-01"}\nnot json\n', '{"records": 1}',
+                        '[{"start_date": "01/02/2024"}]'):
+            with self.subTest(content=content), self.assertRaises(ValueError):
+                parse_records(content, 'json')
+
+    def test_ics(self):
+        content = ('BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nDTSTART;VALUE=DATE:20240101\r\n'
+                   'DTEND;VALUE=DATE:20240106\r\nCATEGORIES:PERIOD\r\nEND:VEVENT\r\n'
+                   'BEGIN:VEVENT\r\nDTSTART;VALUE=DATE:20240129\r\nDTEND;VALUE=DATE:20240203\r\n'
+                   'CATEGORIES:PREDICTION\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n')
+        self.assertEqual(parse_records(content, 'ics'), [(date(2024, 1, 1), date(2024, 1, 5))])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            parse_records('', 'xlsx')
+
+
+class ExportRoundTripTests(TestCase):
+    """导出后再导入只得到实际记录，预测和预测占位记录不会变成实际记录"""
+
+    def test_round_trip(self):
+        user = User.objects.create_user('export', 'export@example.com', 'pw')
+        PeriodRecord.objects.create(user=user, start_date=date(2024, 1, 1), end_date=date(2024, 1, 5))
+        PeriodRecord.objects.create(user=user, start_date=date(2024, 1, 29), end_date=date(2024, 2, 2),
+                                    is_predicted=True)
+        PeriodPrediction.objects.create(user=user, predicted_start=date(2024, 2, 26),
+                                        predicted_end=date(2024, 3, 1))
+        for export_format in ('csv', 'json', 'ics'):
+            with self.subTest(export_format=export_format):
+                content = ''.join(stream_export(user, export_format)).encode('utf-8')
+                self.assertEqual(parse_records(content, export_format), [(date(2024, 1, 1), date(2024, 1, 5))])
+
+
+class ImportValidationTests(TestCase):
+    """导入校验：重复跳过，过长、倒置和重叠的记录报错"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('import', 'import@example.com', 'pw')
+        PeriodRecord.objects.create(user=self.user, start_date=date(2024, 1, 1), end_date=date(2024, 1, 5))
+
+    def test_valid_rows(self):
+        records, skipped, errors = validate_records(
+            self.user, [(date(2024, 1, 1), None), (date(2024, 1, 29), None), (date(2024, 2, 26), date(2024, 3, 1))], 5)
+        self.assertEqual((skipped, errors), (1, []))
+        self.assertEqual([(r.start_date, r.end_date) for r in records],
+                         [(date(2024, 1, 29), date(2024, 2, 2)), (date(2024, 2, 26), date(2024, 3, 1))])
+
+    def test_invalid_rows(self):
+        _, _, errors = validate_records(self.user, [
+            (date(2024, 2, 10), date(2024, 2, 5)),  # 结束早于开始
+            (date(2024, 3, 1), date(2024, 3, 20)),  # 超过14天
+            (date(2024, 1, 3), None),  # 与已有记录重叠
+            (date(2024, 4, 1), None), (date(2024, 4, 3), None),  # 彼此重叠
+        ], 5)
+        self.assertEqual(len(errors), 4)
+
+    def test_import_survives_policy_failure(self):
+        profile = UserProfile.objects.create(user=self.user, cycle_length=28, period_length=5)
+        rows = [(date(2024, 1, 29), None), (date(2024, 2, 26), None)]
+        with mock.patch('app01.policy.retrain_policy.evaluate', side_effect=RuntimeError('boom')), \
+                self.assertLogs('app01.policy', 'ERROR'):
+            result = import_records(self.user, profile, rows)
+        self.assertEqual(result['imported'], 2)
+        self.assertTrue(PeriodPrediction.objects.filter(user=self.user, is_confirmed=False).exists())
+
+
+class MetricsEndpointTests(TestCase):
+    """/metrics/只凭令牌访问，不信任REMOTE_ADDR"""
+
+    @override_settings(METRICS_TOKEN='')
+    def test_disabled_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_requires_token(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'periodai_requests', response.content)
+
+
+class CalendarTests(TestCase):
+    """日历缓存按数据版本失效，JSON接口校验参数并返回连续的月份"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('calendar', 'calendar@example.com', 'pw')
+        self.profile = UserProfile.objects.create(user=self.user, cycle_length=28, period_length=5)
+        for start in (date(2024, 1, 1), date(2024, 1, 30)):
+            record = PeriodRecord.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+            record_added(self.user, record)
+        self.client.force_login(self.user)
+
+    def test_data_version_invalidates_cache(self):
+        today = date(2024, 3, 1)
+        with mock.patch('app01.views.build_user_calendars', wraps=build_user_calendars) as build:
+            cached_user_calendars(self.user, self.profile, get_cycle_stats(self.user), [(2024, 2)], today)
+            cached_user_calendars(self.user, self.profile, get_cycle_stats(self.user), [(2024, 2)], today)
+            self.assertEqual(build.call_count, 1)
+            bump_data_version(self.user)
+            cached_user_calendars(self.user, self.profile, get_cycle_stats(self.user), [(2024, 2)], today)
+            self.assertEqual(build.call_count, 2)
+
+    def test_fragment_cache_follows_data_version(self):
+        def period_days():
+            response = self.client.get(reverse('index'), {'year': 2024, 'month': 3})
+            return response.context['calendar_cache_key'], response.content.count(b'data-is-period="True"')
+
+        key, before = period_days()
+        self.assertEqual(period_days(), (key, before))
+        record = PeriodRecord.objects.create(user=self.user, start_date=date(2024, 3, 10), end_date=date(2024, 3, 14))
+        record_added(self.user, record)
+        new_key, after = period_days()
+        self.assertNotEqual(new_key, key)
+        self.assertEqual(after - before, 5)
+
+    def test_calendar_range(self):
+        response = self.client.get(reverse('calendar_range'), {'year': 2024, 'month': 12, 'months': 3}).json()
+        self.assertTrue(response['success'])
+        self.assertEqual([(m['year'], m['month']) for m in response['months']], [(2024, 12), (2025, 1), (2025, 2)])
+        self.assertEqual(response['data_version'], get_cycle_stats(self.user).data_version)
+        days = [day for week in response['months'][0]['weeks'] for day in week if day['current_month']]
+        self.assertEqual(len(days), 31)
+
+    def test_calendar_range_validation(self):
+        for params in ({'months': 0}, {'months': MAX_CALENDAR_MONTHS + 1}, {'month': 13}, {'year': 'x'}):
+            with self.subTest(params=params):
+                self.assertFalse(self.client.get(reverse('calendar_range'), params).json()['success'])
+        self.assertEqual(len(self.client.get(reverse('calendar_range'), {'months': MAX_CALENDAR_MONTHS})
+                             .json()['months']), MAX_CALENDAR_MONTHS)
+
+
+class PredictionRangeTests(TestCase):
+    """日期范围读取覆盖全部PREDICTION_CYCLES个预测周期，不只是第1个"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('range', 'range@example.com', 'pw')
+        self.profile = UserProfile.objects.create(user=self.user, cycle_length=28, period_length=5)
+        for start in (date(2024, 1, 1), date(2024, 1, 29)):
+            record = PeriodRecord.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+            record_added(self.user, record)
+        self.predictions = refresh_predictions(self.user, self.profile)
+
+    def in_range(self, start, end):
+        return get_predictions_in_range(self.user, self.profile, start, end)
+
+    def test_later_cycles(self):
+        self.assertEqual(len(self.predictions), PREDICTION_CYCLES)
+        for prediction in (self.predictions[1], self.predictions[-1]):
+            found = self.in_range(prediction.predicted_start, prediction.predicted_start)
+            self.assertEqual([p.cycle_index for p in found], [prediction.cycle_index])
+        last_end = self.predictions[-1].predicted_end
+        self.assertEqual(self.in_range(last_end + timedelta(days=1), last_end + timedelta(days=60)), [])
+
+    def test_incomplete_predictions_regenerated(self):
+        PeriodPrediction.objects.filter(user=self.user, cycle_index=PREDICTION_CYCLES).delete()
+        last = self.predictions[-1]
+        found = self.in_range(last.predicted_start, last.predicted_end)
+        self.assertEqual([p.cycle_index for p in found], [PREDICTION_CYCLES])
+        self.assertEqual(PeriodPrediction.objects.filter(user=self.user, is_confirmed=False).count(),
+                         PREDICTION_CYCLES)
+
+
+class PredictionAccuracyTests(TestCase):
+    """误差统计按用户和全部用户各一行累加"""
+
+    def test_totals_row_is_unique(self):
+        first = User.objects.create_user('acc1', 'acc1@example.com', 'pw')
+        second = User.objects.create_user('acc2', 'acc2@example.com', 'pw')
+        update_accuracy(first, 'gru', 2)
+        update_accuracy(second, 'gru', 4)
+        total = PredictionAccuracy.objects.get(user=None, method='gru')
+        self.assertEqual((total.count, total.error_sum), (2, 6))
+        self.assertAlmostEqual(total.rolling_mae, (2 * PredictionAccuracy.ERROR_DECAY + 4)
+                               / (PredictionAccuracy.ERROR_DECAY + 1))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PredictionAccuracy.objects.create(user=None, method='gru')
+
+
+class AddPeriodStartTests(TestCase):
+    """标记经期开始：确认当前预测并更新误差统计，误差统计失败时记录仍然保存"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('start', 'start@example.com', 'pw')
+        UserProfile.objects.create(user=self.user, cycle_length=28, period_length=5)
+        for start in (date(2024, 1, 1), date(2024, 1, 29), date(2024, 2, 26), date(2024, 3, 25)):
+            PeriodRecord.objects.create(user=self.user, start_date=start, end_date=start + timedelta(days=4))
+        refresh_predictions(self.user, stats=rebuild_cycle_stats(self.user))
+        self.predicted = current_predictions(self.user, UserCycleStats.objects.get(user=self.user).data_version)[0]
+        self.client.force_login(self.user)
+
+    def post(self, start):
+        return self.client.post(reverse('add_period_start'), {'start_date': start.isoformat()}).json()
+
+    def test_confirms_prediction(self):
+        actual = self.predicted.predicted_start + timedelta(days=2)
+        self.assertTrue(self.post(actual)['success'])
+        confirmed = PeriodPrediction.objects.get(pk=self.predicted.pk)
+        self.assertTrue(confirmed.is_confirmed)
+        self.assertEqual((confirmed.actual_start, confirmed.error_days), (actual, 2))
+        accuracy = PredictionAccuracy.objects.get(user=self.user, method=confirmed.method_key)
+        self.assertEqual((accuracy.count, accuracy.last_error), (1, 2))
+        self.assertTrue(PredictionAccuracy.objects.filter(user=None, method='fixed').exists())
+
+    def test_refresh_keeps_one_pending_set(self):
+        stats = UserCycleStats.objects.get(user=self.user)
+        refresh_predictions(self.user, stats=stats)
+        refresh_predictions(self.user, stats=stats)
+        pending = PeriodPrediction.objects.filter(user=self.user, is_confirmed=False)
+        self.assertEqual(pending.count(), PREDICTION_CYCLES)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PeriodPrediction.objects.create(user=self.user, predicted_start=date(2030, 1, 1),
+                                            predicted_end=date(2030, 1, 5), cycle_length=28, cycle_index=1)
+
+    def test_record_saved_when_accuracy_fails(self):
+        actual = self.predicted.predicted_start
+        with mock.patch('app01.views.record_actual', side_effect=RuntimeError('boom')):
+            self.assertTrue(self.post(actual)['success'])
+        self.assertTrue(PeriodRecord.objects.filter(user=self.user, start_date=actual).exists())
+        self.assertEqual(UserCycleStats.objects.get(user=self.user).last_start_date, actual)
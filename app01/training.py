@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from django.conf import settings
+from django.db import close_old_connections
+from .stats import bump_data_version
+
+
+logger = logging.getLogger(__name__)
+
+
+# GRU阶段所需的最少完整周期数
+MIN_GRU_CYCLES = 7
+
+# 使用群体模型所需的最少完整周期数（与加权平均阶段的起点一致）
+MIN_GLOBAL_GRU_CYCLES = 3
+
+# 最多记住这么多个用户上次训练所用数据的签名，超出时淘汰最久未训练的用户（之后最多多训练一次）
+MAX_TRAINED_SIGNATURES = 1024
+
+
+class TrainingQueue:
+    """后台GRU训练队列：请求只登记任务立即返回，由后台线程串行训练
+
+    - 同一用户在排队期间的重复触发合并为一个任务
+    - 取出任务时若数据自上次训练后未变化（或已不足训练条件），直接丢弃
+    - 训练完成前预测器继续使用旧模型或加权平均
+    """
+
+    def __init__(self, max_trained=MAX_TRAINED_SIGNATURES):
+        self._jobs = {}  # 任务表 user_id -> 最近一次触发时间
+        self._order = deque()
+        self._running = None
+        self._trained = OrderedDict()  # user_id -> 上次训练所用数据的签名，按训练时间排序
+        self.max_trained = max_trained
+        self._cond = threading.Condition()
+        self._thread = None
+        self.enqueued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def enqueue(self, user_id):
+        """登记训练任务，返回是否新建了任务（False表示与已有任务合并）"""
+        if not getattr(settings, 'GRU_TRAINING_ASYNC', True):
+            self._run_job(user_id)
+            return True
+
+        with self._cond:
+            if user_id in self._jobs:
+                self._jobs[user_id] = time.time()
+                self.coalesced += 1
+                return False
+            self._jobs[user_id] = time.time()
+            self._order.append(user_id)
+            self.enqueued += 1
+            self._ensure_worker()
+            self._cond.notify()
+            return True
+
+    def is_pending(self, user_id):
+        with self._cond:
+            return user_id in self._jobs or self._running == user_id
+
+    def wait_idle(self, timeout=None):
+        """等待队列清空（管理命令和调试用）"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._jobs or self._running is not None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._jobs),
+                'running': self._running,
+                'enqueued': self.enqueued,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, name='gru-training', daemon=True)
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._order:
+                    self._cond.wait()
+                user_id = self._order.popleft()
+                self._jobs.pop(user_id, None)
+                self._running = user_id
+
+            close_old_connections()
+            try:
+                self._run_job(user_id)
+            finally:
+                close_old_connections()
+                with self._cond:
+                    self._running = None
+                    self._cond.notify_all()
+
+    def _run_job(self, user_id):
+        """执行单个训练任务：总是读取最新的周期统计，避免用过期数据训练"""
+        from .models import UserCycleStats
+        from .predictor import gru_predictor, refresh_predictions
+
+        try:
+            # 已有群体模型时用户只需在预测时校准，不再单独训练
+            if gru_predictor.has_global_model():
+                self.dropped += 1
+                return
+
+            # 与重训练策略使用同一份周期序列（全部历史），训练窗口的位置记录在模型元数据中
+            stats = UserCycleStats.objects.select_related('user').filter(user_id=user_id).first()
+
+            signature = (stats.record_count, stats.last_start_date) if stats is not None else None
+            if stats is None or stats.cycle_count < MIN_GRU_CYCLES or self._trained_signature(user_id) == signature:
+                self.dropped += 1
+                return
+
+            logger.info("后台训练用户%s的GRU模型，周期数: %s", user_id, stats.cycle_count,
+                        extra={'user_id': user_id, 'cycles': stats.cycle_count})
+            if gru_predictor.train_from_cycles(user_id, stats.cycle_lengths):
+                self._remember(user_id, signature)
+                self.completed += 1
+                # 新模型就绪，递增数据版本（使缓存的日历失效）并重新生成已保存的预测
+                bump_data_version(stats.user)
+                refresh_predictions(stats.user)
+            else:
+                # 数据不足也记录签名，数据不变时不再重复尝试
+                self._remember(user_id, signature)
+                self.failed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("用户%s后台训练失败", user_id, extra={'user_id': user_id})
+
+
+    def _trained_signature(self, user_id):
+        with self._cond:
+            return self._trained.get(user_id)
+
+    def _remember(self, user_id, signature):
+        with self._cond:
+            self._trained[user_id] = signature
+            self._trained.move_to_end(user_id)
+            while len(self._trained) > self.max_trained:
+                self._trained.popitem(last=False)
+
+
+# 全局训练队列实例
+training_queue = TrainingQueue()
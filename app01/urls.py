@@ -13,6 +13,10 @@ urlpatterns = [
     path('period/info/', views.get_period_info, name='get_period_info'),
     path('period/adjust/', views.adjust_period, name='adjust_period'),
     path('period/predictions/', views.get_prediction_info, name='get_prediction_info'),  # 新增
+    path('metrics/', views.prometheus_metrics, name='metrics'),
+    path('period/calendar/', views.calendar_range, name='calendar_range'),
+    path('period/import/', views.import_periods, name='import_periods'),
+    path('period/export/', views.export_periods, name='export_periods'),
     path('period/delete/<int:record_id>/', views.delete_period, name='delete_period'),
     path('period/edit/', views.period_edit, name='period_edit'),
     path('period/delete-account/', views.period_delete, name='period_delete'),
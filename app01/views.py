@@ -1,24 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from datetime import datetime, timedelta
 from .models import PeriodRecord, UserProfile, PeriodPrediction
-from .predictor import get_three_stage_predictions  # 导入新的预测函数
+from .predictor import (get_predictions_in_range, get_stored_predictions, prediction_dates_in_month,
+                        refresh_predictions)  # 导入新的预测函数
+from .policy import evaluate_retraining
+from .stats import bump_data_version, get_cycle_stats, record_added, record_updated
+from . import metrics
+from .evaluation import record_actual
+from .exporters import EXPORT_FORMATS, stream_export
+from .importers import detect_format, import_records, parse_records
+from .queries import (paginated_records, records_covering, records_in_window, records_starting_between,
+                      user_profile)
 import calendar as cal
 import json
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# 日历接口单次最多返回的月数
+MAX_CALENDAR_MONTHS = 24
 
 
 def index(request):
     """首页 - 使用三阶段预测算法"""
-    # 检查用户是否已登录但未设置基础信息
-    if request.user.is_authenticated:
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-        except UserProfile.DoesNotExist:
-            return redirect('set_profile')
+    # 检查用户是否已登录但未设置基础信息（本次请求内只读取一次）
+    profile = user_profile(request.user)
+    if request.user.is_authenticated and profile is None:
+        return redirect('set_profile')
 
     # 获取当前日期
     today = timezone.now().date()
@@ -36,87 +55,22 @@ def index(request):
         year = today.year
         month = today.month
 
-    # 生成日历数据
-    calendar_data = generate_calendar(year, month)
-
     # 如果用户已登录，获取经期记录和预测
-    period_dates = []
     period_records = []
-    current_prediction_dates = []
-    next_prediction_dates = []
-
-    if request.user.is_authenticated:
-        try:
-            profile = UserProfile.objects.get(user=request.user)
-            # 获取用户的经期记录（未删除的）
-            records = PeriodRecord.objects.filter(user=request.user, is_deleted=False)
-            period_records = list(records.order_by('-start_date'))
-
-            # 获取实际经期日期
-            for record in records:
-                current_date = record.start_date
-                while current_date <= record.end_date:
-                    period_info = {
-                        'date': current_date,
-                        'is_predicted': record.is_predicted,
-                        'is_confirmed': not record.is_predicted
-                    }
-                    period_dates.append(period_info)
-                    current_date += timedelta(days=1)
-
-            # 使用三阶段预测算法
-            if records.exists() and profile.cycle_length and profile.period_length:
-                current_prediction_dates, next_prediction_dates = get_three_stage_predictions(
-                    user=request.user,
-                    records=period_records,
-                    profile=profile,
-                    year=year,
-                    month=month
-                )
-
-                print(f"=== 视图层预测结果 ===")
-                print(f"目标月份: {year}年{month}月")
-                print(f"当前预测天数: {len(current_prediction_dates)}")
-                print(f"下次预测天数: {len(next_prediction_dates)}")
-
-        except UserProfile.DoesNotExist:
-            print("用户没有基础信息，跳过预测")
-            pass
-
-    # 标记日历中的日期状态
-    for week in calendar_data:
-        for day in week:
-            if day['date']:
-                # 重置状态
-                day.update({
-                    'is_period': False,
-                    'is_predicted_period': False,
-                    'is_confirmed_period': False,
-                    'is_current_prediction': False,
-                    'is_next_prediction': False,
-                    'is_today': day['date'] == today,
-                    'is_future': day['date'] > today
-                })
-
-                # 检查是否是实际经期
-                for period_info in period_dates:
-                    if day['date'] == period_info['date']:
-                        day['is_period'] = True
-                        day['is_predicted_period'] = period_info['is_predicted']
-                        day['is_confirmed_period'] = period_info['is_confirmed']
-                        break
-
-                # 检查是否是当前预测周期
-                for pred_date in current_prediction_dates:
-                    if day['date'] == pred_date:
-                        day['is_current_prediction'] = True
-                        break
-
-                # 检查是否是下次预测周期
-                for next_pred_date in next_prediction_dates:
-                    if day['date'] == next_pred_date:
-                        day['is_next_prediction'] = True
-                        break
+    records_page = None
+    data_version = None
+
+    if profile is not None:
+        # 记录列表分页显示
+        records_page = paginated_records(request.user, request.GET.get('page'))
+        period_records = list(records_page.object_list)
+
+        # 标记好的日历按数据版本缓存
+        stats = get_cycle_stats(request.user)
+        data_version = stats.data_version
+        calendar_data = cached_user_calendars(request.user, profile, stats, [(year, month)], today)[(year, month)]
+    else:
+        calendar_data = mark_calendar(generate_calendar(year, month), {}, [], [], today)
 
     # 计算上下月导航
     if month == 1:
@@ -132,6 +86,8 @@ def index(request):
     # 准备上下文数据
     context = {
         'calendar_data': calendar_data,
+        'calendar_cache_key': calendar_cache_key(request.user.id, data_version, year, month, today),
+        'calendar_cache_ttl': settings.CALENDAR_CACHE_TTL,
         'current_year': year,
         'current_month': month,
         'month_name': cal.month_name[month],
@@ -140,6 +96,7 @@ def index(request):
         'next_year': next_year,
         'next_month': next_month,
         'period_records': period_records,
+        'records_page': records_page,
         'today': today,
         'range_15_23': list(range(15, 24)),
         'range_24_32': list(range(24, 33)),
@@ -149,11 +106,8 @@ def index(request):
     }
 
     # 如果用户已登录，添加用户信息到上下文
-    if request.user.is_authenticated:
-        try:
-            context['user_profile'] = UserProfile.objects.get(user=request.user)
-        except UserProfile.DoesNotExist:
-            pass
+    if profile is not None:
+        context['user_profile'] = profile
 
     return render(request, 'index.html', context)
 
@@ -162,8 +116,6 @@ def get_dynamic_predictions(user, records, profile, year, month):
     """
     最终修复版：集成验证和调试
     """
-    print(f"=== 智能预测计算开始 ===")
-
     # 首先验证预测方法
     cycle_count = validate_prediction_method(records)
 
@@ -182,24 +134,20 @@ def get_dynamic_predictions(user, records, profile, year, month):
         # 固定间隔方法
         cycle_length = profile.cycle_length
         method_note = f"固定间隔（{cycle_count}个周期）"
-        print(f"🎯 使用方法: {method_note}")
     else:
         # 加权平均方法
         cycle_length = calculate_weighted_average_cycle(sorted_actual)
         method_note = f"加权平均（基于{cycle_count}个周期）"
-        print(f"🎯 使用方法: {method_note}")
 
     # 计算预测
     period_length = profile.period_length
     prediction_start = reference_date + timedelta(days=cycle_length)
     prediction_end = prediction_start + timedelta(days=period_length - 1)
 
-    print(f"🔮 最终预测: {prediction_start} 至 {prediction_end}")
-    print(f"📝 方法说明: {method_note}")
+    logger.debug("预测%s至%s（%s）", prediction_start, prediction_end, method_note)
 
     # 生成日期
     predicted_dates = generate_dates_in_month(prediction_start, prediction_end, year, month)
-    print(f"✅ 在目标月份内的预测天数: {len(predicted_dates)}")
 
     return predicted_dates, []
 
@@ -208,13 +156,10 @@ def calculate_weighted_average_cycle(records):
     计算加权平均周期长度
     近期周期权重更高
     """
-    print(f"=== 加权平均计算开始 ===")
-
     # 确保记录按时间排序
     sorted_records = sorted(records, key=lambda x: x.start_date)
 
     if len(sorted_records) < 2:
-        print("❌ 需要至少2个记录才能计算周期")
         return 28  # 默认值
 
     # 计算每个周期长度
@@ -227,18 +172,15 @@ def calculate_weighted_average_cycle(records):
         # 只保留合理范围的周期（15-45天）
         if 15 <= days_between <= 45:
             cycle_lengths.append(days_between)
-            print(f"周期{i}: {prev_start} 到 {curr_start} = {days_between}天")
 
     if not cycle_lengths:
-        print("❌ 无有效周期数据")
         return 28  # 默认值
 
-    print(f"有效周期数据: {cycle_lengths}")
+    logger.debug("有效周期数据: %s", cycle_lengths)
 
     # 如果周期数量少于2个，使用简单平均
     if len(cycle_lengths) < 2:
         avg_cycle = sum(cycle_lengths) / len(cycle_lengths)
-        print(f"周期数不足，使用简单平均: {avg_cycle:.1f}天")
         return int(round(avg_cycle))
 
     # 加权平均计算：近期周期权重更高
@@ -250,7 +192,6 @@ def calculate_weighted_average_cycle(records):
         # 权重衰减因子：0.7^(n-i-1)
         weight = 0.7 ** (n - i - 1)
         weights.append(weight)
-        print(f"周期{i + 1}权重: {weight:.3f}")
 
     # 归一化权重
     total_weight = sum(weights)
@@ -260,7 +201,6 @@ def calculate_weighted_average_cycle(records):
     weighted_sum = 0
     for length, weight in zip(cycle_lengths, normalized_weights):
         weighted_sum += length * weight
-        print(f"周期{length}天 × 权重{weight:.3f} = {length * weight:.2f}")
 
     weighted_avg = weighted_sum
     cycle_length = int(round(weighted_avg))
@@ -268,8 +208,8 @@ def calculate_weighted_average_cycle(records):
     # 限制在合理范围内
     cycle_length = max(20, min(60, cycle_length))
 
-    print(f"📊 加权平均计算: {weighted_avg:.2f} → {cycle_length}天")
-    print(f"📈 最终周期长度: {cycle_length}天")
+    logger.debug("加权平均周期%.2f天，取%s天（权重%s）", weighted_avg, cycle_length,
+                 [round(w, 3) for w in normalized_weights])
 
     return cycle_length
 
@@ -296,88 +236,162 @@ def validate_prediction_stage(records):
 
     # 在预测函数中添加验证
     stage, method, cycle_count = validate_prediction_stage(records)
-    print(f"✅ 预测阶段验证: {stage} - {method} (周期数: {cycle_count})")
+    logger.debug("预测阶段验证: %s - %s（周期数: %s）", stage, method, cycle_count)
 
-def mark_calendar_dates(calendar_data, records, current_prediction_dates, next_prediction_dates, year, month):
+def calendar_cache_key(user_id, data_version, year, month, today):
+    """日历缓存键；包含today，跨天后“今天”和“未来”的标记会自动更新"""
+    return f"calendar:{user_id}:{data_version}:{year}-{month}:{today.isoformat()}"
+
+
+def build_user_calendars(user, profile, stats, months, today):
     """
-    关键函数：正确标记日历日期，确保颜色显示不消失
-    保持与index.html模板完全兼容的数据结构
+    生成并标记用户多个月的日历（经期记录 + 三阶段预测），返回{(年, 月): 日历数据}
+
+    所有月份共用一次记录查询（覆盖全部可见范围）和一次预测读取
+    """
+    calendars = {(year, month): generate_calendar(year, month) for year, month in months}
+
+    # 只查询与各月可见范围（约6周）重叠的记录
+    windows = [calendar_window(calendar_data) for calendar_data in calendars.values()]
+    window_start = min(start for start, _ in windows)
+    window_end = max(end for _, end in windows)
+    with metrics.timed('calendar_records'):
+        window_records = list(records_in_window(user, window_start, window_end))
+        period_days = build_period_days(window_records, window_start, window_end)
+
+    # 使用三阶段预测算法（输入来自增量维护的周期统计），只读取与可见范围重叠的预测周期
+    predictions = []
+    if profile.cycle_length and profile.period_length:
+        predictions = get_predictions_in_range(user, profile, window_start, window_end, stats)
+
+    with metrics.timed('calendar_mark'):
+        for (year, month), calendar_data in calendars.items():
+            current_prediction_dates, next_prediction_dates = prediction_dates_in_month(predictions, year, month)
+            mark_calendar(calendar_data, period_days, current_prediction_dates, next_prediction_dates, today)
+    return calendars
+
+
+def cached_user_calendars(user, profile, stats, months, today):
     """
-    print("=== 开始标记日历日期 ===")
+    读取标记好的日历，{(年, 月): 日历数据}
 
-    # 准备经期日期列表
-    period_dates = []
+    按数据版本缓存：记录或基础信息变化会递增data_version，旧缓存不再命中；未命中的月份一次性生成
+    """
+    keys = {calendar_cache_key(user.id, stats.data_version, year, month, today): (year, month)
+            for year, month in months}
+    cached = cache.get_many(keys.keys())
+    calendars = {keys[key]: calendar_data for key, calendar_data in cached.items()}
+
+    missing = [month for key, month in keys.items() if key not in cached]
+    metrics.CACHE_EVENTS.inc(len(cached), cache='calendar', result='hit')
+    metrics.CACHE_EVENTS.inc(len(missing), cache='calendar', result='miss')
+    if missing:
+        started = time.perf_counter()
+        built = build_user_calendars(user, profile, stats, missing, today)
+        logger.debug("用户%s生成%s个月的日历", user.id, len(missing), extra={
+            'user_id': user.id,
+            'months': len(missing),
+            'cache_hits': len(cached),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        })
+        cache.set_many(
+            {calendar_cache_key(user.id, stats.data_version, year, month, today): built[(year, month)]
+             for year, month in missing},
+            settings.CALENDAR_CACHE_TTL
+        )
+        calendars.update(built)
+    return calendars
+
+
+def calendar_window(calendar_data):
+    """日历可见范围（约6周）的第一天和最后一天"""
+    return calendar_data[0][0]['date'], calendar_data[-1][-1]['date']
+
+
+def build_period_days(records, window_start, window_end):
+    """
+    把记录展开为 {日期: 是否为预测记录}，只展开与可见范围重叠的部分
+    多条记录覆盖同一天时以先出现的记录为准（与原逐条匹配的结果一致）
+    """
+    period_days = {}
     for record in records:
-        current_date = record.start_date
-        while current_date <= record.end_date:
-            period_dates.append({
-                'date': current_date,
-                'is_predicted': record.is_predicted,
-                'is_confirmed': not record.is_predicted
-            })
+        if record.end_date < window_start or record.start_date > window_end:
+            continue
+        current_date = max(record.start_date, window_start)
+        last_date = min(record.end_date, window_end)
+        while current_date <= last_date:
+            period_days.setdefault(current_date, record.is_predicted)
             current_date += timedelta(days=1)
+    return period_days
 
-    print(f"经期日期数量: {len(period_dates)}")
-    print(f"当前预测日期数量: {len(current_prediction_dates)}")
-    print(f"下次预测日期数量: {len(next_prediction_dates)}")
+
+def mark_calendar(calendar_data, period_days, current_prediction_dates, next_prediction_dates, today):
+    """按日期查字典/集合原地标记日历，耗时只与可见天数有关"""
+    current_prediction_set = set(current_prediction_dates)
+    next_prediction_set = set(next_prediction_dates)
+    for week in calendar_data:
+        for day in week:
+            if day['date']:
+                # 重置状态
+                day.update({
+                    'is_period': False,
+                    'is_predicted_period': False,
+                    'is_confirmed_period': False,
+                    'is_current_prediction': day['date'] in current_prediction_set,
+                    'is_next_prediction': day['date'] in next_prediction_set,
+                    'is_today': day['date'] == today,
+                    'is_future': day['date'] > today
+                })
+
+                # 检查是否是实际经期
+                is_predicted = period_days.get(day['date'])
+                if is_predicted is not None:
+                    day['is_period'] = True
+                    day['is_predicted_period'] = is_predicted
+                    day['is_confirmed_period'] = not is_predicted
+    return calendar_data
+
+
+def mark_calendar_dates(calendar_data, records, current_prediction_dates, next_prediction_dates, year, month):
+    """
+    关键函数：正确标记日历日期，确保颜色显示不消失
+    保持与index.html模板完全兼容的数据结构
+    """
+    # 只展开日历可见范围内的经期日期，按日期直接查找
+    period_days = build_period_days(records, *calendar_window(calendar_data))
+    current_prediction_set = set(current_prediction_dates)
+    next_prediction_set = set(next_prediction_dates)
 
     today = timezone.now().date()
     marked_calendar_data = []
 
     # 标记每个日期
-    for week_index, week in enumerate(calendar_data):
+    for week in calendar_data:
         marked_week = []
-        for day_index, day in enumerate(week):
+        for day in week:
             marked_day = day.copy()  # 复制原始数据
 
             if marked_day['date']:
-                # 重置所有标记
+                date = marked_day['date']
+                is_predicted = period_days.get(date)
+                is_period = is_predicted is not None
+
+                # 经期日期优先级最高，其次是当前预测，最后是下次预测
+                is_current_prediction = not is_period and date in current_prediction_set
                 marked_day.update({
-                    'is_period': False,
-                    'is_predicted_period': False,
-                    'is_confirmed_period': False,
-                    'is_current_prediction': False,
-                    'is_next_prediction': False,
-                    'is_today': marked_day['date'] == today,
-                    'is_future': marked_day['date'] > today
+                    'is_period': is_period,
+                    'is_predicted_period': bool(is_predicted),
+                    'is_confirmed_period': is_period and not is_predicted,
+                    'is_current_prediction': is_current_prediction,
+                    'is_next_prediction': (not is_period and not is_current_prediction
+                                           and date in next_prediction_set),
+                    'is_today': date == today,
+                    'is_future': date > today
                 })
 
-                # 标记经期日期（最高优先级）
-                for period_info in period_dates:
-                    if marked_day['date'] == period_info['date']:
-                        marked_day['is_period'] = True
-                        marked_day['is_predicted_period'] = period_info['is_predicted']
-                        marked_day['is_confirmed_period'] = period_info['is_confirmed']
-                        break
-
-                # 如果不是经期，标记预测日期
-                if not marked_day['is_period']:
-                    # 标记当前预测
-                    for pred_date in current_prediction_dates:
-                        if marked_day['date'] == pred_date:
-                            marked_day['is_current_prediction'] = True
-                            break
-
-                    # 标记下次预测
-                    if not marked_day['is_current_prediction']:
-                        for next_pred_date in next_prediction_dates:
-                            if marked_day['date'] == next_pred_date:
-                                marked_day['is_next_prediction'] = True
-                                break
-
             marked_week.append(marked_day)
         marked_calendar_data.append(marked_week)
 
-    # 调试：统计标记结果
-    period_count = sum(1 for week in marked_calendar_data for day in week
-                       if day.get('is_period'))
-    current_pred_count = sum(1 for week in marked_calendar_data for day in week
-                             if day.get('is_current_prediction'))
-    next_pred_count = sum(1 for week in marked_calendar_data for day in week
-                          if day.get('is_next_prediction'))
-
-    print(f"标记完成 - 经期: {period_count}, 当前预测: {current_pred_count}, 下次预测: {next_pred_count}")
-
     return marked_calendar_data
 
 def generate_dates_in_month(start_date, end_date, year, month):
@@ -597,10 +611,7 @@ def period_logout(request):
 def set_profile(request):
     """设置用户基础信息 - 修复版本"""
     # 检查用户是否已有基础信息
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-    except UserProfile.DoesNotExist:
-        profile = None
+    profile = user_profile(request.user)
 
     # 创建15-45的范围列表
     range_15_45 = list(range(15, 46))  # 15到45（包含45）
@@ -643,6 +654,8 @@ def set_profile(request):
                     cycle_length=cycle_length,
                     period_length=period_length
                 )
+            bump_data_version(request.user)
+            refresh_predictions(request.user, profile)
 
             return redirect('index')
         except ValueError:
@@ -684,17 +697,19 @@ def set_profile_ajax(request):
                 })
 
             # 保存或更新用户基础信息
-            try:
-                profile = UserProfile.objects.get(user=request.user)
+            profile = user_profile(request.user)
+            if profile:
                 profile.cycle_length = cycle_length
                 profile.period_length = period_length
                 profile.save()
-            except UserProfile.DoesNotExist:
+            else:
                 profile = UserProfile.objects.create(
                     user=request.user,
                     cycle_length=cycle_length,
                     period_length=period_length
                 )
+            bump_data_version(request.user)
+            refresh_predictions(request.user, profile)
 
             return JsonResponse({'success': True, 'message': '基础信息保存成功'})
         except ValueError:
@@ -717,12 +732,7 @@ def get_period_info(request):
             is_start_possible = True
 
             # 检查是否已有包含该日期的经期记录
-            existing_records = PeriodRecord.objects.filter(
-                user=user,
-                start_date__lte=date,
-                end_date__gte=date,
-                is_deleted=False
-            )
+            existing_records = records_covering(user, date)
 
             if existing_records.exists():
                 is_start_possible = False
@@ -732,12 +742,7 @@ def get_period_info(request):
             end_candidate_records = []
             fourteen_days_ago = date - timedelta(days=14)
 
-            records_for_end = PeriodRecord.objects.filter(
-                user=user,
-                start_date__gte=fourteen_days_ago,
-                start_date__lte=date,
-                is_deleted=False
-            )
+            records_for_end = records_starting_between(user, fourteen_days_ago, date)
 
             for record in records_for_end:
                 # 允许调整任何在14天内的记录
@@ -772,6 +777,7 @@ def adjust_period(request):
 
         try:
             record = PeriodRecord.objects.get(id=record_id, user=request.user)
+            old_start_date, old_is_predicted = record.start_date, record.is_predicted
 
             if action == 'start' and start_date_str:
                 new_start = datetime.strptime(start_date_str, '%Y-%m-%d').date()
@@ -813,6 +819,9 @@ def adjust_period(request):
                 })
 
             record.save()
+            stats = record_updated(request.user, record, old_start_date, old_is_predicted)
+            evaluate_retraining(request.user, stats, 'adjust_period')
+            refresh_predictions(request.user, stats=stats)
 
             return JsonResponse({
                 'success': True,
@@ -837,12 +846,17 @@ def add_period_start(request):
         try:
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
             user = request.user
-            profile = UserProfile.objects.get(user=user)
+            profile = user_profile(user)
+            if profile is None:
+                return JsonResponse({'success': False, 'message': '请先设置基础信息'})
 
             # 计算预测结束日期
             period_length = profile.period_length
             predicted_end_date = start_date + timedelta(days=period_length - 1)
 
+            # 新增记录之前的统计：确认预测时用它找到当时的预测
+            previous_stats = get_cycle_stats(user)
+
             # 创建经期记录
             period = PeriodRecord.objects.create(
                 user=user,
@@ -850,29 +864,19 @@ def add_period_start(request):
                 end_date=predicted_end_date,
                 is_predicted=False
             )
+            stats = record_added(user, period)
 
-            # 检查是否需要训练GRU模型
+            # 用实际开始日期确认当前预测（refresh_predictions之前，旧预测仍在），更新各方法的误差统计；
+            # 误差统计失败不影响记录的保存
+            prediction_error = None
             try:
-                records = PeriodRecord.objects.filter(
-                    user=user,
-                    is_deleted=False
-                ).order_by('start_date')
-
-                actual_records = [r for r in records if not r.is_predicted]
-                cycle_count = len(actual_records) - 1
-
-                # 当周期数达到7个时训练GRU模型
-                if cycle_count >= 7:
-                    print(f"🤖 触发GRU模型训练，周期数: {cycle_count}")
-                    from .predictor import gru_predictor
-                    success = gru_predictor.train_model(user.id, actual_records)
-                    if success:
-                        print("✅ GRU模型训练完成")
-                    else:
-                        print("❌ GRU模型训练失败")
-
-            except Exception as e:
-                print(f"GRU模型训练跳过: {e}")
+                prediction_error = record_actual(user, start_date, previous_stats)
+            except Exception:
+                logger.exception("用户%s的预测误差统计失败", user.id, extra={'user_id': user.id})
+
+            # 先由重训练策略决定是否训练，再刷新预测
+            evaluate_retraining(user, stats, 'add_period_start', prediction_error)
+            refresh_predictions(user, profile, stats)
 
             return JsonResponse({
                 'success': True,
@@ -887,89 +891,156 @@ def add_period_start(request):
     return JsonResponse({'success': False, 'message': '无效请求'})
 
 
-def update_predictions(user, confirmed_start_date):
-    """更新预测记录 - 当用户确认经期开始时调用"""
+def add_months(year, month, count):
+    """从year年month月起偏移count个月"""
+    index = year * 12 + month - 1 + count
+    return index // 12, index % 12 + 1
+
+
+def serialize_calendar(calendar_data):
+    """日历数据转为JSON可序列化的周列表，字段与index模板使用的一致"""
+    return [[{
+        'date': day['date'].isoformat(),
+        'day': day['day'],
+        'current_month': day['current_month'],
+        'is_period': day['is_period'],
+        'is_current_prediction': day['is_current_prediction'],
+        'is_next_prediction': day['is_next_prediction'],
+        'is_today': day['is_today'],
+        'is_future': day['is_future'],
+    } for day in week] for week in calendar_data]
+
+
+@login_required
+def calendar_range(request):
+    """从year年month月起连续months个月的标记日历（JSON），前端用来预取相邻月份，切换月份时不必重新加载页面"""
+    today = timezone.now().date()
     try:
-        profile = UserProfile.objects.get(user=user)
-        cycle_length = profile.cycle_length
-        period_length = profile.period_length
+        year = int(request.GET.get('year', today.year))
+        month = int(request.GET.get('month', today.month))
+        months = int(request.GET.get('months', 12))
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'message': '参数必须是整数'})
+    if not 1 <= month <= 12 or not 1 <= months <= MAX_CALENDAR_MONTHS:
+        return JsonResponse({'success': False, 'message': f'月份应为1-12，月数应为1-{MAX_CALENDAR_MONTHS}'})
+
+    profile = user_profile(request.user)
+    if profile is None:
+        return JsonResponse({'success': False, 'message': '请先设置基础信息'})
+
+    month_list = [add_months(year, month, offset) for offset in range(months)]
+    stats = get_cycle_stats(request.user)
+    calendars = cached_user_calendars(request.user, profile, stats, month_list, today)
+
+    return JsonResponse({
+        'success': True,
+        'today': today.isoformat(),
+        'data_version': stats.data_version,
+        'months': [
+            {'year': y, 'month': m, 'weeks': serialize_calendar(calendars[(y, m)])}
+            for y, m in month_list
+        ]
+    })
 
-        # 计算新的预测
-        next_prediction_start = confirmed_start_date + timedelta(days=cycle_length)
-        next_prediction_end = next_prediction_start + timedelta(days=period_length - 1)
 
-        # 这里可以保存预测记录到数据库，用于历史跟踪
-        # 当前实现中，预测是实时计算的，所以不需要保存
+def prometheus_metrics(request):
+    """Prometheus文本格式的指标，需在Authorization头中携带Bearer METRICS_TOKEN；未配置令牌时一律拒绝"""
+    token = settings.METRICS_TOKEN
+    if not token or not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    except UserProfile.DoesNotExist:
-        # 用户没有基础信息，无法更新预测
-        pass
+
+@login_required
+def import_periods(request):
+    """批量导入历史经期记录（CSV/JSON/ICS文件），一次写入并只更新一次统计和预测"""
+    if request.method == 'POST':
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'success': False, 'message': '请选择要导入的文件'})
+
+        profile = user_profile(request.user)
+        if profile is None:
+            return JsonResponse({'success': False, 'message': '请先设置基础信息'})
+
+        import_format = request.POST.get('format') or detect_format(upload.name)
+        try:
+            rows = parse_records(upload.read(), import_format)
+            result = import_records(request.user, profile, rows)
+        except (ValueError, UnicodeDecodeError) as e:
+            return JsonResponse({'success': False, 'message': str(e)})
+
+        if result['errors']:
+            return JsonResponse({
+                'success': False,
+                'message': f"有{len(result['errors'])}条记录未通过校验，未导入任何记录",
+                'errors': result['errors']
+            })
+        return JsonResponse({
+            'success': True,
+            'message': f"成功导入{result['imported']}条记录，跳过{result['skipped']}条重复记录",
+            'imported': result['imported'],
+            'skipped': result['skipped']
+        })
+
+    return JsonResponse({'success': False, 'message': '无效请求'})
+
+
+@login_required
+def export_periods(request):
+    """流式导出用户的基础信息、全部记录和预测（?format=csv|json|ics），内存占用与历史长度无关"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'success': False, 'message': '不支持的导出格式'})
+
+    content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream_export(request.user, export_format), content_type=content_type)
+    filename = f"periods_{timezone.now():%Y%m%d}.{extension}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def update_predictions(user, confirmed_start_date):
+    """更新预测记录 - 当用户确认经期开始时调用"""
+    # 预测保存在PeriodPrediction中，由三阶段算法重新计算
+    return refresh_predictions(user)
 
 
 # 在views.py中找到预测相关函数，修改如下：
 
 @login_required
 def get_prediction_info(request):
-    """获取预测信息 - 修改为从经期结束日开始计算"""
+    """获取预测信息 - 读取已保存的三阶段预测结果"""
     if request.method == 'GET':
         try:
             user = request.user
-            profile = UserProfile.objects.get(user=user)
-
-            # 获取最近的经期记录
-            latest_records = PeriodRecord.objects.filter(
-                user=user,
-                is_deleted=False
-            ).order_by('-start_date')
+            profile = user_profile(user)
+            if profile is None:
+                return JsonResponse({'success': False, 'message': '请先设置基础信息'})
 
             predictions = []
-
-            if latest_records.exists():
-                # 获取最近的确认记录
-                confirmed_records = latest_records.filter(is_predicted=False)
-                if confirmed_records.exists():
-                    latest_confirmed = confirmed_records[0]
-                else:
-                    latest_confirmed = latest_records[0]
-
-                cycle_length = profile.cycle_length
-                period_length = profile.period_length
-
-                # 修改：从结束日期开始计算间隔
-                # 原逻辑：prediction_start = latest_confirmed.start_date + timedelta(days=cycle_length)
-                # 新逻辑：从经期结束日开始计算
-                prediction_start = latest_confirmed.end_date + timedelta(days=cycle_length)
-                prediction_end = prediction_start + timedelta(days=period_length - 1)
-
-                predictions.append({
-                    'cycle': 1,
-                    'start_date': prediction_start.strftime('%Y-%m-%d'),
-                    'end_date': prediction_end.strftime('%Y-%m-%d'),
-                    'is_current': True,
-                    'calculation_note': f"基于{latest_confirmed.end_date}结束 + {cycle_length}天间隔"
-                })
-
-                # 可以继续生成更多预测周期
-                for i in range(2, 4):  # 生成2-3个额外周期
-                    next_prediction_start = prediction_start + timedelta(days=cycle_length * (i - 1))
-                    next_prediction_end = next_prediction_start + timedelta(days=period_length - 1)
-
-                    predictions.append({
-                        'cycle': i,
-                        'start_date': next_prediction_start.strftime('%Y-%m-%d'),
-                        'end_date': next_prediction_end.strftime('%Y-%m-%d'),
-                        'is_current': False
-                    })
-
+            stored_predictions = get_stored_predictions(user, profile)
+
+            for prediction in stored_predictions:
+                item = {
+                    'cycle': prediction.cycle_index,
+                    'start_date': prediction.predicted_start.strftime('%Y-%m-%d'),
+                    'end_date': prediction.predicted_end.strftime('%Y-%m-%d'),
+                    'is_current': prediction.cycle_index == 1
+                }
+                if prediction.cycle_index == 1:
+                    reference_date = prediction.predicted_start - timedelta(days=prediction.cycle_length)
+                    item['calculation_note'] = f"基于{reference_date}结束 + {prediction.cycle_length}天间隔"
+                predictions.append(item)
+
+            first = stored_predictions[0] if stored_predictions else None
             return JsonResponse({
                 'success': True,
                 'predictions': predictions,
-                'cycle_length': profile.cycle_length,
+                'cycle_length': first.cycle_length if first else profile.cycle_length,
                 'period_length': profile.period_length,
-                'calculation_method': '从经期结束日开始计算间隔'
+                'calculation_method': first.method if first else '从经期结束日开始计算间隔'
             })
-        except UserProfile.DoesNotExist:
-            return JsonResponse({'success': False, 'message': '请先设置基础信息'})
         except Exception as e:
             return JsonResponse({'success': False, 'message': str(e)})
 
@@ -997,12 +1068,9 @@ def add_period_end(request):
                 # 方式2：通过开始日期查找最近的记录
                 start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
                 # 查找开始日期在最近30天内的记录
-                records = PeriodRecord.objects.filter(
-                    user=user,
-                    start_date__gte=start_date - timedelta(days=30),
-                    start_date__lte=start_date + timedelta(days=1),
-                    is_deleted=False
-                ).order_by('-start_date')
+                records = records_starting_between(
+                    user, start_date - timedelta(days=30), start_date + timedelta(days=1)
+                )
 
                 if records.exists():
                     record = records[0]  # 取最近的记录
@@ -1031,9 +1099,13 @@ def add_period_end(request):
                 })
 
             # 更新记录
+            old_start_date, old_is_predicted = record.start_date, record.is_predicted
             record.end_date = end_date
             record.is_predicted = False  # 标记为已确认
             record.save()
+            stats = record_updated(user, record, old_start_date, old_is_predicted)
+            evaluate_retraining(user, stats, 'add_period_end')
+            refresh_predictions(user, stats=stats)
 
             return JsonResponse({
                 'success': True,
@@ -1057,6 +1129,9 @@ def delete_period(request, record_id):
             record = PeriodRecord.objects.get(id=record_id, user=request.user)
             record.is_deleted = True
             record.save()
+            stats = record_updated(request.user, record, record.start_date, record.is_predicted)
+            evaluate_retraining(request.user, stats, 'delete_period')
+            refresh_predictions(request.user, stats=stats)
             return JsonResponse({'success': True, 'message': '记录删除成功'})
         except PeriodRecord.DoesNotExist:
             return JsonResponse({'success': False, 'message': '记录不存在'})
@@ -20,6 +20,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app01.middleware.ServerTimingMiddleware',  # 放在最前，统计完整的请求耗时
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,4 +79,63 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
-SESSION_COOKIE_AGE = 60 * 60 * 24 * 7
\ No newline at end of file
+SESSION_COOKIE_AGE = 60 * 60 * 24 * 7
+
+# GRU模型进程内缓存：最多缓存的用户模型数、缓存存活秒数
+GRU_MODEL_CACHE_SIZE = 32
+GRU_MODEL_CACHE_TTL = 60 * 60
+
+# export_gru_models --pack把用户模型按user_id取模打包进的分片文件数（改动后需重新打包）
+GRU_MODEL_SHARDS = 16
+
+# GRU模型在后台线程训练；设为False时在请求内同步训练（调试用）
+GRU_TRAINING_ASYNC = True
+
+# 重训练策略（app01.policy）：新增窗口数、上次预测误差天数达到阈值，或模型超过最大年龄时才重新训练；
+# 两次训练之间至少间隔GRU_RETRAIN_MIN_INTERVAL秒
+GRU_RETRAIN_MIN_NEW_SAMPLES = 3
+GRU_RETRAIN_ERROR_DAYS = 3
+GRU_RETRAIN_MIN_INTERVAL = 60 * 60
+GRU_RETRAIN_MAX_MODEL_AGE = 90 * 24 * 60 * 60
+# 重训练决定（TrainingDecision）的保留天数，由manage.py prune_training_decisions清理（可配合cron定期执行）
+GRU_DECISION_RETENTION_DAYS = 90
+
+# 进程内缓存（无需外部服务），用于缓存标记好的日历
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'periodai',
+    }
+}
+
+# 日历缓存存活秒数；缓存键包含用户数据版本，记录变化后旧缓存自然失效
+CALENDAR_CACHE_TTL = 60 * 60
+
+# 每次保存的预测周期数（约一年），超出范围的月份不显示预测
+FORECAST_CYCLES = 12
+
+# 日志：app01各模块使用logging.getLogger(__name__)，经队列由后台线程输出一行一条JSON
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'app01.log.JsonFormatter'},
+    },
+    'handlers': {
+        'background': {
+            '()': 'app01.log.BackgroundHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'app01': {
+            'handlers': ['background'],
+            'level': os.environ.get('APP01_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# 访问/metrics/（Prometheus文本格式）需携带的令牌：Authorization: Bearer <令牌>；为空时接口关闭
+# 不按客户端地址放行：部署在反向代理后时所有请求的REMOTE_ADDR都是代理的地址
+METRICS_TOKEN = os.environ.get('PERIODAI_METRICS_TOKEN', '')
\ No newline at end of file